@@ -0,0 +1,320 @@
+"""In-process stand-in for S3, used by the benchmarks so they need no network or AWS account.
+
+It answers API calls from botocore's before-send event, in place of the HTTP request, so the rest of botocore runs as
+it does against S3: request signing and the request-created, response-received and needs-retry events, retries and
+their hooks (e.g. ez_aws metrics and concurrency limits). The response bodies aren't serialized; the parsed response
+is handed to botocore's parser from before-parse instead. Every request sleeps for latency seconds, outside of any
+lock, so concurrency behaves like it does against a remote service. Only the operations ez_aws uses are implemented."""
+import bisect
+import collections
+import datetime
+import hashlib
+import io
+import itertools
+import random
+import threading
+import time
+import urllib.parse
+
+from botocore.awsrequest import AWSResponse
+from botocore.response import StreamingBody
+
+
+class FakeS3Error(Exception):
+    def __init__(self, status: int, code: str, message: str = ''):
+        super().__init__(code)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+class _EmptyRaw:
+    """raw body of the fake HTTP responses (the parsed response is handed over in before-parse)"""
+    def stream(self, **kwargs):
+        return iter([b''])
+
+
+class _Object:
+    def __init__(self, data: bytes, etag: str):
+        self.data = data
+        self.etag = etag
+        self.last_modified = datetime.datetime.now(datetime.timezone.utc)
+
+
+class FakeS3:
+    """holds buckets of objects in memory. Call attach(session) before making clients from a boto3 session,
+    then every S3 call of those clients is answered here. requests counts the calls per API operation,
+    and bytes_in / bytes_out count the object data received (uploads) and sent (downloads).
+    throttle_rate is the fraction of requests answered with 503 SlowDown instead, counted in throttled"""
+
+    def __init__(self, latency: float = 0.0, throttle_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.requests = collections.Counter()
+        self.throttled = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buckets = {} #name -> {'keys': sorted list of keys, 'objects': {key: _Object}}
+        self._uploads = {} #upload id -> (bucket, key, {part number: bytes})
+        self._upload_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._parsed = threading.local() #the parsed response of the request being answered by this thread
+
+    def attach(self, session) -> None:
+        """answers the S3 calls of every client made from session (a boto3.Session) from now on"""
+        session.events.register('before-parameter-build.s3', self._capture, unique_id='fake_s3_capture')
+        session.events.register_last('before-send.s3', self._respond, unique_id='fake_s3_respond')
+        session.events.register_first('before-parse.s3', self._hand_over, unique_id='fake_s3_hand_over')
+
+    def create_bucket(self, bucket: str) -> None:
+        with self._lock:
+            self._buckets.setdefault(bucket, {'keys': [], 'objects': {}})
+
+    def put(self, bucket: str, key: str, data: bytes) -> None:
+        """stores an object directly, without counting a request (for setting up benchmarks)"""
+        self._store(bucket, key, _Object(data, '"' + hashlib.md5(data).hexdigest() + '"'))
+
+    def delete(self, bucket: str, key: str) -> None:
+        """removes an object directly, without counting a request"""
+        with self._lock:
+            contents = self._bucket(bucket)
+            del contents['objects'][key]
+            contents['keys'].remove(key)
+
+    def total_size(self, bucket: str) -> int:
+        """the total size of the objects in bucket"""
+        with self._lock:
+            return sum(len(obj.data) for obj in self._bucket(bucket)['objects'].values())
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.throttled = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def _store(self, bucket: str, key: str, obj: _Object) -> None:
+        with self._lock:
+            contents = self._bucket(bucket)
+            if key not in contents['objects']:
+                bisect.insort(contents['keys'], key)
+            contents['objects'][key] = obj
+
+    def _bucket(self, bucket: str):
+        contents = self._buckets.get(bucket)
+        if contents == None:
+            raise FakeS3Error(404, 'NoSuchBucket', bucket)
+        return contents
+
+    def _object(self, bucket: str, key: str) -> _Object:
+        with self._lock:
+            obj = self._bucket(bucket)['objects'].get(key)
+        if obj == None:
+            raise FakeS3Error(404, 'NoSuchKey', key)
+        return obj
+
+    def _capture(self, params, model, context, **kwargs) -> None:
+        #kept in the context (not popped) for every attempt of the call, with where a body stream starts so retries resend it
+        body = params.get('Body')
+        context['fake_s3'] = (model.name, params, body.tell() if hasattr(body, 'seek') else None)
+
+    def _respond(self, request, **kwargs):
+        if 'fake_s3' not in request.context: #made by a client created before attach
+            return None
+        name, params, body_start = request.context['fake_s3']
+        with self._lock:
+            self.requests[name] += 1
+            throttled = self.throttle_rate and self._random.random() < self.throttle_rate
+            self.throttled += bool(throttled)
+        if self.latency:
+            time.sleep(self.latency)
+        handler = getattr(self, '_op_' + name, None)
+        try:
+            if throttled:
+                raise FakeS3Error(503, 'SlowDown', 'Please reduce your request rate.')
+            if handler == None:
+                raise FakeS3Error(501, 'NotImplemented', f"FakeS3 doesn't implement {name}")
+            if body_start != None:
+                params['Body'].seek(body_start)
+            parsed = handler(**params)
+            status = 200
+        except FakeS3Error as e:
+            status = e.status
+            #HEAD responses have no body, so S3 only returns the status code (which botocore's parser uses as the code)
+            parsed = {} if name.startswith('Head') else {'Error': {'Code': e.code, 'Message': e.message}}
+        headers = {'content-length': str(parsed['ContentLength'])} if 'Body' in parsed else {}
+        if 'ETag' in parsed:
+            headers['etag'] = parsed['ETag']
+        self._parsed.response = parsed
+        return AWSResponse(request.url, status, headers, _EmptyRaw())
+
+    def _hand_over(self, customized_response_dict, **kwargs) -> None:
+        parsed = getattr(self._parsed, 'response', None)
+        if parsed != None: #botocore parses the (empty) response, then updates it with this
+            self._parsed.response = None
+            customized_response_dict.update(parsed)
+
+    @staticmethod
+    def _read_body(body) -> bytes:
+        if body == None:
+            return b''
+        if isinstance(body, str):
+            return body.encode()
+        if isinstance(body, (bytes, bytearray)):
+            return bytes(body)
+        return body.read()
+
+    @staticmethod
+    def _range(range_header: str, size: int):
+        """returns (start, end) (end exclusive) of a 'bytes=a-b', 'bytes=a-' or 'bytes=-n' range"""
+        first, last = range_header.split('=', 1)[1].split('-')
+        if first == '':
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = size if last == '' else min(int(last) + 1, size)
+        if start >= size:
+            raise FakeS3Error(416, 'InvalidRange', range_header)
+        return start, end
+
+    @staticmethod
+    def _source(copy_source):
+        if isinstance(copy_source, str):
+            #botocore quotes the dictionary form into 'bucket/key' before the call is sent
+            bucket, key = urllib.parse.unquote(copy_source.lstrip('/')).split('/', 1)
+            return bucket, key
+        return copy_source['Bucket'], copy_source['Key']
+
+    def _op_ListBuckets(self, **params):
+        with self._lock:
+            names = sorted(self._buckets)
+        return {'Buckets': [{'Name': name} for name in names]}
+
+    def _op_HeadBucket(self, Bucket, **params):
+        with self._lock:
+            self._bucket(Bucket)
+        return {}
+
+    def _op_ListObjectsV2(self, Bucket, Prefix='', Delimiter=None, StartAfter=None, ContinuationToken=None, MaxKeys=1000, **params):
+        with self._lock:
+            contents = self._bucket(Bucket)
+            keys, objects = contents['keys'], contents['objects']
+            if ContinuationToken != None: #the next key to return
+                index = bisect.bisect_left(keys, ContinuationToken)
+            elif StartAfter:
+                index = bisect.bisect_right(keys, max(StartAfter, Prefix))
+            else:
+                index = bisect.bisect_left(keys, Prefix)
+
+            found, common_prefixes = [], []
+            while index < len(keys) and len(found) + len(common_prefixes) < MaxKeys:
+                key = keys[index]
+                if not key.startswith(Prefix):
+                    index = len(keys)
+                    break
+                if Delimiter:
+                    end = key.find(Delimiter, len(Prefix))
+                    if end != -1:
+                        common_prefix = key[:end + len(Delimiter)]
+                        if StartAfter == None or common_prefix > StartAfter:
+                            common_prefixes.append({'Prefix': common_prefix})
+                        index = bisect.bisect_left(keys, common_prefix + '\U0010ffff') #skip past everything under it
+                        continue
+                obj = objects[key]
+                found.append({'Key': key, 'Size': len(obj.data), 'ETag': obj.etag, 'LastModified': obj.last_modified,
+                              'StorageClass': 'STANDARD'})
+                index += 1
+            truncated = index < len(keys) and keys[index].startswith(Prefix)
+            response = {'IsTruncated': truncated, 'KeyCount': len(found) + len(common_prefixes), 'MaxKeys': MaxKeys, 'Prefix': Prefix}
+            if found:
+                response['Contents'] = found
+            if common_prefixes:
+                response['CommonPrefixes'] = common_prefixes
+            if truncated:
+                response['NextContinuationToken'] = keys[index]
+            return response
+
+    def _op_HeadObject(self, Bucket, Key, IfMatch=None, **params):
+        obj = self._object(Bucket, Key)
+        if IfMatch != None and IfMatch != obj.etag:
+            raise FakeS3Error(412, 'PreconditionFailed')
+        return {'ContentLength': len(obj.data), 'ETag': obj.etag, 'LastModified': obj.last_modified, 'ContentType': 'binary/octet-stream'}
+
+    def _op_GetObject(self, Bucket, Key, Range=None, IfMatch=None, **params):
+        obj = self._object(Bucket, Key)
+        if IfMatch != None and IfMatch != obj.etag:
+            raise FakeS3Error(412, 'PreconditionFailed')
+        size = len(obj.data)
+        response = {'ETag': obj.etag, 'LastModified': obj.last_modified, 'ContentType': 'binary/octet-stream'}
+        if Range != None:
+            start, end = self._range(Range, size)
+            response['ContentRange'] = f'bytes {start}-{end-1}/{size}'
+        else:
+            start, end = 0, size
+        data = obj.data[start:end]
+        with self._lock:
+            self.bytes_out += len(data)
+        response['ContentLength'] = len(data)
+        response['Body'] = StreamingBody(io.BytesIO(data), len(data))
+        return response
+
+    def _op_PutObject(self, Bucket, Key, Body=None, **params):
+        data = self._read_body(Body)
+        with self._lock:
+            self._bucket(Bucket)
+            self.bytes_in += len(data)
+        self.put(Bucket, Key, data)
+        return {'ETag': self._object(Bucket, Key).etag}
+
+    def _op_CopyObject(self, Bucket, Key, CopySource, **params):
+        source = self._object(*self._source(CopySource))
+        self._store(Bucket, Key, _Object(source.data, source.etag))
+        return {'CopyObjectResult': {'ETag': source.etag, 'LastModified': source.last_modified}}
+
+    def _op_CreateMultipartUpload(self, Bucket, Key, **params):
+        with self._lock:
+            self._bucket(Bucket)
+            upload_id = str(next(self._upload_ids))
+            self._uploads[upload_id] = (Bucket, Key, {})
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def _upload(self, upload_id: str):
+        upload = self._uploads.get(upload_id)
+        if upload == None:
+            raise FakeS3Error(404, 'NoSuchUpload', upload_id)
+        return upload
+
+    def _op_UploadPart(self, Bucket, Key, UploadId, PartNumber, Body=None, **params):
+        data = self._read_body(Body)
+        with self._lock:
+            self._upload(UploadId)[2][PartNumber] = data
+            self.bytes_in += len(data)
+        return {'ETag': '"' + hashlib.md5(data).hexdigest() + '"'}
+
+    def _op_UploadPartCopy(self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange=None, **params):
+        source = self._object(*self._source(CopySource))
+        data = source.data
+        if CopySourceRange != None:
+            start, end = self._range(CopySourceRange, len(data))
+            data = data[start:end]
+        with self._lock:
+            self._upload(UploadId)[2][PartNumber] = data
+        return {'CopyPartResult': {'ETag': '"' + hashlib.md5(data).hexdigest() + '"', 'LastModified': source.last_modified}}
+
+    def _op_CompleteMultipartUpload(self, Bucket, Key, UploadId, MultipartUpload=None, **params):
+        with self._lock:
+            parts = self._upload(UploadId)[2]
+            del self._uploads[UploadId]
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        data = b''.join(parts[number] for number in numbers)
+        digests = b''.join(hashlib.md5(parts[number]).digest() for number in numbers)
+        etag = f'"{hashlib.md5(digests).hexdigest()}-{len(numbers)}"'
+        self._store(Bucket, Key, _Object(data, etag))
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': etag}
+
+    def _op_AbortMultipartUpload(self, Bucket, Key, UploadId, **params):
+        with self._lock:
+            self._upload(UploadId)
+            del self._uploads[UploadId]
+        return {}
@@ -0,0 +1,212 @@
+"""Benchmarks for the hot paths of ez_aws, run against FakeS3 (see fake_s3.py), so they need no network or AWS account.
+
+    python benchmarks/run_benchmarks.py                      # run them all and compare with benchmarks/baselines.json
+    python benchmarks/run_benchmarks.py --save-baseline      # run them all and store the results as the new baselines
+    python benchmarks/run_benchmarks.py -k list_keys -k open # only the benchmarks whose names contain one of these
+    python benchmarks/run_benchmarks.py --throttle-rate 0.02 # answer 2% of the requests with 503 SlowDown
+
+Every benchmark reports its time, throughput and the number of requests it made, per API operation.
+Compared with a baseline made with the same settings, a benchmark regresses if it fails, does a different amount of work
+(e.g. lists fewer keys), makes more requests, or takes more than --tolerance longer. Baselines can't be saved from
+failing benchmarks, and a baseline that is an error counts as a regression. The exit status is 1 if anything regressed"""
+import argparse
+import gzip
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import boto3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ez_aws import AWS
+from fake_s3 import FakeS3
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+BUCKET = 'ez-aws-bench'
+MiB = 1024*1024
+
+
+def populate(fake: FakeS3, keys: int, large_mb: int) -> None:
+    """keys small csv files under keys/, spread over 100 sub-prefixes, plus large.bin and large.csv.gz"""
+    fake.create_bucket(BUCKET)
+    fake.create_bucket(BUCKET + '-copy')
+    for i in range(keys):
+        fake.put(BUCKET, f'keys/{i % 100:02d}/{i:08d}.csv', b'id,name,value\n%d,row,%d\n' % (i, i*7))
+
+    large = os.urandom(MiB) * large_mb #random, but cheap to make
+    fake.put(BUCKET, 'large.bin', large)
+    rows = b''.join(b'%d,name_%d,%d\n' % (i, i % 1000, i*31) for i in range(large_mb * MiB // 20))
+    fake.put(BUCKET, 'large.csv.gz', gzip.compress(b'id,name,value\n' + rows, compresslevel=6))
+
+
+#each benchmark takes (aws, context) and returns (amount of work done, unit). context has the 'scratch' directory,
+#the number of 'objects' in the bucket and their total size in 'bucket_bytes', the size of the large objects in 'large_mb'
+#and the path of the large file to 'upload'
+
+def bench_list_keys_serial(aws: AWS, context: dict):
+    return len(aws.list_keys(BUCKET, 'keys/', max_workers=1)), 'keys'
+
+def bench_list_keys_parallel(aws: AWS, context: dict):
+    return len(aws.list_keys(BUCKET, 'keys/', max_workers=16)), 'keys'
+
+def bench_get_bucket_size(aws: AWS, context: dict):
+    size = aws.get_bucket_size(BUCKET, max_workers=16)
+    if size != context['bucket_bytes']:
+        raise AssertionError(f"get_bucket_size returned {size}, not {context['bucket_bytes']}")
+    return context['objects'], 'keys'
+
+def bench_get_file_index(aws: AWS, context: dict):
+    fout = io.StringIO()
+    aws.get_file_index(BUCKET, 'keys/', fout=fout, max_workers=16, keep_index=False)
+    return fout.getvalue().count('\n') - 1, 'keys'
+
+def bench_get_file_index_column_names(aws: AWS, context: dict):
+    fout = io.StringIO()
+    aws.get_file_index(BUCKET, 'keys/0', fout=fout, get_column_names=True, max_workers=16, keep_index=False)
+    return fout.getvalue().count('\n') - 1, 'keys'
+
+def read_all(file) -> int:
+    total = 0
+    with file:
+        while True:
+            chunk = file.read(MiB)
+            if not chunk:
+                return total
+            total += len(chunk)
+
+def bench_open_sequential(aws: AWS, context: dict):
+    return read_all(aws.open(BUCKET, 'large.bin')) / MiB, 'MiB'
+
+def bench_open_sequential_block_cache(aws: AWS, context: dict):
+    return read_all(aws.open(BUCKET, 'large.bin', block_cache=True)) / MiB, 'MiB'
+
+def bench_open_gzip(aws: AWS, context: dict):
+    return read_all(aws.open(BUCKET, 'large.csv.gz', decompress=True)) / MiB, 'MiB'
+
+def bench_open_gzip_block_cache(aws: AWS, context: dict):
+    return read_all(aws.open(BUCKET, 'large.csv.gz', decompress=True, block_cache=True)) / MiB, 'MiB'
+
+def bench_download(aws: AWS, context: dict):
+    path = os.path.join(context['scratch'], 'large.bin')
+    aws.download(BUCKET, 'large.bin', path)
+    return os.path.getsize(path) / MiB, 'MiB'
+
+def bench_upload(aws: AWS, context: dict):
+    aws.upload(BUCKET, 'uploaded.bin', context['upload'])
+    return os.path.getsize(context['upload']) / MiB, 'MiB'
+
+def bench_copy_within_aws(aws: AWS, context: dict):
+    aws.copy_within_aws(BUCKET, BUCKET + '-copy', 'large.bin')
+    return context['large_mb'], 'MiB'
+
+
+BENCHMARKS = [(name[len('bench_'):], function) for name, function in list(globals().items()) if name.startswith('bench_')]
+
+
+def run(names, settings: dict) -> dict:
+    fake = FakeS3(latency=settings['latency_ms'] / 1000, throttle_rate=settings.get('throttle_rate', 0.0))
+    populate(fake, settings['keys'], settings['large_mb'])
+    session = boto3.Session(aws_access_key_id='fake', aws_secret_access_key='fake', region_name='us-east-1')
+    fake.attach(session)
+    aws = AWS(session=session)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        context = {'scratch': scratch, 'objects': settings['keys'] + 2, 'bucket_bytes': fake.total_size(BUCKET),
+                   'large_mb': settings['large_mb'], 'upload': os.path.join(scratch, 'upload.bin')}
+        with open(context['upload'], 'wb') as fout:
+            fout.write(os.urandom(MiB) * settings['large_mb'])
+
+        for name, function in BENCHMARKS:
+            if names and not any(pattern in name for pattern in names):
+                continue
+            fake.reset_counters()
+            start = time.perf_counter()
+            try:
+                amount, unit = function(aws, context)
+            except Exception as e: #e.g. a missing optional dependency; report it and keep going
+                results[name] = {'error': f'{type(e).__name__}: {e}'}
+                print(f'{name:36} ERROR {results[name]["error"]}')
+                continue
+            seconds = time.perf_counter() - start
+            results[name] = {'seconds': round(seconds, 4), 'amount': amount, 'unit': unit,
+                             'throughput': round(amount / seconds, 2), 'requests': sum(fake.requests.values()),
+                             'requests_by_api': dict(sorted(fake.requests.items())),
+                             'bytes_in': fake.bytes_in, 'bytes_out': fake.bytes_out}
+            print(f'{name:36} {seconds:8.3f}s {amount / seconds:12.1f} {unit}/s {results[name]["requests"]:8} requests')
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """returns a list of regression messages"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if 'error' in result:
+            regressions.append(f'{name}: fails with {result["error"]}')
+            continue
+        if previous == None:
+            continue
+        if 'error' in previous: #nothing to compare with, so it must not pass silently
+            regressions.append(f'{name}: the baseline is an error ({previous["error"]}), re-save the baselines')
+            continue
+        if result['amount'] != previous['amount']:
+            regressions.append(f'{name}: did {result["amount"]} {result["unit"]} of work, not {previous["amount"]}')
+        if result['requests'] > previous['requests']:
+            regressions.append(f'{name}: {result["requests"]} requests, up from {previous["requests"]}')
+        if result['seconds'] > previous['seconds'] * (1 + tolerance):
+            regressions.append(f'{name}: {result["seconds"]:.3f}s, up from {previous["seconds"]:.3f}s')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', dest='names', action='append', default=[], help='only run benchmarks whose names contain this')
+    parser.add_argument('--keys', type=int, default=100000, help='number of small objects to list and index')
+    parser.add_argument('--large-mb', type=int, default=64, help='size of the large objects that are read, downloaded, uploaded and copied')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='latency added to every request')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests answered with 503 SlowDown (retried by botocore)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='fraction a benchmark may slow down before it counts as a regression')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file to compare with (or save to)')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baselines instead of comparing')
+    args = parser.parse_args()
+
+    settings = {'keys': args.keys, 'large_mb': args.large_mb, 'latency_ms': args.latency_ms}
+    if args.throttle_rate:
+        settings['throttle_rate'] = args.throttle_rate
+    print(f'settings: {settings}')
+    results = run(args.names, settings)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fin:
+            baselines = json.load(fin)
+
+    if args.save_baseline:
+        failed = [name for name, result in results.items() if 'error' in result]
+        if failed:
+            print(f'not saving baselines, these benchmarks failed: {", ".join(failed)}')
+            return 1
+        baseline = baselines.get('results', {}) if baselines.get('settings') == settings else {}
+        baseline.update(results)
+        with open(args.baseline, 'w') as fout:
+            json.dump({'settings': settings, 'python': platform.python_version(), 'results': baseline}, fout, indent=2, sort_keys=True)
+            fout.write('\n')
+        print(f'saved baselines to {args.baseline}')
+        return 0
+
+    if baselines.get('settings') != settings:
+        print('no baselines with these settings to compare with (run with --save-baseline to make them)')
+        return 0
+    regressions = compare(results, baselines['results'], args.tolerance)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
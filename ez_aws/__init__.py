@@ -1 +1,13 @@
-from .ez_aws import AWS
\ No newline at end of file
+from .ez_aws import AWS
+from .metadata_cache import MetadataCache
+from .metrics import MetricsCollector
+from .object_index import ObjectIndex
+
+__all__ = ['AWS', 'MetadataCache', 'MetricsCollector', 'ObjectIndex', 'AsyncAWS', 'AsyncReader']
+
+def __getattr__(name):
+    #AsyncAWS pulls in asyncio, so it's only imported when it's first used
+    if name in ('AsyncAWS', 'AsyncReader'):
+        from . import async_aws
+        return getattr(async_aws, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
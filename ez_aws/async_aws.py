@@ -0,0 +1,134 @@
+import asyncio
+import functools
+import itertools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import List, Dict, AsyncIterator, Iterator
+
+from .ez_aws import AWS
+
+
+class AsyncAWS:
+    """asyncio front end for AWS.
+
+    Every blocking call runs on one thread pool of max_threads threads, and at most max_concurrency calls are
+    scheduled on it at a time, so thousands of object operations can be awaited from one event loop
+    (e.g. with asyncio.gather) without spawning thousands of threads or queueing unbounded work"""
+
+    def __init__(self, aws: AWS = None, *, max_concurrency: int = 64, max_threads: int = 32, **aws_kwargs):
+        """aws is an existing AWS to wrap, sharing its session and clients.
+        Otherwise one is made from aws_kwargs, which are the same as for AWS.__init__ (session, access_key, secret_key, region...),
+        so credentials are resolved the same way"""
+        self.aws = aws if aws != None else AWS(**aws_kwargs)
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='ez_aws_async')
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        """the semaphore bounding calls from the running event loop (semaphores can't be shared between loops)"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore == None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _run(self, function, *args, **kwargs):
+        """runs function(*args, **kwargs) on the thread pool once there's room under max_concurrency"""
+        async with self._semaphore():
+            return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def _iterate(self, iterator: Iterator, batch_size: int = 1000) -> AsyncIterator:
+        """turns a blocking iterator into an async one, pulling batch_size items per trip to the thread pool"""
+        try:
+            while True:
+                batch = await self._run(lambda: list(itertools.islice(iterator, batch_size)))
+                if not batch:
+                    return
+                for item in batch:
+                    yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                try:
+                    await asyncio.get_running_loop().run_in_executor(self._executor, iterator.close)
+                except RuntimeError: #the pool was already shut down, e.g. an abandoned async for finalized after aclose()
+                    iterator.close()
+
+    async def list_keys(self, bucket_name: str, prefix : str = "", requester_pays=False, max_workers : int = 1) -> List[str]:
+        """async version of AWS.list_keys"""
+        return await self._run(self.aws.list_keys, bucket_name, prefix, requester_pays=requester_pays, max_workers=max_workers)
+
+    def iter_keys(self, bucket_name: str, prefix : str = "", requester_pays=False, max_workers : int = 1) -> AsyncIterator[str]:
+        """async version of AWS.iter_keys, for use with async for"""
+        return self._iterate(self.aws.iter_keys(bucket_name, prefix, requester_pays=requester_pays, max_workers=max_workers))
+
+    def iter_objects(self, bucket_name: str, prefix : str = "", requester_pays=False, max_workers : int = 1) -> AsyncIterator[Dict]:
+        """async version of AWS.iter_objects, for use with async for"""
+        return self._iterate(self.aws.iter_objects(bucket_name, prefix, requester_pays=requester_pays, max_workers=max_workers))
+
+    async def get_key_index(self, bucket: str, key: str, get_column_names=False, RequestPayer : str = 'bucketowner') -> Dict:
+        """async version of AWS.get_key_index"""
+        return await self._run(self.aws.get_key_index, bucket, key, get_column_names=get_column_names, RequestPayer=RequestPayer)
+
+    async def get_column_names(self, bucket_name: str, key: str, requester_pays = False) -> List[str]:
+        """async version of AWS.get_column_names"""
+        return await self._run(self.aws.get_column_names, bucket_name, key, requester_pays=requester_pays)
+
+    async def download(self, bucket_name : str, key : str, save_location : str, requester_pays=False, **kwargs) -> None:
+        """async version of AWS.download (kwargs are its part_size, max_workers and verify_md5)"""
+        return await self._run(self.aws.download, bucket_name, key, save_location, requester_pays=requester_pays, **kwargs)
+
+    async def upload(self, bucket_name : str, key: str, local_file_location: str) -> None:
+        """async version of AWS.upload"""
+        return await self._run(self.aws.upload, bucket_name, key, local_file_location)
+
+    async def open(self, bucket_name: str, key: str, requester_pays=False, mode='rb', decompress=False, encoding=None, **kwargs) -> 'AsyncReader':
+        """async version of AWS.open, for reading: returns an AsyncReader, whose read/readline are awaitable.
+        Use it as `async with await aws.open(...) as fin:`"""
+        if mode not in ['rb', 'r']:
+            raise ValueError("AsyncAWS.open() only accepts the following modes: ", ['rb', 'r'])
+        file = await self._run(self.aws.open, bucket_name, key, requester_pays=requester_pays, mode=mode,
+                               decompress=decompress, encoding=encoding, **kwargs)
+        return AsyncReader(self, file)
+
+    async def aclose(self) -> None:
+        """shuts down the thread pool, after the calls already running finish"""
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+
+class AsyncReader:
+    """readable stream returned by AsyncAWS.open. Each read runs on the AsyncAWS thread pool"""
+
+    def __init__(self, owner: AsyncAWS, file):
+        self._owner = owner
+        self._file = file
+
+    async def read(self, size: int = -1):
+        return await self._owner._run(self._file.read, size)
+
+    async def readline(self):
+        return await self._owner._run(self._file.readline)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        line = await self.readline()
+        if not line:
+            raise StopAsyncIteration
+        return line
+
+    async def close(self) -> None:
+        await self._owner._run(self._file.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
@@ -0,0 +1,116 @@
+import threading
+
+from typing import Dict
+
+from .metrics import THROTTLE_CODES
+
+
+class AdaptiveLimiter:
+    """AIMD limit on the number of requests in flight: a throttled response (SlowDown/503 and the like) multiplies the limit
+    by decrease_factor, and every successful one grows it by 1/limit, so it grows back by about one request per round trip.
+    Only throttles of requests sent after the last decrease count, so one overload halves the limit once, not once per
+    request that was already in flight. The limit stays between min_limit and max_limit"""
+
+    def __init__(self, max_limit: int = 64, min_limit: int = 1, decrease_factor: float = 0.5):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.throttles = 0
+        self.successes = 0
+        self.decreases = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> int:
+        """waits until there's room under the limit for another request. Returns the token to release it with"""
+        with self._condition:
+            while self.in_flight >= max(int(self.limit), self.min_limit):
+                self._condition.wait()
+            self.in_flight += 1
+            return self.decreases
+
+    def release(self, token: int, throttled=False) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                if token == self.decreases: #sent under the current limit
+                    self.limit = max(self.limit * self.decrease_factor, float(self.min_limit))
+                    self.decreases += 1
+            else:
+                self.successes += 1
+                self.limit = min(self.limit + 1/self.limit, float(self.max_limit))
+            self._condition.notify_all()
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {'limit': self.limit, 'in_flight': self.in_flight, 'throttles': self.throttles, 'successes': self.successes,
+                    'decreases': self.decreases}
+
+
+class ConcurrencyController:
+    """Keeps one AdaptiveLimiter per bucket and top-level prefix (the part of the key before the first '/', or '' for keys
+    without one), shared by every thread and every bulk operation of an AWS, since S3 throttles by prefix, not per thread.
+
+    It's applied through botocore event hooks on the S3 clients (see attach), so every request waits for room under the
+    limiter of the object it's for. Each attempt holds its slot only while it's being sent, not while botocore backs off
+    between retries"""
+
+    def __init__(self, max_limit: int = 64, min_limit: int = 1, decrease_factor: float = 0.5):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, bucket_name: str, key: str = '') -> AdaptiveLimiter:
+        """returns the limiter for the prefix of key (or of a listing prefix) in bucket_name"""
+        partition = (bucket_name, key.split('/', 1)[0] if '/' in key else '')
+        limiter = self._limiters.get(partition)
+        if limiter == None:
+            with self._lock:
+                limiter = self._limiters.get(partition)
+                if limiter == None:
+                    limiter = self._limiters[partition] = AdaptiveLimiter(self.max_limit, self.min_limit, self.decrease_factor)
+        return limiter
+
+    def attach(self, client) -> None:
+        """registers the hooks on a botocore S3 client"""
+        events = client.meta.events
+        events.register('before-parameter-build.s3', self._pick_limiter, unique_id='ez_aws_concurrency_pick')
+        events.register('request-created.s3', self._acquire, unique_id='ez_aws_concurrency_acquire')
+        events.register('response-received.s3', self._release, unique_id='ez_aws_concurrency_release')
+        events.register('after-call.s3', self._release_leftover, unique_id='ez_aws_concurrency_after_call')
+        events.register('after-call-error.s3', self._release_leftover, unique_id='ez_aws_concurrency_after_call_error')
+
+    def _pick_limiter(self, params: Dict, context: Dict, **kwargs) -> None:
+        bucket_name = params.get('Bucket')
+        if isinstance(bucket_name, str):
+            context['ez_aws_limiter'] = self.limiter(bucket_name, params.get('Key') or params.get('Prefix') or '')
+
+    def _acquire(self, request, **kwargs) -> None:
+        context = getattr(request, 'context', None)
+        if context == None or 'ez_aws_limiter' not in context or context.get('ez_aws_limiter_token') != None:
+            return
+        context['ez_aws_limiter_token'] = context['ez_aws_limiter'].acquire()
+
+    def _release(self, context: Dict, parsed_response: Dict = None, response_dict: Dict = None, **kwargs) -> None:
+        token = context.pop('ez_aws_limiter_token', None)
+        if token == None:
+            return
+        code = parsed_response.get('Error', {}).get('Code') if parsed_response else None
+        status = response_dict.get('status_code') if response_dict else None
+        context['ez_aws_limiter'].release(token, throttled = status == 503 or code in THROTTLE_CODES)
+
+    def _release_leftover(self, context: Dict, **kwargs) -> None:
+        """in case an attempt failed in a way that skipped response-received"""
+        token = context.pop('ez_aws_limiter_token', None)
+        if token != None:
+            context['ez_aws_limiter'].release(token)
+
+    def stats(self) -> Dict:
+        """returns {(bucket, prefix): limiter stats} for every limiter made so far"""
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {partition: limiter.stats() for partition, limiter in sorted(limiters.items())}
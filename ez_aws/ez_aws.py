@@ -1,105 +1,529 @@
-import boto3, botocore
-import smart_open.s3 as sos3
-#import smart_open
+#boto3, botocore, smart_open, so7z and urllib.request are imported where they're first used, so importing ez_aws and making an AWS() stay fast
 import csv
+import datetime
 import gzip
+import heapq
 import io
+import hashlib
+import json
+import math
+import os
+import time
+import zlib
+import collections
+import contextvars
+import functools
+import inspect
+import logging
+import queue
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
 
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING: #only for the annotations, so the lazy imports stay lazy
+    import boto3
+    import botocore.config
+    import so7z
 
-import requests #for http querying
 import pathlib
 
-try:
-    import so7z
-    success_so7z = True
-except ImportError as e:
-    print("Warning: Failed to import so7z, so ez_aws will not load the functions that depend on it.")
-    print("Note that, for unknown reasons, so7z will not import properly in IPython/Jupyter even when it loads properly in the interpreter.")
-    print("The rest of ez_aws will continue to work as normal")
-    print("Official error message below:\n")
-    print(e)
-    success_so7z = False
+from .metadata_cache import MetadataCache
+from .object_index import ObjectIndex
+from .streams import BlockReader, MultipartWriter, MultipartTextWriter
+from .metrics import MetricsCollector, ContextThreadPoolExecutor, current_operation
+from .concurrency import ConcurrencyController
+
+logger = logging.getLogger(__name__)
+
+#character classes used to pick StartAfter boundaries when splitting a flat key range into listing shards
+_SHARD_ALPHABETS = ('0123456789', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz', '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
+
+def _prefetch(iterable: Iterable, depth: int = 1) -> Iterator:
+    """yields the items of iterable while a background thread fetches up to depth items ahead.
+    Exceptions raised by iterable are re-raised in the consumer, and closing the generator stops the producer"""
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error != None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def _ordered_map(function, iterable: Iterable, max_workers: int, max_in_flight: int = None, pool: ThreadPoolExecutor = None) -> Iterator:
+    """like ThreadPoolExecutor.map, but lazy: at most max_in_flight calls (default 2*max_workers) are submitted
+    ahead of the consumer, so huge iterables never pile up in memory. Results are yielded in input order.
+    If pool is given, the calls are run on it (and it is left running), instead of on a new pool of max_workers threads"""
+    if max_workers <= 1 and pool == None:
+        yield from map(function, iterable)
+        return
+    if max_in_flight == None:
+        max_in_flight = 2*max_workers
+
+    own_pool = pool == None
+    if own_pool:
+        pool = ContextThreadPoolExecutor(max_workers=max_workers)
+    window = collections.deque()
+    try:
+        for item in iterable:
+            window.append(pool.submit(function, item))
+            if len(window) >= max_in_flight:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+    finally:
+        for future in window:
+            future.cancel()
+        if own_pool:
+            pool.shutdown(wait=True)
+
+
+def _instrumented(function):
+    """groups the API calls made by an AWS method under its name in the metrics (see MetricsCollector).
+    Calls made from inside another instrumented method count for the outer one. Does nothing if metrics are off"""
+    name = function.__name__
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            generator = function(self, *args, **kwargs)
+            if self.metrics == None or current_operation.get() != None:
+                return generator
+            context = contextvars.copy_context()
+            context.run(current_operation.set, name)
+            return _run_in_context(context, generator)
+    else:
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            if self.metrics == None or current_operation.get() != None:
+                return function(self, *args, **kwargs)
+            token = current_operation.set(name)
+            try:
+                return function(self, *args, **kwargs)
+            finally:
+                current_operation.reset(token)
+    return wrapper
+
+
+def _run_in_context(context: contextvars.Context, generator: Iterator) -> Iterator:
+    """yields from generator, running each step of it in context (since a generator runs in the context of whoever consumes it)"""
+    try:
+        while True:
+            try:
+                item = context.run(next, generator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        context.run(generator.close)
+
+
+#set while select_rows makes a requester pays select_object_content call, which has no RequestPayer parameter
+_select_request_payer = contextvars.ContextVar('ez_aws_select_request_payer', default=False)
+
+def _add_request_payer_header(request, **kwargs) -> None:
+    if _select_request_payer.get():
+        request.headers['x-amz-request-payer'] = 'requester'
+
+
+def _first_line_end(data: bytes) -> int:
+    """returns the index of the newline that ends the first csv record in data, or None if it isn't complete yet.
+    Newlines inside quoted fields are skipped"""
+    position = data.find(b'\n')
+    while position != -1:
+        if data.count(b'"', 0, position) % 2 == 0:
+            return position
+        position = data.find(b'\n', position+1)
+    return None
+
+
+def _pwrite(fd: int, data: bytes, offset: int) -> None:
+    """writes all of data at offset in the file, without moving the file position (so threads can write different parts at once).
+    Falls back to a locked seek and write on platforms without os.pwrite (i.e. Windows)"""
+    data = memoryview(data)
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        with _pwrite_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while data:
+                data = data[os.write(fd, data):]
+
+_pwrite_lock = threading.Lock()
+
+
+class _DownloadJob:
+    """state of one file being downloaded in parts by AWS._download_objects"""
+
+    def __init__(self, key: str, path: str, size: int = None, etag: str = None):
+        self.key = key
+        self.path = path
+        self.temporary_path = path + '.ez_aws_download'
+        self.size = size
+        self.etag = etag
+        self.first_part = None #bytes already fetched while finding out the size
+        self.skipped = False
+        self.error = None
+        self.fd = None
+        self.remaining = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+
+_IMDS_URL = 'http://169.254.169.254/latest/'
+_imds_lock = threading.Lock()
+_imds_token = {'value': None, 'expires': 0.0, 'unavailable': False}
+_imds_values = {}
+
+def _imds_get(path: str, timeout: float = 1.0) -> str:
+    """returns the text of an EC2 instance metadata path (e.g. 'meta-data/placement/region'), or None if it can't be read
+    (e.g. because this isn't an EC2 instance). Uses an IMDSv2 session token, and every value is memoized for the
+    life of the process, so off EC2 only the first call waits (at most timeout seconds)"""
+    if os.environ.get('AWS_EC2_METADATA_DISABLED', '').lower() == 'true':
+        return None
+    import urllib.request
+    with _imds_lock:
+        if path in _imds_values:
+            return _imds_values[path]
+        if _imds_token['unavailable']:
+            return None
+        try:
+            if _imds_token['expires'] < time.time():
+                request = urllib.request.Request(_IMDS_URL + 'api/token', method='PUT',
+                                                 headers={'X-aws-ec2-metadata-token-ttl-seconds': '21600'})
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    _imds_token['value'] = response.read().decode()
+                    _imds_token['expires'] = time.time() + 21000
+            request = urllib.request.Request(_IMDS_URL + path, headers={'X-aws-ec2-metadata-token': _imds_token['value']})
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                _imds_values[path] = response.read().decode()
+        except OSError:
+            if _imds_token['value'] == None: #the token itself failed, so there's no metadata service to ask again
+                _imds_token['unavailable'] = True
+            return None
+        return _imds_values[path]
+
+def _instance_region(cache_path: str = None) -> str:
+    """returns the region of the EC2 instance this is running on, or None.
+    If cache_path is given, the region is also saved to that file, and read from it instead of the metadata service next time"""
+    if cache_path != None and os.path.exists(cache_path):
+        with open(cache_path) as fin:
+            return fin.read().strip() or None
+    region = _imds_get('meta-data/placement/region')
+    if cache_path != None and region != None:
+        with open(cache_path, 'w') as fout:
+            fout.write(region)
+    return region
 
 
 class AWS:
     """Wrapper class for boto3 that simplifies a lot of processes we have to do repeatedly"""
 
-    def __init__(self, *, session : boto3.session = None, 
+    def __init__(self, *, session : 'boto3.Session' = None, 
                 access_key :str = None, secret_key :str = None, region: str = None, 
                 credential_file_path: str = None,
-                cache_clients = False):
+                cache_clients = False, metadata_cache: MetadataCache = None,
+                max_pool_connections: int = 64, client_config: 'botocore.config.Config' = None,
+                region_cache_path: str = None, bucket_access_ttl: float = 300, metrics: MetricsCollector = None,
+                adaptive_concurrency = True, ec2_cache_ttl: float = 30):
         """Constructor provides multiple methods for establishing the boto3 session that will be re-used repeatedly:
         1. If none of these parameters are entered, it will use session.get_credentials() by default
         Then, in order of precedence, will use the following
             specific boto3 session
             access key + secret_key
-            credential_file_path pointing to a .csv file with the necessary credentials"""
+            credential_file_path pointing to a .csv file with the necessary credentials
+
+        The session is only made when it's first needed. If it has no region by then, the region of the EC2 instance
+        this is running on is used (from the instance metadata, with a short timeout, memoized per process and,
+        if region_cache_path is given, on disk)
+
+        bucket_access_ttl is how many seconds the results of get_bucket_access are cached for,
+        and ec2_cache_ttl how many seconds the instances found by list_instances and get_instances are
+
+        metrics is an optional MetricsCollector, which records the requests, bytes, latency, retries and throttles
+        of every API call made by the clients and resources of this AWS, grouped by AWS method
+
+        If adaptive_concurrency is true, S3 requests go through a shared ConcurrencyController: the number of requests in flight
+        to each bucket and top-level prefix shrinks when S3 throttles them (SlowDown/503) and grows back as they succeed,
+        up to max_pool_connections, so bulk operations can use a generous max_workers without hammering a hot prefix
 
-        if session != None:
-            self.session=session
-        elif access_key != None and secret_key != None:
-            self.session = boto3.Session(
+        metadata_cache is an optional MetadataCache, used to skip re-reading the column names of unchanged objects
+
+        Clients and resources are created lazily, the first time they're needed (see get_client and get_resource).
+        They use a botocore Config with max_pool_connections connections per client and 'standard' retries,
+        merged with client_config if given (e.g. for timeouts). If cache_clients=True, the s3, iam and ec2 ones are created right away"""
+
+        self._session = session
+        self._session_args = {'access_key': access_key, 'secret_key': secret_key, 'region': region, 'credential_file_path': credential_file_path}
+        self._region_cache_path = region_cache_path
+        self._client_config_args = (max_pool_connections, client_config)
+        self._client_config = None
+        self._clients = {}
+        self._client_lock = threading.RLock()
+        self._thread_resources = threading.local()
+        self.metadata_cache = metadata_cache
+        self.metrics = metrics
+        self.concurrency = ConcurrencyController(max_limit=max_pool_connections) if adaptive_concurrency else None
+        self.bucket_access_ttl = bucket_access_ttl
+        self._bucket_access = {} #bucket -> (expiry time, access)
+        self._bucket_access_lock = threading.Lock()
+        self._select_unavailable = set() #buckets where select_object_content isn't allowed
+        self.ec2_cache_ttl = ec2_cache_ttl
+        self._ec2_cache = {} #('filters', region, filters) or ('instance', region, id) -> (expiry time, result)
+        self._ec2_cache_lock = threading.Lock()
+
+        #caching the various clients and resources for speed later on
+        if cache_clients:
+            for service in ['s3', 'iam', 'ec2']:
+                self.get_client(service)
+            for service in ['s3', 'ec2']:
+                self.get_resource(service)
+
+    @property
+    def session(self) -> 'boto3.Session':
+        """the boto3 session, made the first time it's used (see __init__)"""
+        if self._session == None:
+            with self._client_lock:
+                if self._session == None:
+                    self._session = self._create_session(**self._session_args)
+        return self._session
+
+    @session.setter
+    def session(self, session: 'boto3.Session'):
+        self._session = session
+
+    def _create_session(self, access_key: str = None, secret_key: str = None, region: str = None,
+                        credential_file_path: str = None) -> 'boto3.Session':
+        import boto3
+        if access_key != None and secret_key != None:
+            session = boto3.Session(
                 aws_access_key_id = access_key,
                 aws_secret_access_key=secret_key,
                 region_name = region
             )
         elif credential_file_path != None:
-            creds = csv.DictReader(open(credential_file_path))
-            for row in creds:
-                self.session = boto3.Session(
-                    aws_access_key_id=row['Access key ID'],
-                    aws_secret_access_key=row['Secret access key'],
-                    region_name = region
-                )
+            with open(credential_file_path) as fin:
+                creds = csv.DictReader(fin)
+                for row in creds:
+                    session = boto3.Session(
+                        aws_access_key_id=row['Access key ID'],
+                        aws_secret_access_key=row['Secret access key'],
+                        region_name = region
+                    )
         else: 
-            self.session = boto3.Session(region_name = region)
+            session = boto3.Session(region_name = region)
         
         #establishing region, in case it isn't established yet (such as for EC2 instance)
-        if self.session.region_name ==None:
-            try:
-                response = requests.get('http://169.254.169.254/latest/meta-data/placement/region') #gets region from within EC2 instnace
-                if response.status_code == 200:  #successful
-                    cur_instance_region = response.text
-                    self.session = boto3.Session(region_name = cur_instance_region)
-            except:
-                print("No region specified by user, and could not pull from EC2 instance profile")
-            
-        #caching the various clients and resources for speed later on
-        if cache_clients:
-            self.s3_client = self.session.client('s3')
-            self.s3_resources = self.session.resource('s3')
-            self.iam_client = self.session.client('iam')
-            self.ec2_client = self.session.client('ec2')
-            self.ec2_resources = self.session.resource('ec2')
-        else:
-            self.s3_client = None
-            self.s3_resources = None
-            self.iam_client=None
-            self.ec2_client=None
-            self.ec2_resources= None
+        if session.region_name ==None:
+            cur_instance_region = _instance_region(self._region_cache_path)
+            if cur_instance_region != None:
+                session._session.set_config_variable('region', cur_instance_region) #keeps the credentials, unlike a new session
+            else:
+                logger.warning("No region specified by user, and could not pull from EC2 instance profile")
+        return session
+
+    @property
+    def client_config(self) -> 'botocore.config.Config':
+        """the botocore Config every client and resource is made with (see __init__)"""
+        if self._client_config == None:
+            import botocore.config
+            max_pool_connections, client_config = self._client_config_args
+            config = botocore.config.Config(max_pool_connections=max_pool_connections, retries={'mode': 'standard', 'max_attempts': 10})
+            if client_config != None:
+                config = config.merge(client_config)
+            self._client_config = config
+        return self._client_config
+
+    def get_client(self, service: str, region_name: str = None):
+        """returns the boto3 client for service (in region_name, if given), creating it the first time.
+        Clients are thread-safe, so each one is shared by every thread (along with its connection pool)"""
+        client = self._clients.get((service, region_name))
+        if client == None:
+            with self._client_lock: #creating clients from one session isn't thread-safe
+                client = self._clients.get((service, region_name))
+                if client == None:
+                    client = self.session.client(service, region_name=region_name, config=self.client_config)
+                    if self.metrics != None:
+                        self.metrics.attach(client)
+                    if self.concurrency != None and service == 's3':
+                        self.concurrency.attach(client)
+                    self._clients[(service, region_name)] = client
+        return client
+
+    def get_resource(self, service: str):
+        """returns the boto3 resource for service, creating it the first time it's used in this thread.
+        Resources aren't thread-safe, so each thread gets its own"""
+        resources = self._thread_resources.__dict__
+        resource = resources.get(service)
+        if resource == None:
+            with self._client_lock:
+                resource = self.session.resource(service, config=self.client_config)
+                if self.metrics != None:
+                    self.metrics.attach(resource.meta.client)
+                if self.concurrency != None and service == 's3':
+                    self.concurrency.attach(resource.meta.client)
+            resources[service] = resource
+        return resource
+
+    #the clients and resources that used to be attributes
+    s3_client = property(lambda self: self.get_client('s3'), lambda self, client: self._clients.__setitem__(('s3', None), client))
+    iam_client = property(lambda self: self.get_client('iam'), lambda self, client: self._clients.__setitem__(('iam', None), client))
+    ec2_client = property(lambda self: self.get_client('ec2'), lambda self, client: self._clients.__setitem__(('ec2', None), client))
+    s3_resources = property(lambda self: self.get_resource('s3'))
+    ec2_resources = property(lambda self: self.get_resource('ec2'))
 
     def is_ec2_instance(self) -> bool:
-        """returns true if this program is being run from within an EC2 instance"""
-        try:
-            response = requests.get('http://169.254.169.254/latest/meta-data/placement/region')
-            #print(response.text) #see what the result is first
-            return response.status_code ==200 #successful response, will fail if not from an ec2 instance
-        except:
-            return False
+        """returns true if this program is being run from within an EC2 instance (memoized, see _imds_get)"""
+        return _imds_get('meta-data/placement/region') != None
 
+    def _ec2_cached(self, cache_key: Tuple, refresh = False):
+        """returns the unexpired result cached under cache_key, or None"""
+        with self._ec2_cache_lock:
+            cached = self._ec2_cache.get(cache_key)
+        if cached != None and cached[0] > time.monotonic() and not refresh:
+            return cached[1]
+        return None
+
+    def _ec2_cache_put(self, cache_key: Tuple, result) -> None:
+        with self._ec2_cache_lock:
+            self._ec2_cache[cache_key] = (time.monotonic() + self.ec2_cache_ttl, result)
+
+    def _describe_instances(self, region_name: str = None, filters: List[Dict] = None) -> List[Dict]:
+        """returns every instance (of every page and reservation) describe_instances finds in region_name with filters,
+        each with an extra 'Region' key, and caches each of them for get_instances"""
+        client = self.get_client('ec2', region_name)
+        region = client.meta.region_name
+        paginator = client.get_paginator('describe_instances')
+        kwargs = {'Filters': filters} if filters else {}
+        instances = []
+        for page in paginator.paginate(PaginationConfig={'PageSize': 1000}, **kwargs): #the most describe_instances returns at once
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    instances.append(dict(instance, Region=region))
+        for instance in instances:
+            self._ec2_cache_put(('instance', region_name, instance['InstanceId']), instance)
+        return instances
+
+    def _ec2_regions(self, regions) -> List[str]:
+        """the regions to query: [None] (the session's region) if regions is None, every region enabled for the account if it's 'all'"""
+        if regions == None:
+            return [None]
+        if regions == 'all':
+            cached = self._ec2_cached(('regions',))
+            if cached == None:
+                cached = sorted(region['RegionName'] for region in self.ec2_client.describe_regions()['Regions'])
+                self._ec2_cache_put(('regions',), cached)
+            return cached
+        return [regions] if isinstance(regions, str) else list(regions)
+
+    @_instrumented
+    def list_instances(self, filters = None, regions = None, max_workers : int = 8, refresh = False) -> List[Dict]:
+        """returns the describe_instances dictionary of every EC2 instance matching filters, each with an extra 'Region' key.
+
+        filters is either a dictionary of filter name -> value(s), e.g. {'instance-state-name': 'running', 'tag:team': ['a', 'b']},
+        or the list of {'Name': ..., 'Values': [...]} that boto3 takes. Every page of results is read.
+        Instances are looked up in the session's region, or in each of regions (a list, or 'all' for every region
+        enabled for the account), max_workers regions at a time.
+
+        Results are cached for ec2_cache_ttl seconds (see __init__), unless refresh is true"""
+        if isinstance(filters, dict):
+            filters = [{'Name': name, 'Values': [values] if isinstance(values, str) else list(values)} for name, values in filters.items()]
+        filters = filters or []
+        filters_key = tuple(sorted((f['Name'], tuple(f['Values'])) for f in filters))
+
+        def region_instances(region_name):
+            cached = self._ec2_cached(('filters', region_name, filters_key), refresh)
+            if cached == None:
+                cached = self._describe_instances(region_name, filters)
+                self._ec2_cache_put(('filters', region_name, filters_key), cached)
+            return cached
+
+        instances = []
+        for found in _ordered_map(region_instances, self._ec2_regions(regions), max_workers):
+            instances.extend(found)
+        return instances
+
+    @_instrumented
+    def get_instances(self, instance_ids : List[str], region_name : str = None, refresh = False) -> Dict[str, Dict]:
+        """returns a dictionary of instance id -> describe_instances dictionary (with an extra 'Region' key) for instance_ids,
+        in region_name (or the session's region). Instances that don't exist are left out.
+
+        Only the instances that aren't cached (from earlier calls of this or list_instances, for ec2_cache_ttl seconds)
+        are looked up, 200 ids per request (the most values a filter takes), and ids that don't exist don't fail the request"""
+        found = {}
+        missing = []
+        for instance_id in dict.fromkeys(instance_ids): #without duplicates, in order
+            cached = self._ec2_cached(('instance', region_name, instance_id), refresh)
+            if cached != None:
+                found[instance_id] = cached
+            else:
+                missing.append(instance_id)
+
+        for start in range(0, len(missing), 200):
+            for instance in self._describe_instances(region_name, [{'Name': 'instance-id', 'Values': missing[start:start+200]}]):
+                found[instance['InstanceId']] = instance
+        return {instance_id: found[instance_id] for instance_id in dict.fromkeys(instance_ids) if instance_id in found}
+
+    @_instrumented
+    def get_instance(self, instance_id : str, region_name : str = None, refresh = False) -> Dict:
+        """returns the describe_instances dictionary (with an extra 'Region' key) of instance_id, or None if it doesn't exist.
+        See get_instances"""
+        return self.get_instances([instance_id], region_name, refresh).get(instance_id)
+
+    @_instrumented
+    def current_instance(self, refresh = False) -> Dict:
+        """returns the describe_instances dictionary of the EC2 instance this is running on (its id and region come from the
+        instance metadata, see _imds_get), or None if this isn't running on EC2"""
+        instance_id = _imds_get('meta-data/instance-id')
+        if instance_id == None:
+            return None
+        return self.get_instance(instance_id, _imds_get('meta-data/placement/region'), refresh)
+
+    @_instrumented
     def get_cur_user(self):
         """returns ARN of the user of this current session"""
-        return self.session.client('sts').get_caller_identity()['Arn']
+        return self.get_client('sts').get_caller_identity()['Arn']
 
+    @_instrumented
     def get_bucket_request_payment(self, bucket_name: str, bucket_owner_account_id : str = None) -> str:
         """returns one of the following:
         1. 'Requester': if the requester must pay
         2. 'BucketOwner': if the bucket owner must pay
         3. 'AccessDenied': if you do not have necessary permission to get the bucket_request_payment configuration"""
-
-        if self.s3_client==None:
-            self.s3_client = self.session.client('s3')
         
         #add try /except with proper error when we see it
         try:
@@ -117,33 +541,35 @@ class AWS:
         
         
     
+    @_instrumented
     def get_bucket_size(self, bucket_name : str,
         in_gb = False, in_tb = False, print_progress = False,
-        requester_pays = False) -> int :
-        """ returns total size (in bytes) of bucket"""
-        total_file_size = 0
-        if self.s3_client==None:
-            self.s3_client = self.session.client('s3')
+        requester_pays = False, max_workers : int = 1, inventory_manifest : str = None, live_prefixes : List[str] = None) -> int :
+        """ returns total size (in bytes) of bucket
 
-        if requester_pays:
-            all_objects = self.s3_client.list_objects_v2(Bucket = bucket_name, RequestPayer='requester')
+        If max_workers > 1, the bucket is listed in parallel shards (see _iter_object_pages)
+
+        If inventory_manifest != None, the sizes are summed from that S3 Inventory report instead of listing the bucket,
+        reading max_workers of its data files at a time (see get_file_index for inventory_manifest and live_prefixes)"""
+        total_file_size = 0
+        if inventory_manifest != None:
+            manifest = self._read_inventory_manifest(inventory_manifest, bucket_name, requester_pays)
+            if live_prefixes:
+                for obj in self._iter_inventory_objects(manifest, bucket_name, "", requester_pays, max_workers, live_prefixes=live_prefixes):
+                    total_file_size+=obj['Size']
+            else: #no need to sort the rows just to add them up
+                def file_size(file_key):
+                    return sum(obj['Size'] for obj in self._iter_inventory_file(manifest, file_key, "", requester_pays))
+                for size in _ordered_map(file_size, [f['key'] for f in manifest['files']], max_workers):
+                    total_file_size+=size
         else:
-            all_objects = self.s3_client.list_objects_v2(Bucket = bucket_name)                        
-        for obj in all_objects['Contents']:
-            total_file_size+=obj['Size']
-        
-        group = 1 
-        while all_objects['IsTruncated']:
-            if print_progress:
-                print("List of objects truncated for get_bucket_size, breaking into groups. This is group: " + str(group))
-            group = group+1
-            nextToken = all_objects['NextContinuationToken']
-            if requester_pays:
-                all_objects = self.s3_client.list_objects_v2(Bucket = bucket_name, ContinuationToken= nextToken, RequestPayer='requester')
-            else:
-                all_objects = self.s3_client.list_objects_v2(Bucket = bucket_name, ContinuationToken= nextToken)
-            for obj in all_objects['Contents']:
-                total_file_size+=obj['Size']
+            group = 1
+            for page in self._iter_pages(bucket_name, "", requester_pays, max_workers):
+                if print_progress and group > 1:
+                    print("List of objects truncated for get_bucket_size, breaking into groups. This is group: " + str(group))
+                group = group+1
+                for obj in page:
+                    total_file_size+=obj['Size']
 
         if in_gb:
             return total_file_size / 1.0E9
@@ -151,85 +577,119 @@ class AWS:
             return total_file_size / 1.0E12
         return total_file_size #default is in bytes
     
-    def list_bucket_names(self, only_accessible = False) -> List[str]:
+    @_instrumented
+    def list_bucket_names(self, only_accessible = False, max_workers : int = 32, include_requester_pays = False) -> List[str]:
         """outputs a sorted list of bucket names.
 
-        If only_accessible is true, it will only list the buckets for which you have ListBucket access"""
-        if self.s3_client==None:
-            self.s3_client = self.session.client('s3')
+        If only_accessible is true, it will only list the buckets for which you have ListBucket access
+        (and also requester pays buckets you can list, if include_requester_pays is true).
+        The buckets are probed max_workers at a time, and the results are cached (see get_bucket_access)"""
         response = self.s3_client.list_buckets() #never truncated according to boto3
         bucket_dict_list = response['Buckets']
         bucket_name_list = [x['Name'] for x in bucket_dict_list]
         
         if only_accessible: #check which buckets you have access to
-            accessible_buckets = []
-            for bucket in bucket_name_list:
-                if self.can_access_bucket(bucket):
-                    accessible_buckets.append(bucket)
-            return sorted(accessible_buckets)
+            wanted = ['accessible', 'requester_pays'] if include_requester_pays else ['accessible']
+            accesses = self.get_bucket_accesses(bucket_name_list, max_workers=max_workers)
+            return sorted(bucket for bucket, access in accesses.items() if access in wanted)
         else:
             return sorted(bucket_name_list)
     
 
+    @_instrumented
     def can_access_bucket(self,bucket: str) -> bool:
         """returns true only if the bucket exists and you have permission to access it
-        Note that this will return false if the bucket has requester pays access becuase the head_object function doesn't have a requester_pays options"""
-        if self.s3_client==None:
-            self.s3_client = self.session.client('s3')
+        Note that this will return false if the bucket has requester pays access, use get_bucket_access to tell that case apart"""
+        return self.get_bucket_access(bucket) == 'accessible'
+
+    @_instrumented
+    def get_bucket_access(self, bucket: str, refresh = False) -> str:
+        """returns one of:
+        1. 'accessible': the bucket exists and you have permission to access it
+        2. 'requester_pays': you can only access it by paying for the requests (RequestPayer='requester')
+        3. 'forbidden': the bucket exists but you don't have permission
+        4. 'missing': the bucket doesn't exist
+        5. 'error': anything else (e.g. a network error), which isn't cached
+
+        Results are cached for bucket_access_ttl seconds (see __init__), unless refresh is true"""
+        now = time.monotonic()
+        with self._bucket_access_lock:
+            cached = self._bucket_access.get(bucket)
+        if cached != None and cached[0] > now and not refresh:
+            return cached[1]
+
+        access = self._probe_bucket_access(bucket)
+        if access != 'error':
+            with self._bucket_access_lock:
+                self._bucket_access[bucket] = (now + self.bucket_access_ttl, access)
+        return access
+
+    @_instrumented
+    def get_bucket_accesses(self, bucket_names : List[str] = None, max_workers : int = 32, refresh = False) -> Dict[str, str]:
+        """returns a dictionary of bucket name -> get_bucket_access(bucket name), probing max_workers buckets at a time.
+        If bucket_names isn't given, every bucket from list_buckets is checked"""
+        if bucket_names == None:
+            bucket_names = [x['Name'] for x in self.s3_client.list_buckets()['Buckets']]
+        accesses = _ordered_map(lambda bucket: self.get_bucket_access(bucket, refresh=refresh), bucket_names, max_workers)
+        return dict(zip(bucket_names, accesses))
+
+    def _probe_bucket_access(self, bucket: str) -> str:
+        """the uncached part of get_bucket_access"""
+        import botocore.exceptions
         try:
-            response = self.s3_client.head_bucket(Bucket=bucket)
-            result_code = response['ResponseMetadata']['HTTPStatusCode']
-            return result_code ==200
-            #200 = "if the bucket exists and you have permission to access it"
-            #404 Not found - bucket doesn't exist
-            #403 Forbiden - no permission
-        except:
-            return False #means either bucket doesn't exist or you don't have permission
-    
-    def list_keys(self, bucket_name: str, prefix : str = "", requester_pays=False) -> List[str]:
-        """returns a list of all file keys in the bucket"""
-        filenames = []
-        if self.s3_client==None:
-            self.s3_client = self.session.client('s3')
+            self.s3_client.head_bucket(Bucket=bucket)
+            return 'accessible'
+        except botocore.exceptions.ClientError as e:
+            code = e.response['Error']['Code']
+            if code in ['404', 'NoSuchBucket']:
+                return 'missing'
+            if code not in ['403', 'AccessDenied', 'Forbidden']:
+                return 'error'
+        except Exception:
+            return 'error'
 
-        if requester_pays:
-            all_objects = self.s3_client.list_objects_v2(Bucket = bucket_name,
-                                                    Prefix=prefix,
-                                                    MaxKeys=1000,
-                                                    RequestPayer='requester')
-        else:
-            all_objects = self.s3_client.list_objects_v2(Bucket = bucket_name,
-                                                    Prefix=prefix,
-                                                    MaxKeys=1000)   
+        #head_bucket has no RequestPayer option, so a requester pays bucket looks forbidden.
+        #listing a single key as the requester tells the two apart
         try:
-            for obj in all_objects['Contents']:
-                filenames.append(obj['Key'])
-        except KeyError:
-            print("all_objects in list_keys did not have a 'contents' key, returning empty list")
-            print(all_objects)
-            return []
-        
-        group = 1 
-        while all_objects['IsTruncated']:
-            #print("group: " + str(group))
-            group = group+1
-            nextToken = all_objects['NextContinuationToken']
-            if requester_pays:
-                all_objects = self.s3_client.list_objects_v2(Bucket = bucket_name,
-                                                    Prefix=prefix,
-                                                    MaxKeys=1000,
-                                                    ContinuationToken= nextToken,
-                                                    RequestPayer='requester')
-            else:
-                all_objects = self.s3_client.list_objects_v2(Bucket = bucket_name,
-                                                    Prefix=prefix,
-                                                    MaxKeys=1000,
-                                                    ContinuationToken= nextToken)
-            for obj in all_objects['Contents']:
-                filenames.append(obj['Key'])
-        return filenames
+            self.s3_client.list_objects_v2(Bucket=bucket, MaxKeys=1, RequestPayer='requester')
+            return 'requester_pays'
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ['403', 'AccessDenied', 'Forbidden']:
+                return 'forbidden'
+            return 'error'
+        except Exception:
+            return 'error'
+    
+    @_instrumented
+    def list_keys(self, bucket_name: str, prefix : str = "", requester_pays=False, max_workers : int = 1) -> List[str]:
+        """returns a list of all file keys in the bucket, in key order
+
+        If max_workers > 1, the prefix is listed in parallel shards (see _iter_object_pages)"""
+        return list(self.iter_keys(bucket_name, prefix, requester_pays=requester_pays, max_workers=max_workers))
+
+    @_instrumented
+    def iter_keys(self, bucket_name: str, prefix : str = "", requester_pays=False, max_workers : int = 1) -> Iterator[str]:
+        """lazily yields every file key in the bucket (with matching prefix), in key order. See iter_objects"""
+        for obj in self.iter_objects(bucket_name, prefix, requester_pays=requester_pays, max_workers=max_workers):
+            yield obj['Key']
+
+    @_instrumented
+    def iter_objects(self, bucket_name: str, prefix : str = "", requester_pays=False, max_workers : int = 1,
+                     prefetch_pages : int = 1, start_after : str = None) -> Iterator[Dict]:
+        """lazily yields one dictionary per object in the bucket (with matching prefix, and after start_after if given), in key order.
+        Each dictionary is an element of the list_objects_v2 'Contents', so it has 'Key', 'Size', 'ETag', 'LastModified' etc.
+
+        Pages are only requested as you consume them, and up to prefetch_pages pages are fetched
+        in the background while you work on the current one (set prefetch_pages=0 to disable).
+        If max_workers > 1, the prefix is listed in parallel shards (see _iter_object_pages)"""
+        for page in self._iter_pages(bucket_name, prefix, requester_pays, max_workers, prefetch_pages, start_after):
+            yield from page
         
-    def get_file_index(self, bucket_name : str, prefix : str = "", fout = None, get_column_names=False, print_progress=False, requester_pays=False) -> List[Dict]:
+    @_instrumented
+    def get_file_index(self, bucket_name : str, prefix : str = "", fout = None, get_column_names=False, print_progress=False, requester_pays=False,
+                       max_workers : int = 1, keep_index = True, include_etag = False,
+                       checkpoint_path : str = None, previous_index : str = None, diff_fout = None,
+                       inventory_manifest : str = None, live_prefixes : List[str] = None, column_workers : int = 16) -> List[Dict]:
         """returns a list with one element for each file in the S3 bucket (with matching prefix)
         Each element is a dictionary with at the very least the following keys: 
         1. 'key'
@@ -237,71 +697,350 @@ class AWS:
         3. 'sizegigabyte'
 
         If get_column_names=True, then each dictionary will also contain a  'column names' key, and its value is a comma-separated list of the column names.
+        If include_etag=True, then each dictionary will also contain an 'etag' key.
 
-        WARNING: GETTING THE COLUMN NAMES MAY TRANSFER A LOT OF DATA IF THERE ARE MANY SMALL FILES.
+        WARNING: GETTING THE COLUMN NAMES MAKES AT LEAST ONE (SMALL, RANGED) GET REQUEST PER FILE, WHICH ADDS UP IF THERE ARE MANY SMALL FILES.
 
         if fout != None, then it writes the index to that file. This is particularly useful if you are creating an enormous index
         And you want to write to the file as you index it in case you hit an error along the way
 
-        fout should be an opened file in write mode"""
+        fout should be an opened file in write mode
 
-        if requester_pays:
-            RequestPayer='requester'
-        else:
-            RequestPayer='bucketowner'
+        If keep_index=False, rows are only streamed to fout and an empty list is returned,
+        so memory stays flat no matter how many files are indexed (see also iter_file_index)
 
-        if self.s3_client==None:
-            self.s3_client = self.session.client('s3')
+        If checkpoint_path != None, the last key written to fout is saved to that file every 1000 rows.
+        If the index fails part way, call get_file_index again with the same arguments and fout re-opened in append mode,
+        and it resumes after the saved key instead of starting over (rows written after the checkpoint are truncated from fout first).
+        So fout (and diff_fout) must be seekable, or a ValueError is raised. The checkpoint file is deleted once the index completes.
 
-        if print_progress:
-            print("Beginning file index for bucket=", bucket_name, " and prefix=", prefix)
+        If previous_index != None, it should be the path to an index csv from an earlier get_file_index(include_etag=True)
+        of the same bucket and prefix (a ValueError is raised if it has no etag column). Rows of objects whose size and ETag
+        haven't changed since are reused as they are, so only added or changed objects have their column names read.
+        If diff_fout != None, the added, changed and removed rows are also written to it, with an extra 'change' column.
+
+        If max_workers > 1, the prefix is listed in parallel shards (see _iter_object_pages). Rows stay in key order.
+        If get_column_names=True, up to column_workers objects have their column names read at the same time
+        (each is a small ranged GET that mostly waits on latency, hence the pool even when max_workers=1).
 
+        If inventory_manifest != None, it should be the s3:// path of the manifest.json of a CSV S3 Inventory report of the bucket,
+        and the objects are read from that report instead of listing the bucket, which is much faster and cheaper for big buckets.
+        max_workers of its data files are read at a time, and each is sorted on its own and spilled to a temporary file,
+        so rows still come out in key order without holding the whole inventory in memory.
+        The report is only as fresh as its date, so if live_prefixes is given, those prefixes are also listed live,
+        and the objects in them modified since the report was made are added to it (or replace their rows in it).
+        Objects deleted since the report was made are still in the index."""
+
+        include_etag = include_etag or previous_index != None
         index = []
-        
-        #establishing default values for first run of the while loop
-        group =1
-        first : bool = True
-        all_objects = {'IsTruncated' : True}
 
-        #handling csv writer if necessary
+        #handling csv writers if necessary
         fieldnames = ['key','sizebyte', 'sizegigabyte']
         if get_column_names:
             fieldnames.append('column names')
+        if include_etag:
+            fieldnames.append('etag')
+        outputs = [output for output in (fout, diff_fout) if output != None]
+        if checkpoint_path != None and not all(output.seekable() for output in outputs):
+            raise ValueError("checkpoint_path needs a seekable fout and diff_fout, so the rows written after the last checkpoint "
+                             "can be truncated on resume")
+        if previous_index != None:
+            self._check_previous_index(previous_index)
+
+        checkpoint = self._load_index_checkpoint(checkpoint_path, bucket_name, prefix)
+        if checkpoint != None:
+            for output, position in zip(outputs, checkpoint['positions']):
+                output.seek(position)
+                output.truncate()
         if fout!= None:
             writer = csv.DictWriter(fout, fieldnames)
-            writer.writeheader()
+            if checkpoint == None:
+                writer.writeheader()
+        if diff_fout != None:
+            diff_writer = csv.DictWriter(diff_fout, ['change'] + fieldnames)
+            if checkpoint == None:
+                diff_writer.writeheader()
+        if checkpoint_path != None and checkpoint == None:
+            #so a failure before the first 1000 rows still resumes from right after the headers
+            self._save_index_checkpoint(checkpoint_path, bucket_name, prefix, None, outputs)
 
-        #looping repeatedly until you have all the files
-        while all_objects['IsTruncated']:
-            if print_progress:
-                print("group: " + str(group))
-            group+=1
-            
-            if first:
-                all_objects = self.s3_client.list_objects_v2(Bucket = bucket_name,
-                                                    Prefix=prefix,
-                                                    MaxKeys=1000,
-                                                    RequestPayer=RequestPayer)
-                first = False
+        rows_since_checkpoint = 0
+        for change, row in self._iter_index_changes(bucket_name, prefix, get_column_names=get_column_names, print_progress=print_progress,
+                                                    requester_pays=requester_pays, max_workers=max_workers, include_etag=include_etag,
+                                                    start_after=checkpoint['last_key'] if checkpoint != None else None,
+                                                    previous_index=previous_index, inventory_manifest=inventory_manifest,
+                                                    live_prefixes=live_prefixes, column_workers=column_workers):
+            if diff_fout != None and change != 'unchanged':
+                diff_writer.writerow(dict(row, change=change))
+            if change == 'removed':
+                continue
+            if keep_index:
+                index.append(row)
+            if fout != None:
+                writer.writerow(row)
 
-            else:
-                nextToken = all_objects['NextContinuationToken']
-                all_objects = self.s3_client.list_objects_v2(Bucket = bucket_name,
-                                                    Prefix=prefix,
-                                                    MaxKeys=1000,
-                                                    ContinuationToken= nextToken,
-                                                    RequestPayer=RequestPayer)
-            for obj in all_objects['Contents']:
+            rows_since_checkpoint += 1
+            if checkpoint_path != None and rows_since_checkpoint >= 1000:
+                self._save_index_checkpoint(checkpoint_path, bucket_name, prefix, row['key'], outputs)
+                rows_since_checkpoint = 0
+
+        if checkpoint_path != None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return index
+
+    @_instrumented
+    def iter_file_index(self, bucket_name : str, prefix : str = "", get_column_names=False, print_progress=False, requester_pays=False,
+                        max_workers : int = 1, include_etag = False, start_after : str = None, previous_index : str = None,
+                        inventory_manifest : str = None, live_prefixes : List[str] = None, column_workers : int = 16) -> Iterator[Dict]:
+        """lazily yields the rows of get_file_index, one per file, in key order.
+        The next page of the listing is fetched in the background while the current one is indexed.
+        If get_column_names=True, up to column_workers objects have their column names fetched at the same time"""
+        for change, row in self._iter_index_changes(bucket_name, prefix, get_column_names=get_column_names, print_progress=print_progress,
+                                                    requester_pays=requester_pays, max_workers=max_workers, include_etag=include_etag,
+                                                    start_after=start_after, previous_index=previous_index,
+                                                    inventory_manifest=inventory_manifest, live_prefixes=live_prefixes,
+                                                    column_workers=column_workers):
+            if change != 'removed':
+                yield row
+
+    @_instrumented
+    def get_object_index(self, bucket_name : str, prefix : str = "", requester_pays=False, max_workers : int = 1,
+                         inventory_manifest : str = None, live_prefixes : List[str] = None) -> ObjectIndex:
+        """lists the bucket (with matching prefix) once and returns an ObjectIndex of its objects, which answers
+        du(prefix, depth), largest(n) and size_histogram() without listing it again, and can be saved to a file and reloaded.
+
+        If max_workers > 1, the prefix is listed in parallel shards (see _iter_object_pages).
+        If inventory_manifest != None, the objects are read from that S3 Inventory report instead (see get_file_index)"""
+        if inventory_manifest != None:
+            manifest = self._read_inventory_manifest(inventory_manifest, bucket_name, requester_pays)
+            objects = self._iter_inventory_objects(manifest, bucket_name, prefix, requester_pays, max_workers, live_prefixes=live_prefixes)
+        else:
+            objects = self.iter_objects(bucket_name, prefix, requester_pays=requester_pays, max_workers=max_workers)
+        return ObjectIndex.from_objects(objects, bucket_name, prefix)
+
+    def _iter_index_changes(self, bucket_name : str, prefix : str = "", get_column_names=False, print_progress=False, requester_pays=False,
+                            max_workers : int = 1, include_etag = False, start_after : str = None, previous_index : str = None,
+                            inventory_manifest : str = None, live_prefixes : List[str] = None,
+                            column_workers : int = 16) -> Iterator[Tuple[str, Dict]]:
+        """yields (change, row) for every file, in key order, where change is one of 'added', 'changed', 'unchanged' or 'removed'.
+
+        Without a previous_index every file is 'added'. With one, the listing is merge-joined against the (key ordered)
+        rows of the previous index: rows of unchanged objects are reused, and the rows of objects that no longer exist
+        are yielded as 'removed'"""
+
+        if requester_pays:
+            RequestPayer='requester'
+        else:
+            RequestPayer='bucketowner'
+
+        if print_progress:
+            print("Beginning file index for bucket=", bucket_name, " and prefix=", prefix)
+        if previous_index != None:
+            self._check_previous_index(previous_index)
+
+        def objects():
+            if inventory_manifest != None:
+                manifest = self._read_inventory_manifest(inventory_manifest, bucket_name, requester_pays)
+                if print_progress:
+                    print("reading " + str(len(manifest['files'])) + " inventory files of " + inventory_manifest)
+                for obj in self._iter_inventory_objects(manifest, bucket_name, prefix, requester_pays, max_workers, start_after, live_prefixes):
+                    logger.debug("indexing %s", obj['Key'])
+                    yield obj
+                return
+
+            group = 1
+            for page in self._iter_pages(bucket_name, prefix, requester_pays, max_workers, start_after=start_after):
                 if print_progress:
-                    print(obj['Key'])
+                    print("group: " + str(group))
+                group+=1
+
+                for obj in page:
+                    logger.debug("indexing %s", obj['Key'])
+                    yield obj
+
+        def changes():
+            if previous_index == None:
+                for obj in objects():
+                    yield 'added', obj, None
+                return
+
+            previous_rows = self._read_index_file(previous_index, start_after=start_after)
+            previous = next(previous_rows, None)
+            for obj in objects():
+                while previous != None and previous['key'] < obj['Key']:
+                    yield 'removed', None, previous
+                    previous = next(previous_rows, None)
+                if previous != None and previous['key'] == obj['Key']:
+                    unchanged = (previous['sizebyte'] == obj['Size'] and previous['etag'] not in (None, '') and previous['etag'] == obj['ETag']
+                                 and (not get_column_names or previous.get('column names') not in (None, '')))
+                    yield ('unchanged' if unchanged else 'changed'), obj, previous
+                    previous = next(previous_rows, None)
+                else:
+                    yield 'added', obj, None
+            while previous != None:
+                yield 'removed', None, previous
+                previous = next(previous_rows, None)
+
+        def build_row(change_obj_previous):
+            change, obj, previous = change_obj_previous
+            if change in ('added', 'changed'):
                 row = self.get_obj_index(bucket_name, obj, get_column_names=get_column_names, RequestPayer=RequestPayer)
-                index.append(row)
-                if fout != None:
-                    writer.writerow(row)
-      
-        return index
+                if include_etag:
+                    row = dict(row, etag=obj['ETag'])
+                return change, row
 
+            #reused rows only keep the columns this index asked for
+            row = {'key': previous['key'], 'sizebyte': previous['sizebyte'], 'sizegigabyte': previous['sizebyte'] / 1.0E9}
+            if get_column_names:
+                row['column names'] = previous.get('column names', '')
+            if include_etag:
+                row['etag'] = obj['ETag'] if obj != None else previous.get('etag', '')
+            return change, row
+
+        #column names cost a GET per object, so those are fetched on a thread pool (rows still come back in key order)
+        workers = column_workers if get_column_names else 1
+        try:
+            yield from _ordered_map(build_row, changes(), workers)
+        finally: #so the column names read so far aren't lost if the process ends before the cache's next batch commit
+            if get_column_names and self.metadata_cache != None:
+                self.metadata_cache.flush()
+
+    def _check_previous_index(self, path: str) -> None:
+        """raises ValueError if the index csv at path lacks a column that previous_index needs.
+        Without ETags, an object rewritten with the same size would look unchanged"""
+        with open(path, newline='') as fin:
+            columns = next(csv.reader(fin), [])
+        missing = [column for column in ('key', 'sizebyte', 'etag') if column not in columns]
+        if missing:
+            raise ValueError(f"previous_index {path} has no {', '.join(missing)} column, "
+                             "make it with get_file_index(include_etag=True)")
+
+    def _read_index_file(self, path: str, start_after: str = None) -> Iterator[Dict]:
+        """lazily yields the rows of an index csv written by get_file_index, with 'sizebyte' as an int,
+        skipping the rows up to and including start_after"""
+        with open(path, newline='') as fin:
+            for row in csv.DictReader(fin):
+                if start_after != None and row['key'] <= start_after:
+                    continue
+                row['sizebyte'] = int(row['sizebyte'])
+                yield row
+
+    def _read_inventory_manifest(self, manifest_path: str, bucket_name: str, requester_pays=False) -> Dict:
+        """returns the manifest.json of an S3 Inventory report, given its s3://bucket/key path,
+        after checking that it's a CSV inventory of bucket_name"""
+        if not manifest_path.startswith('s3://') or '/' not in manifest_path[len('s3://'):]:
+            raise ValueError(f"inventory_manifest should be an s3://bucket/key path, not {manifest_path}")
+        manifest_bucket, manifest_key = manifest_path[len('s3://'):].split('/', 1)
+        object_kwargs = {'RequestPayer': 'requester'} if requester_pays else {}
+        response = self.s3_client.get_object(Bucket=manifest_bucket, Key=manifest_key, **object_kwargs)
+        manifest = json.loads(response['Body'].read())
+
+        if manifest.get('fileFormat', 'CSV').upper() != 'CSV':
+            raise ValueError(f"{manifest_path} is a {manifest['fileFormat']} inventory, only CSV inventories can be read")
+        if manifest.get('sourceBucket', bucket_name) != bucket_name:
+            raise ValueError(f"{manifest_path} is an inventory of bucket={manifest['sourceBucket']}, not bucket={bucket_name}")
+        return manifest
+
+    def _iter_inventory_file(self, manifest: Dict, file_key: str, prefix: str = "", requester_pays=False) -> Iterator[Dict]:
+        """lazily yields the objects (with matching prefix) in one data file of an S3 Inventory report, as dictionaries
+        with the 'Key', 'Size', 'ETag' and 'LastModified' of list_objects_v2. The rows aren't in key order.
+        Keys are URL-decoded, and of a versioned inventory only the latest versions that aren't delete markers are kept"""
+        import urllib.parse
+
+        column = {name.strip(): i for i, name in enumerate(manifest['fileSchema'].split(','))}
+        destination_bucket = manifest['destinationBucket'].split(':::')[-1] #it's an ARN
+        #a single forward scan, so only the block being read and the prefetch_blocks (4) ahead of it need to be cached
+        with self.open(destination_bucket, file_key, requester_pays=requester_pays, mode='r', decompress=True,
+                       encoding='utf-8', block_cache=True, cache_blocks=5) as fin:
+            for record in csv.reader(fin):
+                if 'IsLatest' in column and record[column['IsLatest']] != 'true':
+                    continue
+                if 'IsDeleteMarker' in column and record[column['IsDeleteMarker']] == 'true':
+                    continue
+                key = urllib.parse.unquote_plus(record[column['Key']])
+                if not key.startswith(prefix):
+                    continue
+                etag = record[column['ETag']] if 'ETag' in column else ''
+                yield {'Key': key, 'Size': int(record[column['Size']] or 0),
+                       'ETag': '"' + etag + '"' if etag else '', #quoted like the listing's
+                       'LastModified': record[column['LastModifiedDate']] if 'LastModifiedDate' in column else ''}
+
+    def _iter_inventory_objects(self, manifest: Dict, bucket_name: str, prefix: str = "", requester_pays=False, max_workers: int = 1,
+                                start_after: str = None, live_prefixes: List[str] = None) -> Iterator[Dict]:
+        """lazily yields the objects (with matching prefix, and after start_after if given) of an S3 Inventory report, in key order.
+
+        The data files are read max_workers at a time; the rows of each are sorted and written to a temporary file,
+        and the sorted files are then merged. If live_prefixes is given, the objects listed under them that were
+        modified since the report was made are merged in, replacing the inventory rows of the same keys"""
+        with tempfile.TemporaryDirectory(prefix='ez_aws_inventory_') as directory:
+            def sort_file(numbered_file):
+                number, file_key = numbered_file
+                rows = sorted((obj['Key'], obj['Size'], obj['ETag'], obj['LastModified'])
+                              for obj in self._iter_inventory_file(manifest, file_key, prefix, requester_pays)
+                              if start_after == None or obj['Key'] > start_after)
+                path = os.path.join(directory, str(number) + '.csv')
+                with open(path, 'w', newline='', encoding='utf-8') as fout:
+                    csv.writer(fout).writerows(rows)
+                return path
+
+            def read_sorted(path):
+                with open(path, newline='', encoding='utf-8') as fin:
+                    for key, size, etag, last_modified in csv.reader(fin):
+                        yield {'Key': key, 'Size': int(size), 'ETag': etag, 'LastModified': last_modified}
+
+            paths = list(_ordered_map(sort_file, enumerate(f['key'] for f in manifest['files']), max_workers))
+            inventory = heapq.merge(*[read_sorted(path) for path in paths], key=lambda obj: obj['Key'])
+            if not live_prefixes:
+                yield from inventory
+                return
+
+            created = datetime.datetime.fromtimestamp(int(manifest['creationTimestamp']) / 1000, datetime.timezone.utc)
+            listings = [self.iter_objects(bucket_name, live_prefix, requester_pays, max_workers, start_after=start_after)
+                        for live_prefix in sorted(set(live_prefixes))]
+            live = (obj for obj in heapq.merge(*listings, key=lambda obj: obj['Key'])
+                    if obj['Key'].startswith(prefix) and obj['LastModified'] >= created)
+            #live objects sort before inventory rows of the same key, so only the first of each key is kept
+            merged = heapq.merge(((obj['Key'], 0, i, obj) for i, obj in enumerate(live)),
+                                 ((obj['Key'], 1, i, obj) for i, obj in enumerate(inventory)))
+            last_key = None
+            for key, _, _, obj in merged:
+                if key != last_key:
+                    yield obj
+                last_key = key
+
+    def _load_index_checkpoint(self, checkpoint_path: str, bucket_name: str, prefix: str) -> Dict:
+        """returns the checkpoint saved by _save_index_checkpoint, or None if there isn't one"""
+        if checkpoint_path == None or not os.path.exists(checkpoint_path):
+            return None
+        with open(checkpoint_path) as fin:
+            checkpoint = json.load(fin)
+        if checkpoint['bucket'] != bucket_name or checkpoint['prefix'] != prefix:
+            raise ValueError(f"checkpoint {checkpoint_path} is for bucket={checkpoint['bucket']} and prefix={checkpoint['prefix']}, "
+                             f"not bucket={bucket_name} and prefix={prefix}")
+        return checkpoint
+
+    def _save_index_checkpoint(self, checkpoint_path: str, bucket_name: str, prefix: str, last_key: str, outputs: List) -> None:
+        """flushes the outputs and atomically saves the last key written, along with the position of each output
+        (so rows written after the checkpoint can be truncated on resume)"""
+        positions = []
+        for output in outputs:
+            output.flush()
+            positions.append(output.tell())
+
+        temporary_path = checkpoint_path + '.tmp'
+        with open(temporary_path, 'w') as fout:
+            json.dump({'bucket': bucket_name, 'prefix': prefix, 'last_key': last_key, 'positions': positions}, fout)
+        os.replace(temporary_path, checkpoint_path)
+
+    @_instrumented
     def get_obj_index(self, bucket_name, obj, get_column_names=False, RequestPayer: str = 'bucketowner') -> Dict:
+        """returns the get_file_index row for obj, an element of the list_objects_v2 'Contents'.
+        If get_column_names=True and this AWS has a metadata_cache, unchanged objects are answered from the cache without a GET"""
+        if get_column_names and self.metadata_cache != None and obj['ETag']:
+            cached = self.metadata_cache.get(bucket_name, obj['Key'], obj['ETag'], obj['Size'])
+            if cached != None:
+                return cached
+
         result = {'key':obj['Key'], 'sizebyte' :obj['Size'], 'sizegigabyte' : obj['Size']/ 1.0E9}
 
         if get_column_names:
@@ -315,17 +1054,20 @@ class AWS:
 
                 column_string = column_string[:-1] #remove the last comma
                 result['column names'] = column_string
+            if obj['ETag']: #inventories without ETags can't tell a changed object from an unchanged one
+                self._cache_index_row(bucket_name, obj['ETag'], obj['Size'], result)
         return result
 
+    @_instrumented
     def get_key_index(self, bucket: str, key: str, get_column_names=False, RequestPayer : str = 'bucketowner') -> Dict:
         """ returns a dictionary with following keys:
         1. 'key'
         2. 'sizebyte'
         3. 'sizegigabyte'
-        4. (optional if get_column_names=True) 'column names'"""
+        4. (optional if get_column_names=True) 'column names'
+
+        If get_column_names=True and this AWS has a metadata_cache, unchanged objects only cost the head_object request"""
 
-        if self.s3_client==None:
-            self.s3_client = self.session.client('s3')
 
         header = self.s3_client.head_object(
             Bucket=bucket,
@@ -334,6 +1076,11 @@ class AWS:
         )
         
         size_bytes = int(header['ResponseMetadata']['HTTPHeaders']['content-length'])
+        if get_column_names and self.metadata_cache != None:
+            cached = self.metadata_cache.get(bucket, key, header['ETag'], size_bytes)
+            if cached != None:
+                return cached
+
         result = {'key': key, 'sizebyte': size_bytes, 'sizegigabyte' : size_bytes / 1.0E9}
         
         if get_column_names:
@@ -344,91 +1091,529 @@ class AWS:
 
             column_string = column_string[:-1] #remove the last comma
             result['column names'] = column_string
+            self._cache_index_row(bucket, header['ETag'], size_bytes, result)
+            if self.metadata_cache != None:
+                self.metadata_cache.flush()
         
         return result
 
+    def _cache_index_row(self, bucket_name: str, etag: str, size: int, row: Dict) -> None:
+        """stores row in the metadata_cache (if there is one), unless reading the column names failed,
+        since that may have been a transient error"""
+        if self.metadata_cache == None or row.get('column names', '').startswith('unreadable csv'):
+            return
+        self.metadata_cache.put(bucket_name, row['key'], etag, size, row)
 
-
-   
-        
+    @_instrumented
     def get_column_names(self, bucket_name, key, requester_pays = False)-> List[str]:
         """returns a list of the column names of each file.
         first step is to get the extension
-        For now, only .csv and .csv.gz are implemented"""
-        print(f"Requester pays: {requester_pays}")
+        For now, only .csv and .csv.gz are implemented
 
-        split_key = key.split('.')
-        try:
-            extension = split_key[-1]
-        except IndexError:
-            extension =""
-        
-        try:
-            sub_extension = split_key[-2] #e.g. in a .csv.gz file, sub-extension is .csv
-        except IndexError:
-            sub_extension=""
+        Only the start of the file is downloaded (see _read_first_line)"""
+        extension, sub_extension = self._get_extensions(key)
 
-        if extension == 'csv': 
+        if extension == 'csv' or (extension=='gz' and sub_extension=='csv'):
             try:
-                with self.open(bucket_name, key, requester_pays=requester_pays,encoding='utf-8') as fin:
-                    reader = csv.DictReader(fin)
-                    return reader.fieldnames
-            except Exception as e:
-                return [f"unreadable csv: {str(e)}"]
-        elif extension=='gz' and sub_extension=='csv':
-            try:
-                with self.open(bucket_name, key, requester_pays=requester_pays, decompress=True, encoding='utf-8') as fin:
-                    reader = csv.DictReader(fin)
-                    return reader.fieldnames
+                header = self._read_first_line(bucket_name, key, requester_pays=requester_pays, decompress=(extension=='gz'))
+                return next(csv.reader([header]), [])
             except Exception as e:
                 return [f"unreadable csv: {str(e)}"]
         else:
             #print("getColumNames Error: could not read extension of type ", extension, " with sub-extension ", sub_extension)
             return ["unreadable non csv file"]
 
+    def _read_first_line(self, bucket_name: str, key: str, requester_pays=False, decompress=False,
+                         initial_bytes: int = 64*1024, max_bytes: int = 16*1024*1024) -> str:
+        """returns the first csv record of an object (without the newline), decoded as utf-8.
+
+        Fetches bytes=0-(initial_bytes-1) first, then the following ranges (doubling in size each time)
+        only if the first line isn't complete yet, stopping at the end of the object or after max_bytes.
+        If decompress=True, the object is gunzipped incrementally as the ranges arrive"""
+
+        object_kwargs = {}
+        if requester_pays:
+            object_kwargs['RequestPayer'] = 'requester'
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if decompress else None
+
+        data = b''
+        start = 0
+        length = initial_bytes
+        while start < max_bytes:
+            try:
+                response = self.s3_client.get_object(Bucket=bucket_name, Key=key, Range=f'bytes={start}-{start+length-1}', **object_kwargs)
+            except self.s3_client.exceptions.ClientError as e:
+                if e.response['Error']['Code'] == 'InvalidRange': #empty object
+                    break
+                raise e
+            chunk = response['Body'].read()
+            data += decompressor.decompress(chunk) if decompressor else chunk
 
-    def download(self, bucket_name : str , key : str, save_location : str, requester_pays=False) -> None:
+            line_end = _first_line_end(data)
+            if line_end != None:
+                data = data[:line_end]
+                break
+            start += len(chunk)
+            total_size = int(response.get('ContentRange', '/' + str(start)).split('/')[-1])
+            if start >= total_size or not chunk or (decompressor and decompressor.eof):
+                break
+            length *= 2
+        return data.decode('utf-8').rstrip('\r')
+
+    @_instrumented
+    def select_rows(self, bucket_name: str, key: str, columns: List[str] = None, where: Dict[str, str] = None,
+                    requester_pays=False, use_select=True) -> Iterator[Dict[str, str]]:
+        """lazily yields the rows of a .csv or .csv.gz file (with a header line) as dictionaries of column name -> value,
+        keeping only the given columns (all of them if columns is None) and the rows where every column in where
+        equals its value (compared as strings, as they're written in the file).
+
+        If use_select is true, the filtering is done by S3 with select_object_content, so only the matching rows are
+        downloaded. If S3 Select can't be used (e.g. it isn't enabled for the account), the whole file is streamed
+        through open() and filtered locally instead, which gives the same rows"""
+        extension, sub_extension = self._get_extensions(key)
+        if not (extension == 'csv' or (extension == 'gz' and sub_extension == 'csv')):
+            raise ValueError(f"select_rows only reads .csv and .csv.gz files, not {key}")
+        where = {column: str(value) for column, value in (where or {}).items()}
+
+        if use_select and bucket_name not in self._select_unavailable:
+            try:
+                records = self._select_records(bucket_name, key, columns, where, gzipped=(extension == 'gz'), requester_pays=requester_pays)
+            except self.s3_client.exceptions.ClientError as e:
+                if e.response['Error']['Code'] in ['NoSuchKey', 'NoSuchBucket', 'AccessDenied']:
+                    raise e
+                if e.response['Error']['Code'] in ['MethodNotAllowed', 'NotImplemented', 'XNotImplemented']:
+                    self._select_unavailable.add(bucket_name) #don't try again for this bucket
+                logger.info("S3 Select failed for %s/%s (%s), filtering locally", bucket_name, key, e.response['Error']['Code'])
+            else:
+                yield from records
+                return
+
+        with self.open(bucket_name, key, requester_pays=requester_pays, mode='r', decompress=(extension == 'gz'),
+                       encoding='utf-8', block_cache=True, cache_blocks=5) as fin: #a forward scan, see _iter_inventory_file
+            reader = csv.DictReader(fin)
+            missing = [column for column in list(columns or []) + list(where) if column not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"{key} has no column(s) {missing}")
+            conditions = list(where.items())
+            for row in reader:
+                if all(row[column] == value for column, value in conditions):
+                    yield row if columns == None else {column: row[column] for column in columns}
+
+    def _select_records(self, bucket_name: str, key: str, columns: List[str], where: Dict[str, str], gzipped=False,
+                        requester_pays=False) -> Iterator[Dict[str, str]]:
+        """makes the select_object_content request for select_rows (so errors are raised right away),
+        and returns a generator of the rows in its response"""
+        def identifier(column):
+            return 's."' + column.replace('"', '""') + '"'
+        def literal(value):
+            return "'" + value.replace("'", "''") + "'"
+
+        expression = 'SELECT ' + (', '.join(identifier(column) for column in columns) if columns else '*') + ' FROM S3Object s'
+        if where:
+            expression += ' WHERE ' + ' AND '.join(f'{identifier(column)} = {literal(value)}' for column, value in where.items())
+
+        self.s3_client.meta.events.register('before-sign.s3.SelectObjectContent', _add_request_payer_header,
+                                            unique_id='ez_aws_select_request_payer')
+        token = _select_request_payer.set(requester_pays)
+        try:
+            response = self.s3_client.select_object_content(
+                Bucket=bucket_name, Key=key, Expression=expression, ExpressionType='SQL',
+                InputSerialization={'CSV': {'FileHeaderInfo': 'USE', 'AllowQuotedRecordDelimiter': True},
+                                    'CompressionType': 'GZIP' if gzipped else 'NONE'},
+                OutputSerialization={'JSON': {'RecordDelimiter': '\n'}})
+        finally:
+            _select_request_payer.reset(token)
+
+        def records():
+            pending = b''
+            for event in response['Payload']:
+                if 'Records' in event:
+                    lines = (pending + event['Records']['Payload']).split(b'\n')
+                    pending = lines.pop() #a record can be split across events
+                    for line in lines:
+                        if line:
+                            yield json.loads(line)
+            if pending.strip():
+                yield json.loads(pending)
+        return records()
+
+
+    @_instrumented
+    def download(self, bucket_name : str , key : str, save_location : str, requester_pays=False,
+                 part_size : int = 8*1024*1024, max_workers : int = 8, verify_md5 = False) -> None:
         """downloads from from S3 to local computer. 
         save_location should be full path, including filename and extension
+
+        Objects larger than part_size are downloaded as ranged GETs, up to max_workers at a time,
+        each written straight into place in a preallocated file (see _download_objects)
         
         Necessarily incurs data transfer out charges"""
-        print(f"save_location: {save_location}")
         #check to make sure the folder exists locally
         outpath = pathlib.Path(save_location)
         outdirectory = outpath.parent
-        print(f"outdirectory: {outdirectory}")
         if not outdirectory.exists():
-            print("Specified directory ", outdirectory.name, " does not exist yet.")
-            print("Creating ", outdirectory.name)
+            logger.info("Specified directory %s does not exist yet. Creating it", outdirectory.name)
             outdirectory.mkdir(parents=True, exist_ok=True)
 
         #download file
-        if self.s3_resources == None:
-            self.s3_resources = self.session.resource('s3')
-        bucket = self.s3_resources.Bucket(bucket_name)
-        extra_args = {}
-        if requester_pays:
-             extra_args['RequestPayer']='requester'
-        response = bucket.download_file(key,save_location, ExtraArgs = extra_args)
-        response = bucket.download_file(key,save_location)
-        print(response)
+        summary = self._download_objects(bucket_name, [({'Key': key}, save_location)], requester_pays=requester_pays,
+                                         part_size=part_size, max_workers=max_workers, skip_existing=False, verify_md5=verify_md5)
+        if summary['failed']:
+            raise summary['failed'][key]
+
+    @_instrumented
+    def download_many(self, bucket_name : str, keys_or_prefix, dest_dir : str, requester_pays=False,
+                      part_size : int = 8*1024*1024, max_workers : int = 16, skip_existing = True, verify_md5 = False) -> Dict:
+        """downloads many files from S3 into dest_dir, sharing one pool of max_workers threads (and one connection pool)
+        between all of them, so thousands of small files and a few huge ones are downloaded equally fast.
+
+        keys_or_prefix is either a list of keys, which are saved at dest_dir/key,
+        or a prefix, in which case every file under it is saved at dest_dir/(key without the prefix)
+
+        If skip_existing=True, files whose local copy already has the same size are not downloaded again
+        (with verify_md5=True, the local copy's MD5 must also match the ETag, when the ETag is an MD5)
 
+        returns a dictionary with the counts of 'downloaded' and 'skipped' files, 'bytes_downloaded', 'bytes_skipped',
+        'seconds', 'bytes_per_second' and 'failed', a dictionary of key to exception for the files that failed"""
+        dest_dir = os.path.abspath(dest_dir)
+        if isinstance(keys_or_prefix, str):
+            prefix = keys_or_prefix
+            objects = self.iter_objects(bucket_name, prefix, requester_pays=requester_pays)
+            relative_key = lambda key: key[len(prefix):].lstrip('/')
+        else:
+            objects = ({'Key': key} for key in keys_or_prefix)
+            relative_key = lambda key: key
+
+        def targets():
+            for obj in objects:
+                if obj['Key'].endswith('/'): #"folder" placeholder objects
+                    continue
+                yield obj, os.path.join(dest_dir, *relative_key(obj['Key']).split('/'))
+
+        return self._download_objects(bucket_name, targets(), requester_pays=requester_pays, part_size=part_size,
+                                      max_workers=max_workers, skip_existing=skip_existing, verify_md5=verify_md5, root_dir=dest_dir)
+
+    def _download_objects(self, bucket_name: str, targets: Iterable[Tuple[Dict, str]], requester_pays=False,
+                          part_size: int = 8*1024*1024, max_workers: int = 16, skip_existing=True, verify_md5=False,
+                          root_dir: str = None) -> Dict:
+        """downloads every (object, local path) in targets on one thread pool.
+
+        Objects only need a 'Key'. If they also have 'Size' and 'ETag' (e.g. from iter_objects), the parts are planned
+        straight away, otherwise the first MiB is fetched to find out the size and ETag.
+        Each file is preallocated under a temporary name and its parts are written into place with os.pwrite
+        as they arrive, then the file is renamed once complete. Every part is requested with IfMatch on the ETag,
+        so an object that changes mid-download fails instead of mixing versions, and the final size is checked"""
+
+        started = time.monotonic()
+        summary = {'downloaded': 0, 'skipped': 0, 'bytes_downloaded': 0, 'bytes_skipped': 0, 'failed': {}}
+        def tally(job: _DownloadJob):
+            if job.error != None:
+                summary['failed'][job.key] = job.error
+            elif job.skipped:
+                summary['skipped'] += 1
+                summary['bytes_skipped'] += job.size
+            else:
+                summary['downloaded'] += 1
+                summary['bytes_downloaded'] += job.size
+
+        def prepare(target):
+            obj, path = target
+            job = _DownloadJob(obj['Key'], path, obj.get('Size'), obj.get('ETag'))
+            try:
+                if root_dir != None and os.path.commonpath([root_dir, os.path.abspath(path)]) != root_dir:
+                    raise ValueError(f"key {job.key} would be saved outside of {root_dir}")
+                self._prepare_download(bucket_name, job, requester_pays, skip_existing, verify_md5)
+            except Exception as e:
+                job.error = e
+            return job
+
+        #part downloads are bounded by slots, so the prepared (but not yet downloaded) files don't pile up
+        pool = ContextThreadPoolExecutor(max_workers=max_workers)
+        slots = threading.BoundedSemaphore(2*max_workers)
+        active = collections.deque()
+        try:
+            for job in _ordered_map(prepare, targets, max_workers, pool=pool):
+                if job.error == None and not job.skipped:
+                    self._start_download(pool, slots, bucket_name, job, requester_pays, part_size, verify_md5)
+                    active.append(job)
+                else:
+                    tally(job)
+                while active and active[0].done.is_set():
+                    tally(active.popleft())
+            for job in active:
+                job.done.wait()
+                tally(job)
+        finally:
+            pool.shutdown(wait=True)
+
+        summary['seconds'] = time.monotonic() - started
+        summary['bytes_per_second'] = summary['bytes_downloaded'] / max(summary['seconds'], 1E-9)
+        return summary
+
+    def _prepare_download(self, bucket_name: str, job: '_DownloadJob', requester_pays=False, skip_existing=True, verify_md5=False) -> None:
+        """fills in job.size and job.etag if they aren't known yet, and marks the job as skipped if the local copy already matches.
+        When the local file doesn't exist, the size comes from a GET of the first MiB, which is kept as the start of the download"""
+        object_kwargs = {'RequestPayer': 'requester'} if requester_pays else {}
+        if job.size == None:
+            if skip_existing and os.path.exists(job.path):
+                header = self.s3_client.head_object(Bucket=bucket_name, Key=job.key, **object_kwargs)
+                job.size, job.etag = header['ContentLength'], header['ETag']
+            else:
+                try:
+                    response = self.s3_client.get_object(Bucket=bucket_name, Key=job.key, Range=f'bytes=0-{1024*1024-1}', **object_kwargs)
+                    job.first_part = response['Body'].read()
+                    job.size = int(response.get('ContentRange', '/' + str(len(job.first_part))).split('/')[-1])
+                    job.etag = response['ETag']
+                except self.s3_client.exceptions.ClientError as e:
+                    if e.response['Error']['Code'] != 'InvalidRange': #empty object
+                        raise e
+                    job.size, job.first_part = 0, b''
+
+        if skip_existing and self._local_copy_matches(job.path, job.size, job.etag, verify_md5):
+            job.skipped = True
+
+    def _start_download(self, pool: ThreadPoolExecutor, slots: threading.BoundedSemaphore, bucket_name: str, job: '_DownloadJob',
+                        requester_pays=False, part_size: int = 8*1024*1024, verify_md5=False) -> None:
+        """preallocates the temporary file of a prepared job and submits its parts to pool"""
+        offset = 0
+        try:
+            directory = os.path.dirname(job.path)
+            if directory: #'' for a bare filename, in the working directory
+                os.makedirs(directory, exist_ok=True)
+            job.fd = os.open(job.temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+            os.ftruncate(job.fd, job.size)
+            if job.first_part:
+                _pwrite(job.fd, job.first_part, 0)
+                offset = len(job.first_part)
+                job.first_part = None
+        except Exception as e:
+            job.remaining = 1
+            self._part_finished(job, verify_md5, e)
+            return
+
+        #one extra count, held while parts are still being submitted, so the job can't finish early
+        ranges = [(first_byte, min(first_byte+part_size, job.size)-1) for first_byte in range(offset, job.size, part_size)]
+        job.remaining = len(ranges) + 1
+        for first_byte, last_byte in ranges:
+            if job.error != None:
+                self._part_finished(job, verify_md5)
+                continue
+            slots.acquire()
+            future = pool.submit(self._download_part, bucket_name, job, first_byte, last_byte, requester_pays)
+            future.add_done_callback(lambda future, job=job: (slots.release(), self._part_finished(job, verify_md5, future.exception())))
+        self._part_finished(job, verify_md5)
+
+    def _download_part(self, bucket_name: str, job: '_DownloadJob', first_byte: int, last_byte: int, requester_pays=False) -> None:
+        """downloads bytes first_byte-last_byte (inclusive) of the object and writes them into place, a MiB at a time"""
+        if job.error != None:
+            return
+        object_kwargs = {'RequestPayer': 'requester'} if requester_pays else {}
+        if job.etag != None:
+            object_kwargs['IfMatch'] = job.etag
+        response = self.s3_client.get_object(Bucket=bucket_name, Key=job.key, Range=f'bytes={first_byte}-{last_byte}', **object_kwargs)
+        offset = first_byte
+        for chunk in response['Body'].iter_chunks(1024*1024):
+            _pwrite(job.fd, chunk, offset)
+            offset += len(chunk)
+        if offset != last_byte+1:
+            raise IOError(f"expected bytes {first_byte}-{last_byte} of {job.key}, but the download stopped at byte {offset}")
+
+    def _part_finished(self, job: '_DownloadJob', verify_md5=False, error: BaseException = None) -> None:
+        """counts down the parts of job, and once they are all done, checks the file and moves it into place"""
+        with job.lock:
+            if error != None and job.error == None:
+                job.error = error
+            job.remaining -= 1
+            if job.remaining > 0:
+                return
+
+        try:
+            if job.fd != None:
+                os.close(job.fd)
+            if job.error == None:
+                if os.path.getsize(job.temporary_path) != job.size:
+                    raise IOError(f"downloaded {job.key} has {os.path.getsize(job.temporary_path)} bytes instead of {job.size}")
+                if verify_md5 and not self._local_copy_matches(job.temporary_path, job.size, job.etag, verify_md5=True):
+                    raise IOError(f"MD5 of downloaded {job.key} doesn't match its ETag {job.etag}")
+                os.replace(job.temporary_path, job.path)
+        except Exception as e:
+            job.error = e
+        finally:
+            if job.error != None and os.path.exists(job.temporary_path):
+                os.remove(job.temporary_path)
+            job.done.set()
+
+    def _local_copy_matches(self, path: str, size: int, etag: str = None, verify_md5=False, part_size: int = None) -> bool:
+        """returns true if the local file at path has the given size and, if verify_md5=True, an MD5 matching the ETag.
+        A multipart ETag (md5 of the parts' md5s, then -number of parts) can only be checked if part_size is the part size it was uploaded with,
+        otherwise only the size is compared"""
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            return False
+        if not verify_md5 or etag == None:
+            return True
+        etag = etag.strip('"')
+        multipart = '-' in etag
+        if multipart and part_size == None:
+            return True
+
+        md5 = hashlib.md5()
+        part_md5s = []
+        with open(path, 'rb') as fin:
+            if multipart:
+                for part in iter(lambda: fin.read(part_size), b''):
+                    part_md5s.append(hashlib.md5(part).digest())
+            else:
+                for chunk in iter(lambda: fin.read(1024*1024), b''):
+                    md5.update(chunk)
+        if multipart:
+            return hashlib.md5(b''.join(part_md5s)).hexdigest() + '-' + str(len(part_md5s)) == etag
+        return md5.hexdigest() == etag
+
+    @_instrumented
     def upload(self, bucket_name : str, key: str, local_file_location: str)-> None:
         """uploads file from local computer to the bucket, with specified key"""
-        if self.s3_resources == None:
-            self.s3_resources = self.session.resource('s3') 
         bucket = self.s3_resources.Bucket(bucket_name)
         bucket.upload_file(local_file_location,key)
 
+    @_instrumented
+    def upload_many(self, bucket_name : str, files : Iterable[Tuple[str, str]], max_workers : int = 16,
+                    multipart_chunksize : int = 8*1024*1024, skip_existing = False) -> Dict:
+        """uploads many local files to the bucket on one shared pool of max_workers threads.
+        files is an iterable of (key, local_file_location) pairs, in the same order as upload().
+        Files larger than multipart_chunksize are uploaded as concurrent multipart uploads.
+
+        If skip_existing=True, files whose size and MD5 (or multipart ETag) already match the remote copy are skipped.
+        The remote copies are found per parent "directory" of the keys (see _find_remote_objects), so keys spread over
+        the bucket don't list all of it.
+
+        returns the same summary as sync_dir_to_s3"""
+        remote = None
+        if skip_existing:
+            files = list(files)
+            remote = self._find_remote_objects(bucket_name, [key for key, _ in files], max_workers)
+        return self._upload_files(bucket_name, ((key, path, None) for key, path in files), remote, max_workers, multipart_chunksize)
+
+    @_instrumented
+    def sync_dir_to_s3(self, local_dir : str, bucket_name : str, prefix : str = "", max_workers : int = 16,
+                       multipart_chunksize : int = 8*1024*1024, skip_existing = True) -> Dict:
+        """uploads every file under local_dir to bucket_name, at prefix + (path relative to local_dir, with / separators).
+
+        The remote prefix is listed once up front, and (if skip_existing=True) files whose size and MD5 (or multipart ETag,
+        for files larger than multipart_chunksize) already match are skipped. The directory tree is walked lazily,
+        and the rest of the files are uploaded on one shared pool of max_workers threads, large files as multipart uploads.
+
+        returns a dictionary with the counts of 'uploaded' and 'skipped' files, 'bytes_uploaded', 'bytes_skipped',
+        'seconds', 'bytes_per_second' and 'failed', a dictionary of key to exception for the files that failed"""
+        remote = self._list_remote_objects(bucket_name, prefix, max_workers) if skip_existing else None
+
+        def walk(directory):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from walk(entry.path)
+                    elif entry.is_file():
+                        relative = os.path.relpath(entry.path, local_dir).replace(os.sep, '/')
+                        yield prefix + relative, entry.path, entry.stat().st_size
+
+        return self._upload_files(bucket_name, walk(local_dir), remote, max_workers, multipart_chunksize)
+
+    def _list_remote_objects(self, bucket_name: str, prefix: str, max_workers: int = 1) -> Dict[str, Tuple[int, str]]:
+        """returns {key: (size, etag)} for every object under prefix, from a single listing pass"""
+        return {obj['Key']: (obj['Size'], obj['ETag']) for obj in self.iter_objects(bucket_name, prefix, max_workers=max_workers)}
+
+    def _find_remote_objects(self, bucket_name: str, keys: List[str], max_workers: int = 1, max_heads: int = 20) -> Dict[str, Tuple[int, str]]:
+        """returns {key: (size, etag)} for the keys that exist in the bucket.
+        Keys are grouped by parent prefix (up to their last '/'). Groups of up to max_heads keys get a head_object each,
+        and bigger groups list their parent once, with Delimiter='/' so sub-prefixes aren't listed.
+        The groups are looked up on max_workers threads"""
+        groups = collections.defaultdict(list)
+        for key in keys:
+            groups[key[:key.rfind('/') + 1]].append(key)
+
+        def head(key):
+            try:
+                header = self.s3_client.head_object(Bucket=bucket_name, Key=key)
+            except self.s3_client.exceptions.ClientError as e:
+                if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                    return {}
+                raise e
+            return {key: (header['ContentLength'], header['ETag'])}
+
+        def list_parent(parent):
+            found = {}
+            kwargs = {'Prefix': parent, 'Delimiter': '/'}
+            while True:
+                page = self._list_objects_page(bucket_name, **kwargs)
+                found.update((obj['Key'], (obj['Size'], obj['ETag'])) for obj in page.get('Contents', []))
+                if not page['IsTruncated']:
+                    return found
+                kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+        lookups = [(head, key) for group in groups.values() if len(group) <= max_heads for key in group]
+        lookups += [(list_parent, parent) for parent, group in groups.items() if len(group) > max_heads]
+        remote = {}
+        for found in _ordered_map(lambda lookup: lookup[0](lookup[1]), lookups, max_workers):
+            remote.update(found)
+        return remote
+
+    def _upload_files(self, bucket_name: str, files: Iterable[Tuple[str, str, int]], remote: Dict[str, Tuple[int, str]] = None,
+                      max_workers: int = 16, multipart_chunksize: int = 8*1024*1024) -> Dict:
+        """uploads (key, local path, size) files with one s3transfer TransferManager, skipping the ones that match remote.
+        The sizes (if None) and MD5s for the skip check are found on a thread pool, ahead of the uploads"""
+
+        started = time.monotonic()
+        summary = {'uploaded': 0, 'skipped': 0, 'bytes_uploaded': 0, 'bytes_skipped': 0, 'failed': {}}
+
+        def check(file):
+            """returns (key, path, size, skip), where skip is an exception if the file can't be read"""
+            key, path, size = file
+            try:
+                if size == None:
+                    size = os.path.getsize(path)
+                if remote == None or remote.get(key, (None, None))[0] != size:
+                    return key, path, size, False
+                return key, path, size, self._local_copy_matches(path, size, remote[key][1], verify_md5=True, part_size=multipart_chunksize)
+            except OSError as e:
+                return key, path, size, e
+
+        def tally(key, size, future):
+            try:
+                future.result()
+                summary['uploaded'] += 1
+                summary['bytes_uploaded'] += size
+            except Exception as e:
+                summary['failed'][key] = e
+
+        from boto3.s3.transfer import TransferConfig
+        from s3transfer.manager import TransferManager
+        config = TransferConfig(multipart_threshold=multipart_chunksize, multipart_chunksize=multipart_chunksize, max_concurrency=max_workers)
+        active = collections.deque()
+        with TransferManager(self.s3_client, config, executor_cls=ContextThreadPoolExecutor) as manager:
+            for key, path, size, skip in _ordered_map(check, files, max_workers):
+                if isinstance(skip, Exception):
+                    summary['failed'][key] = skip
+                    continue
+                if skip:
+                    summary['skipped'] += 1
+                    summary['bytes_skipped'] += size
+                    continue
+                active.append((key, size, manager.upload(path, bucket_name, key)))
+                while active and active[0][2].done():
+                    tally(*active.popleft())
+            while active:
+                tally(*active.popleft())
+
+        summary['seconds'] = time.monotonic() - started
+        summary['bytes_per_second'] = summary['bytes_uploaded'] / max(summary['seconds'], 1E-9)
+        return summary
+
+    @_instrumented
     def copy_within_aws(self, source_bucket_name : str , dest_bucket_name :str , source_file_key: str, dest_file_key = None)-> None:
         """copies file_key from source_bucket to dest_bucket within s3 
         (so never downloaded locally)"""
         if dest_file_key == None:
             dest_file_key = source_file_key
 
-        if self.s3_resources == None:
-            self.s3_resources = self.session.resource('s3')
-
         dest_bucket = self.s3_resources.Bucket(dest_bucket_name)
         source = {'Bucket': source_bucket_name, 'Key': source_file_key}
         dest_bucket.copy(
@@ -438,7 +1623,142 @@ class AWS:
         )
     
 
-    def open(self, bucket_name: str, key: str, requester_pays=False, mode='rb', decompress=False, encoding=None):
+    @_instrumented
+    def copy_prefix(self, source_bucket_name : str, source_prefix : str, dest_bucket_name : str, dest_prefix : str = "",
+                    max_workers : int = 16, multipart_threshold : int = 256*1024*1024, part_size : int = 64*1024*1024,
+                    skip_identical = True, dry_run = False) -> Dict:
+        """copies every file under source_prefix in source_bucket to dest_prefix + (key without source_prefix) in dest_bucket, within s3
+        (so never downloaded locally). Like copy_within_aws, the destination bucket owner gets full control of the copies.
+
+        The source is listed once, and the copies are fanned out on max_workers threads: a CopyObject for files up to
+        multipart_threshold, and a multipart upload with parallel UploadPartCopy parts (of part_size) for larger ones.
+
+        If skip_identical=True, the destination is also listed once, and files that already have the same size and ETag
+        there are skipped (the ETag of a multipart copy differs from its source, so for those the destination just has to be newer).
+        If dry_run=True, nothing is copied, and the summary reports what would have been.
+
+        returns a dictionary with the counts of 'copied' and 'skipped' files, 'bytes_copied', 'bytes_skipped',
+        'seconds', 'bytes_per_second' and 'failed', a dictionary of source key to exception for the files that failed"""
+
+        started = time.monotonic()
+        summary = {'copied': 0, 'skipped': 0, 'bytes_copied': 0, 'bytes_skipped': 0, 'failed': {}}
+        summary_lock = threading.Lock()
+        def finished(key: str, size: int, error: BaseException = None):
+            with summary_lock:
+                if error != None:
+                    summary['failed'][key] = error
+                else:
+                    summary['copied'] += 1
+                    summary['bytes_copied'] += size
+
+        dest_objects = {}
+        if skip_identical:
+            dest_objects = {obj['Key']: obj for obj in self.iter_objects(dest_bucket_name, dest_prefix, max_workers=max_workers)}
+
+        #requests are bounded by slots, so a huge listing doesn't queue up millions of copies
+        pool = ContextThreadPoolExecutor(max_workers=max_workers)
+        slots = threading.BoundedSemaphore(2*max_workers)
+        def submit(function, on_done):
+            slots.acquire()
+            future = pool.submit(function)
+            future.add_done_callback(lambda future: (slots.release(), on_done(future.exception())))
+
+        try:
+            for obj in self.iter_objects(source_bucket_name, source_prefix, max_workers=max_workers):
+                dest_key = dest_prefix + obj['Key'][len(source_prefix):]
+                if self._is_identical_copy(obj, dest_objects.get(dest_key)):
+                    summary['skipped'] += 1
+                    summary['bytes_skipped'] += obj['Size']
+                    continue
+                if dry_run:
+                    finished(obj['Key'], obj['Size'])
+                    continue
+
+                source = {'Bucket': source_bucket_name, 'Key': obj['Key']}
+                on_done = lambda error, obj=obj: finished(obj['Key'], obj['Size'], error)
+                if obj['Size'] <= multipart_threshold:
+                    submit(lambda source=source, dest_key=dest_key: self.s3_client.copy_object(
+                                Bucket=dest_bucket_name, Key=dest_key, CopySource=source, ACL='bucket-owner-full-control'),
+                           on_done)
+                else:
+                    try:
+                        self._start_multipart_copy(submit, source, dest_bucket_name, dest_key, obj['Size'], part_size, on_done)
+                    except Exception as e:
+                        on_done(e)
+        finally:
+            pool.shutdown(wait=True)
+
+        summary['seconds'] = time.monotonic() - started
+        summary['bytes_per_second'] = summary['bytes_copied'] / max(summary['seconds'], 1E-9)
+        return summary
+
+    def _is_identical_copy(self, source: Dict, dest: Dict) -> bool:
+        """returns true if dest (a list_objects_v2 'Contents' element, or None) already is a copy of source"""
+        if dest == None or dest['Size'] != source['Size']:
+            return False
+        if dest['ETag'] == source['ETag']:
+            return True
+        multipart = '-' in dest['ETag'] or '-' in source['ETag']
+        return multipart and dest['LastModified'] >= source['LastModified']
+
+    def _start_multipart_copy(self, submit, source: Dict, dest_bucket_name: str, dest_key: str, size: int, part_size: int, on_done) -> None:
+        """starts a multipart upload copying source, and submits its UploadPartCopy parts through submit(function, on_done).
+        Whichever part finishes last completes the upload (or aborts it if any part failed) and then calls on_done(error)"""
+        header = self.s3_client.head_object(**source)
+        create_kwargs = {name: header[name] for name in ('ContentType', 'ContentEncoding', 'ContentDisposition',
+                                                          'ContentLanguage', 'CacheControl', 'Expires') if name in header}
+        upload_id = self.s3_client.create_multipart_upload(Bucket=dest_bucket_name, Key=dest_key, ACL='bucket-owner-full-control',
+                                                           Metadata=header.get('Metadata', {}), **create_kwargs)['UploadId']
+
+        part_size = max(part_size, -(-size // 10000)) #s3 allows at most 10000 parts
+        ranges = [(first_byte, min(first_byte+part_size, size)-1) for first_byte in range(0, size, part_size)]
+        etags = [None]*len(ranges)
+        state = {'remaining': len(ranges), 'error': None}
+        lock = threading.Lock()
+
+        def copy_part(number, first_byte, last_byte):
+            response = self.s3_client.upload_part_copy(Bucket=dest_bucket_name, Key=dest_key, UploadId=upload_id, PartNumber=number,
+                                                       CopySource=source, CopySourceRange=f'bytes={first_byte}-{last_byte}')
+            etags[number-1] = response['CopyPartResult']['ETag']
+
+        def part_done(error):
+            with lock:
+                if error != None and state['error'] == None:
+                    state['error'] = error
+                state['remaining'] -= 1
+                if state['remaining'] > 0:
+                    return
+            try:
+                if state['error'] != None:
+                    self.s3_client.abort_multipart_upload(Bucket=dest_bucket_name, Key=dest_key, UploadId=upload_id)
+                else:
+                    parts = [{'ETag': etag, 'PartNumber': number} for number, etag in enumerate(etags, 1)]
+                    self.s3_client.complete_multipart_upload(Bucket=dest_bucket_name, Key=dest_key, UploadId=upload_id,
+                                                             MultipartUpload={'Parts': parts})
+            except Exception as e:
+                if state['error'] == None:
+                    state['error'] = e
+            on_done(state['error'])
+
+        for number, (first_byte, last_byte) in enumerate(ranges, 1):
+            submit(lambda number=number, first_byte=first_byte, last_byte=last_byte: copy_part(number, first_byte, last_byte), part_done)
+
+    @_instrumented
+    def open(self, bucket_name: str, key: str, requester_pays=False, mode='rb', decompress=False, encoding=None,
+             block_cache=False, block_size: int = 8*1024*1024, cache_blocks: int = 16, prefetch_blocks: int = 4,
+             parallel_write=False, part_size: int = 8*1024*1024, max_workers: int = 4, max_in_flight_parts: int = 8):
+        """opens an S3 object as a file, for reading ('rb', 'r') or writing ('wb', 'w').
+        If decompress is true, gz files are (de)compressed on the fly.
+
+        If block_cache is true (reading only), the object is read in ranged GETs of block_size bytes through a BlockReader:
+        the last cache_blocks blocks are cached, so seeking back to them is free, and while reading in order the next
+        prefetch_blocks blocks are fetched in the background. The BlockReader is the block_reader attribute of the
+        returned file, and its stats() show the bytes fetched vs bytes served
+
+        If parallel_write is true (writing only), the object is written through a MultipartWriter: parts of part_size bytes
+        are uploaded max_workers at a time, with at most max_in_flight_parts in memory, and with decompress, gz files are
+        compressed in blocks on the same threads (as a multi-member gzip file). The MultipartWriter is the multipart_writer
+        attribute of the returned file. Closing the file completes the upload, and an error aborts it"""
         
         supported_modes = ['rb', 'wb', 'r', 'w']
         if mode not in supported_modes:
@@ -451,44 +1771,314 @@ class AWS:
 
         binary_mode = mode[0] + 'b'
         #open the binary version
-        result = sos3.open(
-            bucket_id = bucket_name,
-            key_id = key,
-            session = self.session,
-            mode=binary_mode,
-            object_kwargs = object_kwargs
-        )
+        block_reader = None
+        multipart_writer = None
+        if parallel_write and binary_mode == 'wb':
+            compress = decompress and self._get_extensions(key)[0] == 'gz'
+            multipart_writer = MultipartWriter(self.s3_client, bucket_name, key, object_kwargs, compress=compress, part_size=part_size,
+                                               max_workers=max_workers, max_in_flight_parts=max_in_flight_parts)
+            result = multipart_writer
+        elif block_cache and binary_mode == 'rb':
+            block_reader = BlockReader(self.s3_client, bucket_name, key, object_kwargs, block_size=block_size,
+                                       cache_blocks=cache_blocks, prefetch_blocks=prefetch_blocks)
+            result = io.BufferedReader(block_reader, buffer_size=min(block_size, 1024*1024))
+        else:
+            import smart_open.s3 as sos3
+            #the shared client, so open() gets the same connection pool, retries, metrics and concurrency limits as everything else
+            client_kwargs = {'S3.Client.' + method: object_kwargs for method in
+                             ['get_object', 'head_object', 'put_object', 'create_multipart_upload', 'upload_part',
+                              'complete_multipart_upload', 'abort_multipart_upload']}
+            result = sos3.open(
+                bucket_id = bucket_name,
+                key_id = key,
+                mode=binary_mode,
+                client = self.s3_client,
+                client_kwargs = client_kwargs
+            )
 
         if mode in ['r', 'w']:
             if encoding==None:
-                print("set encoding to utf-8 because user specified 'r' or 'w' mode but not encoding type")
+                logger.info("set encoding to utf-8 because user specified 'r' or 'w' mode but not encoding type")
                 encoding='utf-8'
 
-        #decompress
-        if decompress:
-            extension, sub_extension = self._get_extensions(key)
-            if extension== 'gz':
-                if encoding!= None:
-                    gzip_mode = mode[0] + 't' #text mdoe
+        try:
+            #decompress
+            if decompress:
+                extension, sub_extension = self._get_extensions(key)
+                if extension== 'gz':
+                    if encoding!= None:
+                        gzip_mode = mode[0] + 't' #text mdoe
+                    else:
+                        gzip_mode = mode[0] #binary for gzip
+                    if multipart_writer != None: #already compressing
+                        if encoding != None:
+                            result = MultipartTextWriter(buffer = result, encoding=encoding)
+                    else:
+                        result = gzip.open(result, mode=gzip_mode, encoding = encoding)
+                elif extension == '7z':
+                    raise NotImplementedError("Have not implemented 7z decompress in ez_aws.open yet")
+                elif extension in ['txt', 'csv']:
+                    logger.warning("user requested to decompress file %s, but decompress is not necessary for file with extension %s", key, extension)
                 else:
-                    gzip_mode = mode[0] #binary for gzip
-                result = gzip.open(result, mode=gzip_mode, encoding = encoding)
-            elif extension == '7z':
-                raise NotImplementedError("Have not implemented 7z decompress in ez_aws.open yet")
-            elif extension in ['txt', 'csv']:
-                print(f"user requseted to decompress file {key}, but decompress is not necessary for file with extension {extension}")
-            else:
-                raise NotImplementedError("ez_aws library only decompresses/compresses gz files currently")
-        else: #no need to decompress
-           if encoding!= None: #transform into decoded stream if you want
-               print("Converting to textio wrapper with encoding =", encoding)
-               result = io.TextIOWrapper(
-                   buffer = result,
-                   encoding=encoding,
-               )
+                    raise NotImplementedError("ez_aws library only decompresses/compresses gz files currently")
+            else: #no need to decompress
+               if encoding!= None: #transform into decoded stream if you want
+                   logger.info("Converting to textio wrapper with encoding = %s", encoding)
+                   text_wrapper = MultipartTextWriter if multipart_writer != None else io.TextIOWrapper
+                   result = text_wrapper(
+                       buffer = result,
+                       encoding=encoding,
+                   )
+        except BaseException:
+            if multipart_writer != None: #don't create the object
+                multipart_writer.terminate()
+            raise
+        if block_reader != None:
+            result.block_reader = block_reader
+        if multipart_writer != None:
+            result.multipart_writer = multipart_writer
         return result
        
 
+    def _list_objects_page(self, bucket_name: str, requester_pays=False, **kwargs) -> Dict:
+        """makes a single list_objects_v2 call of up to 1000 keys.
+        kwargs (Prefix, Delimiter, StartAfter, ContinuationToken) are passed straight through"""
+        if requester_pays:
+            kwargs['RequestPayer'] = 'requester'
+        return self.s3_client.list_objects_v2(Bucket=bucket_name, MaxKeys=1000, **kwargs)
+
+    def _iter_pages(self, bucket_name: str, prefix: str = "", requester_pays=False, max_workers: int = 1, prefetch_pages: int = 1,
+                    start_after: str = None):
+        """_iter_object_pages, with up to prefetch_pages pages fetched ahead in a background thread"""
+        pages = self._iter_object_pages(bucket_name, prefix, requester_pays=requester_pays, max_workers=max_workers, start_after=start_after)
+        if prefetch_pages > 0:
+            pages = _prefetch(pages, prefetch_pages)
+        return pages
+
+    def _iter_object_pages(self, bucket_name: str, prefix: str = "", requester_pays=False, max_workers: int = 1, start_after: str = None):
+        """yields lists of object dicts (as returned in list_objects_v2 'Contents') for every key under prefix
+        (and after start_after, if given), in key order.
+
+        The first page is always listed directly, so small prefixes cost a single request.
+        If it is truncated and max_workers > 1, the rest of the key space is split into shards
+        (see _plan_list_shards) which are listed on a thread pool and yielded back in key order (see _list_shards).
+        Otherwise the listing continues serially with the continuation token"""
+        kwargs = {'Prefix': prefix}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        page = self._list_objects_page(bucket_name, requester_pays, **kwargs)
+        contents = page.get('Contents', [])
+        yield contents
+
+        if max_workers <= 1 or not contents:
+            while page['IsTruncated']:
+                page = self._list_objects_page(bucket_name, requester_pays, ContinuationToken=page['NextContinuationToken'], **kwargs)
+                yield page.get('Contents', [])
+            return
+        if not page['IsTruncated']:
+            return
+
+        with ContextThreadPoolExecutor(max_workers=max_workers) as pool:
+            shards = self._plan_list_shards(pool, bucket_name, prefix, [obj['Key'] for obj in contents], requester_pays, target=4*max_workers)
+            yield from self._list_shards(pool, bucket_name, shards, requester_pays, max_in_flight=2*max_workers)
+
+    def _plan_list_shards(self, pool: ThreadPoolExecutor, bucket_name: str, prefix: str, sample: List[str],
+                          requester_pays=False, target: int = 32, max_depth: int = 3) -> List[Dict]:
+        """splits every key under prefix after the keys of sample (the first page, already listed) into an ordered list of shards.
+
+        Each shard is either {'objects': [...]} (keys already returned during discovery) or
+        {'prefix', 'start_after', 'end_at'}, which covers the keys under 'prefix' with start_after < key <= end_at.
+        Shards marked 'expand' are walked one level at a time with Delimiter='/' (see _expand_shard),
+        until there are at least target shards or max_depth levels have been discovered"""
+        shards = [{'prefix': prefix, 'start_after': sample[-1], 'end_at': None, 'expand': True}]
+        for _ in range(max_depth):
+            expandable = [shard for shard in shards if shard.get('expand')]
+            if not expandable or sum('prefix' in shard for shard in shards) >= target:
+                break
+            share = max(2, -(-target // len(expandable)))
+            expansions = iter(pool.map(lambda shard: self._expand_shard(bucket_name, shard, requester_pays, share, sample), expandable))
+            shards = [part for shard in shards for part in (next(expansions) if shard.get('expand') else [shard])]
+        return shards
+
+    def _expand_shard(self, bucket_name: str, shard: Dict, requester_pays=False, target: int = 32, sample: List[str] = ()) -> List[Dict]:
+        """lists one level of an expandable shard with Delimiter='/' and returns the shards that replace it, in key order.
+        If a truncated page ends with a key rather than a common prefix, the directory is flat,
+        so the remainder is split by StartAfter boundaries instead of paging through it serially.
+        Once a level has more than target common prefixes, those that hold less than a page each (estimated from sample,
+        see _keys_per_prefix) aren't walked to its end: runs of them are merged into range shards of about a page each,
+        or into about target range shards if the sample doesn't tell"""
+        prefix, start_after = shard['prefix'], shard['start_after']
+        kwargs = {'Prefix': prefix, 'Delimiter': '/'}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+
+        #the common prefix holding start_after is only partly listed, and S3 does not return it after StartAfter
+        result = []
+        partial_prefix = None
+        if start_after and start_after.find('/', len(prefix)) != -1:
+            partial_prefix = start_after[:start_after.find('/', len(prefix))+1]
+            result.append({'prefix': partial_prefix, 'start_after': start_after, 'end_at': None, 'expand': True})
+
+        names = [] #every key and common prefix of the level listed so far
+        prefix_count = 0
+        merge_step = None
+        while True:
+            page = self._list_objects_page(bucket_name, requester_pays, **kwargs)
+            entries = [(obj['Key'], {'objects': [obj]}) for obj in page.get('Contents', [])]
+            for common_prefix in page.get('CommonPrefixes', []):
+                sub_prefix = common_prefix['Prefix']
+                if sub_prefix != partial_prefix:
+                    entries.append((sub_prefix, {'prefix': sub_prefix, 'start_after': None, 'end_at': None, 'expand': True}))
+            entries.sort(key=lambda entry: entry[0])
+            names.extend(name for name, _ in entries)
+            prefix_count += sum('prefix' in entry for _, entry in entries)
+
+            truncated = page['IsTruncated'] and entries
+            if prefix_count > target and merge_step == None:
+                keys_per_prefix = self._keys_per_prefix(prefix, sample)
+                merge_step = -(-len(names) // target) if keys_per_prefix == None else math.ceil(1000 / keys_per_prefix)
+            if merge_step != None and merge_step > 1:
+                return self._merge_level(prefix, start_after, names, merge_step, truncated)
+
+            for _, entry in entries:
+                if 'objects' in entry and result and 'objects' in result[-1]:
+                    result[-1]['objects'].extend(entry['objects'])
+                else:
+                    result.append(entry)
+
+            if not truncated:
+                return result
+            if 'objects' in entries[-1][1]:
+                return result + self._split_key_range(prefix, entries[-1][0], entries[0][0])
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+    def _merge_level(self, prefix: str, start_after: str, names: List[str], step: int, truncated: bool) -> List[Dict]:
+        """returns range shards covering the keys under prefix after start_after, cut at every step-th key or
+        common prefix in names (a sorted, partial listing of the level with Delimiter='/').
+        Cutting at a common prefix puts the keys under it in the next range. If the level was truncated,
+        the ranges after the last cut are split by StartAfter boundaries, as for a flat directory"""
+        boundaries = names[step-1:-1:step] or names[:1]
+        shards = []
+        lower = start_after
+        for boundary in boundaries:
+            shards.append({'prefix': prefix, 'start_after': lower, 'end_at': boundary})
+            lower = boundary
+        if truncated:
+            return shards + self._split_key_range(prefix, lower, names[0])
+        shards.append({'prefix': prefix, 'start_after': lower, 'end_at': None})
+        return shards
+
+    @staticmethod
+    def _keys_per_prefix(prefix: str, sample: List[str]) -> float:
+        """estimates the number of keys under each common prefix of the level under prefix, from sample
+        (the keys of the first page), or returns None if no key of sample is under one of them.
+        The last common prefix of sample may go on past it, so it only counts if it's the only one"""
+        counts = collections.Counter(key[:key.find('/', len(prefix))] for key in sample
+                                     if key.startswith(prefix) and key.find('/', len(prefix)) != -1)
+        if not counts:
+            return None
+        sizes = list(counts.values()) #in key order
+        if len(sizes) > 1:
+            sizes.pop()
+        return sum(sizes) / len(sizes)
+
+    def _split_key_range(self, prefix: str, start_after: str, sample_key: str, end_at: str = None) -> List[Dict]:
+        """returns range shards that together cover every key under prefix with start_after < key <= end_at
+        (or every key after start_after, if end_at is None).
+
+        Boundaries are start_after with one character bumped up, at the last two positions before start_after and
+        sample_key (an earlier key) diverge, and the last range takes everything after them. E.g. after 'logs/2023-01-15'
+        (sampled at 'logs/2023-01-12') this gives ranges for the rest of the month, ten days at a time, then one for every
+        later month and year, which _list_shards splits again if it turns out large. So date or counter style keys split evenly"""
+        diverge = len(os.path.commonprefix([start_after, sample_key]))
+        boundaries = []
+        for position in range(max(len(prefix), diverge - 2), min(diverge, len(start_after))):
+            current = start_after[position]
+            for alphabet in _SHARD_ALPHABETS:
+                if current in alphabet:
+                    boundaries.extend(start_after[:position] + char for char in alphabet if char > current)
+                    break
+        boundaries = sorted(boundary for boundary in boundaries if end_at == None or boundary < end_at)
+
+        shards = []
+        lower = start_after
+        for boundary in boundaries:
+            shards.append({'prefix': prefix, 'start_after': lower, 'end_at': boundary})
+            lower = boundary
+        shards.append({'prefix': prefix, 'start_after': lower, 'end_at': end_at})
+        return shards
+
+    def _list_shards(self, pool: ThreadPoolExecutor, bucket_name: str, shards: List[Dict], requester_pays=False,
+                     max_in_flight: int = 16, max_pages: int = 4) -> Iterator[List[Dict]]:
+        """yields the pages of every shard from _plan_list_shards, in key order.
+
+        The first max_in_flight shards are listed ahead on pool, up to max_pages pages each, so only that many pages
+        are held at a time. A shard still truncated after max_pages pages is split again (see _list_shard) and the
+        pieces of its rest take its place in line, so a shard holding most of the keys is listed in parallel too"""
+        window = collections.deque(shards) #shards, futures of (pages, rest of the shard) and lists of pages, in key order
+        try:
+            while window:
+                index = 0
+                while index < min(max_in_flight, len(window)):
+                    entry = window[index]
+                    if isinstance(entry, dict) and 'objects' not in entry:
+                        window[index] = pool.submit(self._collect_shard, bucket_name, entry, requester_pays, max_pages)
+                    elif isinstance(entry, Future) and entry.done():
+                        pages, rest = entry.result()
+                        window[index] = pages
+                        for offset, shard in enumerate(rest, 1):
+                            window.insert(index + offset, shard)
+                    index += 1
+                if isinstance(window[0], Future): #not listed yet
+                    wait([entry for entry in window if isinstance(entry, Future)], return_when=FIRST_COMPLETED)
+                    continue
+                head = window.popleft()
+                if isinstance(head, dict):
+                    yield head['objects']
+                else:
+                    yield from head
+        finally:
+            for entry in window:
+                if isinstance(entry, Future):
+                    entry.cancel()
+
+    def _collect_shard(self, bucket_name: str, shard: Dict, requester_pays=False, max_pages: int = None) -> Tuple[List[List[Dict]], List[Dict]]:
+        """returns (the pages of _list_shard, the shards covering the rest of it)"""
+        listing = self._list_shard(bucket_name, shard, requester_pays, max_pages)
+        pages = []
+        while True:
+            try:
+                pages.append(next(listing))
+            except StopIteration as stop:
+                return pages, stop.value
+
+    def _list_shard(self, bucket_name: str, shard: Dict, requester_pays=False, max_pages: int = None) -> Iterator[List[Dict]]:
+        """yields the pages of objects in a shard from _plan_list_shards, in key order.
+        If the shard is still truncated after max_pages pages, it stops there and returns (as the generator's value)
+        range shards covering the rest, split by _split_key_range. Otherwise it returns an empty list"""
+        prefix, end_at = shard['prefix'], shard['end_at']
+        kwargs = {'Prefix': prefix}
+        if shard['start_after']:
+            kwargs['StartAfter'] = shard['start_after']
+
+        first_key = None
+        pages = 0
+        while True:
+            page = self._list_objects_page(bucket_name, requester_pays, **kwargs)
+            contents = page.get('Contents', [])
+            if end_at != None and contents and contents[-1]['Key'] > end_at:
+                yield [obj for obj in contents if obj['Key'] <= end_at]
+                return []
+            yield contents
+            if not page['IsTruncated'] or not contents:
+                return []
+            pages += 1
+            if first_key == None:
+                first_key = contents[0]['Key']
+            if max_pages != None and pages >= max_pages:
+                return self._split_key_range(prefix, contents[-1]['Key'], first_key, end_at)
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
     def _get_extensions(self, filename: str)-> Tuple[str,str]:
         """returns extension, sub_extension of a file.
         E.g. if a file is "Hello.csv.gz", the extension would be .gz and the sub-extension would be .csv"""
@@ -505,20 +2095,28 @@ class AWS:
 
         return extension, sub_extension
 
-    if success_so7z:
-        def get_7zip_archive(self, bucket_name: str, key: str, password : str = None, requester_pays=False) -> so7z.SmartOpen7z:
-            """Returns a SmartOpen7z object (an archive), given parameters.
-            If it is password protected, then you must enter a password to decrypt it."""
+    @_instrumented
+    def get_7zip_archive(self, bucket_name: str, key: str, password : str = None, requester_pays=False,
+                         block_size: int = 1024*1024, cache_blocks: int = 64) -> 'so7z.SmartOpen7z':
+        """Returns a SmartOpen7z object (an archive), given parameters.
+        If it is password protected, then you must enter a password to decrypt it.
+        The archive is read through open(block_cache=True), so jumping between the footer and the data doesn't re-fetch blocks.
 
-            file = self.open(
-                    bucket_name =bucket_name,
-                    key=key,
-                    requester_pays=requester_pays,
-                    mode='rb'
-            )
+        Needs the optional so7z package. Note that, for unknown reasons, so7z will not import properly in IPython/Jupyter
+        even when it loads properly in the interpreter."""
+        import so7z
 
-            return so7z.SmartOpen7z(
-                file=file,
-                password=password
-            )
+        file = self.open(
+                bucket_name =bucket_name,
+                key=key,
+                requester_pays=requester_pays,
+                mode='rb',
+                block_cache=True,
+                block_size=block_size,
+                cache_blocks=cache_blocks
+        )
 
+        return so7z.SmartOpen7z(
+            file=file,
+            password=password
+        )
@@ -0,0 +1,148 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+from typing import Dict
+
+
+#caches that are still open, so whatever they haven't committed yet is committed when the interpreter exits
+_open_caches = weakref.WeakSet()
+
+@atexit.register
+def _flush_open_caches() -> None:
+    for cache in list(_open_caches):
+        try:
+            cache.flush()
+        except Exception: #e.g. the database was deleted; nothing left to save it to
+            pass
+
+
+class MetadataCache:
+    """On-disk (SQLite) cache of object index rows, such as the ones made by AWS.get_obj_index and AWS.get_key_index.
+
+    An entry is only returned if the (bucket, key, ETag, size) of the object still match the ones it was stored with,
+    so any change to the object is a miss. Each (bucket, key) keeps a single entry, and once there are more than
+    max_entries, the least recently used ones are evicted.
+
+    Pass it to AWS(metadata_cache=...) to skip the GET requests for column names of unchanged objects.
+
+    Writes are committed in batches (every commit_every writes or commit_interval seconds, whichever comes first),
+    and AWS flushes the cache at the end of get_file_index, iter_file_index and get_key_index. Call close()
+    (or use it in a with block) when you're done with it; caches left open are flushed when the interpreter exits"""
+
+    def __init__(self, directory: str = None, max_entries: int = 1000000, filename: str = 'metadata_cache.sqlite3',
+                 commit_every: int = 1000, commit_interval: float = 5.0):
+        """directory defaults to $XDG_CACHE_HOME/ez_aws (or ~/.cache/ez_aws), and is created if it doesn't exist yet"""
+        if directory == None:
+            directory = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'ez_aws')
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, filename)
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        self._last_commit = time.monotonic()
+        self._closed = False
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS objects ('
+            'bucket TEXT NOT NULL, key TEXT NOT NULL, etag TEXT NOT NULL, size INTEGER NOT NULL, '
+            'row TEXT NOT NULL, last_used INTEGER NOT NULL, PRIMARY KEY (bucket, key))')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS objects_last_used ON objects (last_used)')
+        self._connection.commit()
+        self._entries = self._connection.execute('SELECT COUNT(*) FROM objects').fetchone()[0]
+        self._clock = self._connection.execute('SELECT COALESCE(MAX(last_used), 0) FROM objects').fetchone()[0]
+        _open_caches.add(self)
+
+    def get(self, bucket: str, key: str, etag: str, size: int) -> Dict:
+        """returns the cached row for this version of the object, or None if it isn't cached"""
+        with self._lock:
+            found = self._connection.execute(
+                'SELECT row FROM objects WHERE bucket=? AND key=? AND etag=? AND size=?',
+                (bucket, key, etag, size)).fetchone()
+            if found == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._clock += 1
+            self._connection.execute('UPDATE objects SET last_used=? WHERE bucket=? AND key=?', (self._clock, bucket, key))
+            self._wrote()
+            return json.loads(found[0])
+
+    def put(self, bucket: str, key: str, etag: str, size: int, row: Dict) -> None:
+        """stores row for this version of the object, replacing any older version of it"""
+        with self._lock:
+            self._clock += 1
+            replaced = self._connection.execute('SELECT 1 FROM objects WHERE bucket=? AND key=?', (bucket, key)).fetchone()
+            self._connection.execute(
+                'INSERT OR REPLACE INTO objects (bucket, key, etag, size, row, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                (bucket, key, etag, size, json.dumps(row), self._clock))
+            if replaced == None:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                self._evict()
+            self._wrote()
+
+    def _evict(self) -> None:
+        """removes the least recently used entries, down to 90% of max_entries so eviction doesn't run on every put"""
+        excess = self._entries - int(self.max_entries * 0.9)
+        self._connection.execute(
+            'DELETE FROM objects WHERE rowid IN (SELECT rowid FROM objects ORDER BY last_used LIMIT ?)', (excess,))
+        self._entries -= excess
+        self.evictions += excess
+
+    def _wrote(self) -> None:
+        """commits once every commit_every writes or commit_interval seconds, since committing every single one is slow"""
+        self._pending_writes += 1
+        if self._pending_writes >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval:
+            self._commit()
+
+    def _commit(self) -> None:
+        self._connection.commit()
+        self._pending_writes = 0
+        self._last_commit = time.monotonic()
+
+    def stats(self) -> Dict:
+        """returns a dictionary with the 'hits', 'misses', 'evictions' (since this object was made) and current 'entries'"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': self._entries}
+
+    def clear(self) -> None:
+        """removes every entry"""
+        with self._lock:
+            self._connection.execute('DELETE FROM objects')
+            self._commit()
+            self._entries = 0
+
+    def flush(self) -> None:
+        """commits any pending writes to disk"""
+        with self._lock:
+            if not self._closed and self._pending_writes:
+                self._commit()
+
+    def close(self) -> None:
+        """commits any pending writes and closes the database"""
+        self.flush()
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._connection.close()
+                _open_caches.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,147 @@
+import bisect
+import collections
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Callable, Dict
+
+
+#the AWS method (e.g. 'list_keys') that the current API calls are made for
+current_operation = contextvars.ContextVar('ez_aws_operation', default=None)
+
+#upper bounds (in milliseconds) of the latency histogram buckets; slower calls go in the last, '+inf' one
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+#error codes S3 and the other services use to tell clients to slow down
+THROTTLE_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                  'ProvisionedThroughputExceededException', 'RequestThrottled', 'RequestThrottledException'}
+
+logger = logging.getLogger(__name__)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that runs every call in a copy of the context it was submitted from,
+    so current_operation (and other context variables) carry over into the worker threads"""
+
+    def submit(self, function, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+
+class MetricsCollector:
+    """Records what every AWS API call costs, grouped by the AWS method it was made for and the API operation:
+    the number of calls, errors, retries and throttles (SlowDown/503 and the like), bytes sent and received, and a latency histogram.
+
+    Pass it to AWS(metrics=...), and it's attached to the event hooks of every client and resource that AWS makes.
+    snapshot() returns the totals so far. If callback is given, it's called with a record dictionary after every
+    API call, and if log_level is given, every record is also logged at that level on the 'ez_aws.metrics' logger"""
+
+    def __init__(self, callback: Callable[[Dict], None] = None, log_level: int = None):
+        self.callback = callback
+        self.log_level = log_level
+        self._lock = threading.Lock()
+        self._stats = {} #(operation, api) -> totals
+
+    def attach(self, client) -> None:
+        """registers the metrics event handlers on a botocore client"""
+        events = client.meta.events
+        events.register('before-call', self._before_call, unique_id='ez_aws_metrics_before_call')
+        events.register('request-created', self._request_created, unique_id='ez_aws_metrics_request_created')
+        events.register('needs-retry', self._needs_retry, unique_id='ez_aws_metrics_needs_retry')
+        events.register('after-call', self._after_call, unique_id='ez_aws_metrics_after_call')
+        events.register('after-call-error', self._after_call_error, unique_id='ez_aws_metrics_after_call_error')
+
+    def _before_call(self, context: Dict, **kwargs) -> None:
+        context['ez_aws_metrics'] = {'operation': current_operation.get() or 'other', 'start': time.perf_counter(),
+                                     'bytes_out': 0, 'throttles': 0}
+
+    def _request_created(self, request, **kwargs) -> None:
+        """counts the bytes sent by every attempt, including retries"""
+        call = getattr(request, 'context', {}).get('ez_aws_metrics')
+        if call == None or request.body == None:
+            return
+        #uploads with checksums are sent aws-chunked, so the payload size is only in the decoded length header
+        length = request.headers.get('X-Amz-Decoded-Content-Length') or request.headers.get('Content-Length')
+        if length != None:
+            call['bytes_out'] += int(length)
+            return
+        try:
+            call['bytes_out'] += len(request.body)
+        except TypeError: #a stream without a length
+            pass
+
+    def _needs_retry(self, response=None, request_dict=None, **kwargs) -> None:
+        """counts the attempts that were throttled. Returns None, so the retry decision is left to botocore"""
+        if response == None or request_dict == None:
+            return
+        call = request_dict.get('context', {}).get('ez_aws_metrics')
+        http_response, parsed = response
+        code = parsed.get('Error', {}).get('Code') if parsed else None
+        if call != None and (http_response.status_code == 503 or code in THROTTLE_CODES):
+            call['throttles'] += 1
+
+    def _after_call(self, http_response, parsed: Dict, model, context: Dict, **kwargs) -> None:
+        call = context.get('ez_aws_metrics')
+        if call == None:
+            return
+        if model.has_streaming_output: #the body hasn't been read yet, so go by its length
+            bytes_in = int(http_response.headers.get('content-length', 0))
+        else:
+            bytes_in = len(http_response.content or b'')
+        error = parsed.get('Error', {}).get('Code') if http_response.status_code >= 300 else None
+        self._record(call, model.name, http_response.status_code, error, bytes_in,
+                     parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+    def _after_call_error(self, exception: Exception, context: Dict, model=None, **kwargs) -> None:
+        """calls that failed without a response (e.g. connection errors, after botocore's retries)"""
+        call = context.get('ez_aws_metrics')
+        if call == None:
+            return
+        self._record(call, model.name if model != None else 'unknown', None, type(exception).__name__, 0, 0)
+
+    def _record(self, call: Dict, api: str, status: int, error: str, bytes_in: int, retries: int) -> None:
+        seconds = time.perf_counter() - call['start']
+        with self._lock:
+            stats = self._stats.get((call['operation'], api))
+            if stats == None:
+                stats = self._stats[(call['operation'], api)] = {
+                    'calls': 0, 'errors': 0, 'retries': 0, 'throttles': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0,
+                    'latency_ms': [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+            stats['calls'] += 1
+            stats['errors'] += error != None
+            stats['retries'] += retries
+            stats['throttles'] += call['throttles']
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += call['bytes_out']
+            stats['seconds'] += seconds
+            stats['latency_ms'][bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+
+        if self.callback == None and self.log_level == None:
+            return
+        record = {'operation': call['operation'], 'api': api, 'status': status, 'error': error, 'seconds': seconds,
+                  'retries': retries, 'throttles': call['throttles'], 'bytes_in': bytes_in, 'bytes_out': call['bytes_out']}
+        if self.log_level != None:
+            logger.log(self.log_level, "%(operation)s %(api)s status=%(status)s error=%(error)s seconds=%(seconds).3f "
+                       "retries=%(retries)s throttles=%(throttles)s bytes_in=%(bytes_in)s bytes_out=%(bytes_out)s", record)
+        if self.callback != None:
+            try:
+                self.callback(record)
+            except Exception: #a broken sink shouldn't break the API call
+                logger.exception("metrics callback failed")
+
+    def snapshot(self) -> Dict:
+        """returns {AWS method: {API operation: totals}}, where the totals are the 'calls', 'errors', 'retries', 'throttles',
+        'bytes_in', 'bytes_out', total 'seconds', and 'latency_ms', a histogram of {bucket upper bound: calls}"""
+        bounds = [f'<={bound}' for bound in LATENCY_BUCKETS_MS] + ['+inf']
+        result = collections.defaultdict(dict)
+        with self._lock:
+            for (operation, api), stats in sorted(self._stats.items()):
+                result[operation][api] = dict(stats, latency_ms=dict(zip(bounds, stats['latency_ms'])))
+        return dict(result)
+
+    def reset(self) -> None:
+        """clears every total"""
+        with self._lock:
+            self._stats.clear()
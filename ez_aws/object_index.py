@@ -0,0 +1,297 @@
+import array
+import bisect
+import datetime
+import heapq
+import json
+import mmap
+import struct
+import sys
+
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+_MAGIC = b'EZAWSIDX'
+_VERSION = 1
+_ALIGNMENT = 8
+
+
+class _Keys:
+    """read-only sequence of the keys (as utf-8 bytes) in a blob, cut at offsets, so bisect can search it"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i+1]])
+
+
+class ObjectIndex:
+    """Compact, read-only index of the objects in a bucket (or under a prefix of it), made in one listing pass
+    by AWS.get_object_index, for answering questions about sizes without listing the bucket again.
+
+    The keys, sizes, ETags and modification times are kept in flat arrays, in key order, instead of one dictionary
+    per object, so millions of objects take tens of bytes each. Along with a running total of the sizes, that makes
+    the total size and count under any prefix two binary searches away, so du(prefix, depth) only costs a couple of
+    lookups per prefix it returns, however many objects are under them. largest(n) walks a precomputed order by size,
+    and size_histogram() of the whole index is precomputed too.
+
+    save(path) writes it to a binary file, and ObjectIndex.load(path) memory-maps that file back, so reloading
+    even a huge index is instant and only the parts that are used are read from disk"""
+
+    #name -> array typecode of the columns, in the order they're saved in
+    _COLUMNS = {'key_offsets': 'Q', 'keys': 'B', 'etag_offsets': 'Q', 'etags': 'B', 'sizes': 'q', 'mtimes': 'd',
+                'cumulative_sizes': 'q', 'by_size': 'Q'}
+
+    def __init__(self, bucket_name: str, prefix: str, columns: Dict, histogram: Dict = None, mapped = None):
+        """use AWS.get_object_index, ObjectIndex.from_objects or ObjectIndex.load to make one"""
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self._columns = columns
+        self._keys = _Keys(columns['keys'], columns['key_offsets'])
+        self._etag_blob = columns['etags']
+        self._etag_offsets = columns['etag_offsets']
+        self._sizes = columns['sizes']
+        self._mtimes = columns['mtimes']
+        self._cumulative = columns['cumulative_sizes']
+        self._by_size = columns['by_size']
+        self._histogram = histogram if histogram != None else self._compute_histogram(0, len(self._sizes))
+        self._mapped = mapped #(file, mmap) of a loaded index
+
+    @classmethod
+    def from_objects(cls, objects: Iterable[Dict], bucket_name: str = "", prefix: str = "") -> 'ObjectIndex':
+        """builds an index from list_objects_v2 style dictionaries (with 'Key', 'Size', and optionally 'ETag' and 'LastModified'),
+        such as the ones AWS.iter_objects yields. They're sorted by key if they don't come in key order"""
+        keys, key_offsets = bytearray(), array.array('Q', [0])
+        etags, etag_offsets = bytearray(), array.array('Q', [0])
+        sizes, mtimes = array.array('q'), array.array('d')
+        in_order = True
+        previous = None
+        for obj in objects:
+            key = obj['Key'].encode('utf-8')
+            if previous != None and key <= previous:
+                in_order = False
+            previous = key
+            keys += key
+            key_offsets.append(len(keys))
+            etags += obj.get('ETag', '').strip('"').encode('ascii')
+            etag_offsets.append(len(etags))
+            sizes.append(obj['Size'])
+            mtimes.append(_timestamp(obj.get('LastModified')))
+
+        columns = {'key_offsets': key_offsets, 'keys': bytes(keys), 'etag_offsets': etag_offsets, 'etags': bytes(etags),
+                   'sizes': sizes, 'mtimes': mtimes}
+        if not in_order:
+            columns = _sorted_columns(columns)
+
+        cumulative = array.array('q', [0])
+        total = 0
+        for size in columns['sizes']:
+            total += size
+            cumulative.append(total)
+        columns['cumulative_sizes'] = cumulative
+        columns['by_size'] = array.array('Q', sorted(range(len(columns['sizes'])), key=columns['sizes'].__getitem__, reverse=True))
+        return cls(bucket_name, prefix, columns)
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def __contains__(self, key: str) -> bool:
+        return self._find(key) != None
+
+    def __iter__(self) -> Iterator[Dict]:
+        """yields the row of every object, in key order"""
+        for i in range(len(self)):
+            yield self._row(i)
+
+    def get(self, key: str) -> Dict:
+        """returns the row of key (see largest), or None if it isn't in the index"""
+        i = self._find(key)
+        return self._row(i) if i != None else None
+
+    def _find(self, key: str) -> int:
+        encoded = key.encode('utf-8')
+        i = bisect.bisect_left(self._keys, encoded)
+        return i if i < len(self) and self._keys[i] == encoded else None
+
+    def _row(self, i: int) -> Dict:
+        """the same columns as the rows of AWS.get_file_index(include_etag=True), plus 'last_modified' (a UTC datetime, or None)"""
+        size = self._sizes[i]
+        etag = bytes(self._etag_blob[self._etag_offsets[i]:self._etag_offsets[i+1]]).decode('ascii')
+        mtime = self._mtimes[i]
+        return {'key': self._keys[i].decode('utf-8'), 'sizebyte': size, 'sizegigabyte': size / 1.0E9,
+                'etag': '"' + etag + '"' if etag else '',
+                'last_modified': datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc) if mtime == mtime else None}
+
+    def _range(self, prefix: bytes) -> Tuple[int, int]:
+        """returns the (start, end) positions of the keys that start with prefix.
+        No utf-8 string has a 0xff byte, so prefix + 0xff sorts after every key that starts with prefix"""
+        start = bisect.bisect_left(self._keys, prefix)
+        return start, bisect.bisect_left(self._keys, prefix + b'\xff', start)
+
+    def totals(self, prefix: str = "") -> Dict:
+        """returns the 'count' and total 'sizebyte' of the objects whose keys start with prefix"""
+        start, end = self._range(prefix.encode('utf-8'))
+        return {'count': end - start, 'sizebyte': self._cumulative[end] - self._cumulative[start]}
+
+    def du(self, prefix: str = "", depth: int = 1) -> Dict[str, Dict]:
+        """returns {sub-prefix: {'count', 'sizebyte'}} for every prefix up to depth levels ('/'-separated) below prefix,
+        in key order, like du --max-depth. Objects at a shallower level are in it under their own key.
+        depth=0 returns just the totals of prefix"""
+        encoded = prefix.encode('utf-8')
+        start, end = self._range(encoded)
+        result = {}
+        i = start
+        while i < end:
+            key = self._keys[i]
+            cut = len(encoded)
+            for _ in range(depth):
+                cut = key.find(b'/', cut)
+                if cut == -1:
+                    break
+                cut += 1
+            if cut == -1: #an object, not a prefix
+                child, child_end = key, i + 1
+            else:
+                child = key[:cut]
+                child_end = bisect.bisect_left(self._keys, child + b'\xff', i, end)
+            result[child.decode('utf-8')] = {'count': child_end - i, 'sizebyte': self._cumulative[child_end] - self._cumulative[i]}
+            i = child_end
+        return result
+
+    def largest(self, n: int = 10, prefix: str = "") -> List[Dict]:
+        """returns the rows of the n largest objects (with matching prefix), largest first.
+        Each row has the 'key', 'sizebyte', 'sizegigabyte', 'etag' and 'last_modified' of the object"""
+        start, end = self._range(prefix.encode('utf-8'))
+        if end - start == len(self):
+            return [self._row(i) for i in self._by_size[:n]]
+        if end - start <= n * 64: #a small prefix is faster to scan than to find in the order of the whole index
+            return [self._row(i) for i in heapq.nlargest(n, range(start, end), key=self._sizes.__getitem__)]
+        rows = []
+        for i in self._by_size:
+            if start <= i < end:
+                rows.append(self._row(i))
+                if len(rows) == n:
+                    break
+        return rows
+
+    def size_histogram(self, prefix: str = "") -> Dict[int, Dict]:
+        """returns {upper bound: {'count', 'sizebyte'}} of the objects (with matching prefix), grouped by the power of two
+        their size is below, smallest first (so 1 is the empty objects, 1024 the ones from 512 bytes to 1 KiB, and so on)"""
+        if prefix == "":
+            return dict(self._histogram)
+        return self._compute_histogram(*self._range(prefix.encode('utf-8')))
+
+    def _compute_histogram(self, start: int, end: int) -> Dict[int, Dict]:
+        counts = {}
+        for i in range(start, end):
+            size = self._sizes[i]
+            bucket = counts.get(size.bit_length())
+            if bucket == None:
+                bucket = counts[size.bit_length()] = {'count': 0, 'sizebyte': 0}
+            bucket['count'] += 1
+            bucket['sizebyte'] += size
+        return {2**bits: counts[bits] for bits in sorted(counts)}
+
+    def save(self, path: str) -> None:
+        """writes the index to a binary file, which ObjectIndex.load memory-maps back.
+        The file is a header (the magic bytes, its length and a JSON description) followed by the columns, 8-byte aligned"""
+        sections = {}
+        offset = 0
+        for name in self._COLUMNS:
+            length = len(memoryview(self._columns[name]).cast('B'))
+            sections[name] = [offset, length]
+            offset += length + (-length % _ALIGNMENT)
+        header = json.dumps({'version': _VERSION, 'byteorder': sys.byteorder, 'bucket': self.bucket_name, 'prefix': self.prefix,
+                             'count': len(self), 'sections': sections,
+                             'histogram': [[bound, totals['count'], totals['sizebyte']] for bound, totals in self._histogram.items()]}).encode()
+        header += b' ' * (-(len(_MAGIC) + 8 + len(header)) % _ALIGNMENT)
+
+        with open(path, 'wb') as fout:
+            fout.write(_MAGIC + struct.pack('<Q', len(header)) + header)
+            for name in self._COLUMNS:
+                data = memoryview(self._columns[name]).cast('B')
+                fout.write(data)
+                fout.write(b'\0' * (-len(data) % _ALIGNMENT))
+
+    @classmethod
+    def load(cls, path: str) -> 'ObjectIndex':
+        """memory-maps an index written by save. Call close() (or use it in a with block) to unmap it"""
+        fin = open(path, 'rb')
+        try:
+            mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            fin.close()
+            raise
+        try:
+            if mapped[:len(_MAGIC)] != _MAGIC:
+                raise ValueError(f"{path} isn't an ObjectIndex file")
+            header_length, = struct.unpack('<Q', mapped[len(_MAGIC):len(_MAGIC)+8])
+            data_start = len(_MAGIC) + 8 + header_length
+            header = json.loads(mapped[len(_MAGIC)+8:data_start])
+            if header['version'] != _VERSION:
+                raise ValueError(f"{path} is an ObjectIndex file of version {header['version']}, not {_VERSION}")
+            if header['byteorder'] != sys.byteorder:
+                raise ValueError(f"{path} was saved on a {header['byteorder']} endian machine")
+
+            view = memoryview(mapped)
+            columns = {}
+            for name, typecode in cls._COLUMNS.items():
+                offset, length = header['sections'][name]
+                start = data_start + offset
+                columns[name] = view[start:start+length].cast(typecode)
+            histogram = {bound: {'count': count, 'sizebyte': size} for bound, count, size in header['histogram']}
+        except BaseException:
+            mapped.close()
+            fin.close()
+            raise
+        return cls(header['bucket'], header['prefix'], columns, histogram, mapped=(fin, mapped))
+
+    def close(self) -> None:
+        """unmaps the file of a loaded index (an index that was built in memory has nothing to close)"""
+        if self._mapped == None:
+            return
+        for column in self._columns.values():
+            column.release()
+        self._columns = {}
+        self._keys = self._etag_blob = self._etag_offsets = self._sizes = self._mtimes = self._cumulative = self._by_size = None
+        fin, mapped = self._mapped
+        self._mapped = None
+        mapped.close()
+        fin.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _timestamp(last_modified) -> float:
+    """seconds since the epoch of a LastModified datetime or ISO 8601 string (as in inventory reports), or nan if there isn't one"""
+    if last_modified in (None, ''):
+        return float('nan')
+    if isinstance(last_modified, str):
+        last_modified = datetime.datetime.fromisoformat(last_modified.replace('Z', '+00:00'))
+    return last_modified.timestamp()
+
+
+def _sorted_columns(columns: Dict) -> Dict:
+    """returns the columns of from_objects rearranged in key order"""
+    keys = _Keys(columns['keys'], columns['key_offsets'])
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    etags = _Keys(columns['etags'], columns['etag_offsets'])
+
+    key_blob, key_offsets = bytearray(), array.array('Q', [0])
+    etag_blob, etag_offsets = bytearray(), array.array('Q', [0])
+    for i in order:
+        key_blob += keys[i]
+        key_offsets.append(len(key_blob))
+        etag_blob += etags[i]
+        etag_offsets.append(len(etag_blob))
+    return {'key_offsets': key_offsets, 'keys': bytes(key_blob), 'etag_offsets': etag_offsets, 'etags': bytes(etag_blob),
+            'sizes': array.array('q', (columns['sizes'][i] for i in order)),
+            'mtimes': array.array('d', (columns['mtimes'][i] for i in order))}
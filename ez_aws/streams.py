@@ -0,0 +1,314 @@
+import collections
+import contextvars
+import gzip
+import io
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from typing import Dict
+
+
+class BlockReader(io.RawIOBase):
+    """Seekable read-only stream of an S3 object, made of ranged GETs of block_size bytes (see AWS.open(block_cache=True)).
+
+    The last cache_blocks blocks read are kept in an LRU cache, so seeking back to them (e.g. to the footer of an
+    archive and back) doesn't fetch them again. While blocks are read in order, the next prefetch_blocks blocks
+    are fetched ahead on a background thread pool, so sequential scans don't wait on every block.
+    Every GET is made with the ETag from when the stream was opened, so a changed object raises an error
+    instead of returning a mix of both versions"""
+
+    def __init__(self, client, bucket_name: str, key: str, object_kwargs: Dict = None,
+                 block_size: int = 8*1024*1024, cache_blocks: int = 16, prefetch_blocks: int = 4):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.object_kwargs = object_kwargs if object_kwargs != None else {}
+        self.block_size = block_size
+        self.prefetch_blocks = prefetch_blocks
+        self.cache_blocks = max(cache_blocks, prefetch_blocks+1) #room for the block being read and the ones ahead of it
+
+        head = client.head_object(Bucket=bucket_name, Key=key, **self.object_kwargs)
+        self.size = head['ContentLength']
+        self.etag = head['ETag']
+        self.block_count = (self.size + block_size - 1) // block_size
+
+        self.bytes_fetched = 0
+        self.bytes_served = 0
+        self.requests = 1 #the head_object
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self._position = 0
+        self._last_block = None
+        self._blocks = collections.OrderedDict() #block index -> future of its bytes, least recently used first
+        self._lock = threading.Lock()
+        self._pool = None
+        self._context = contextvars.copy_context() #so the reads count for the AWS method that opened the stream (see MetricsCollector)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"negative seek position {position}")
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if self._position >= self.size or len(buffer) == 0:
+            return 0
+        index, offset = divmod(self._position, self.block_size)
+        block = self._get_block(index)
+        length = min(len(buffer), len(block) - offset)
+        buffer[:length] = block[offset:offset+length]
+        self._position += length
+        self.bytes_served += length
+        return length
+
+    def _get_block(self, index: int) -> bytes:
+        """returns the bytes of block index, from the cache if it's there, and starts the read-ahead if reads are sequential"""
+        sequential = self._last_block != None and index == self._last_block + 1
+        moved = index != self._last_block #only count a hit or miss once per block, not once per read of it
+        self._last_block = index
+        with self._lock:
+            future = self._blocks.get(index)
+            if future != None:
+                self._blocks.move_to_end(index)
+                self.cache_hits += moved
+            else:
+                self.cache_misses += 1
+        if future == None:
+            future = self._submit(index, run_now=True)
+        if sequential and self.prefetch_blocks > 0:
+            for ahead in range(index+1, min(index+1+self.prefetch_blocks, self.block_count)):
+                self._submit(ahead)
+        try:
+            return future.result()
+        except Exception:
+            with self._lock:
+                if self._blocks.get(index) is future: #don't cache the failure, so reading again retries it
+                    del self._blocks[index]
+            raise
+
+    def _submit(self, index: int, run_now=False):
+        """caches a future of block index (fetched right away on this thread if run_now, otherwise on the pool),
+        unless it's already cached, and evicts the least recently used blocks past cache_blocks"""
+        with self._lock:
+            future = self._blocks.get(index)
+            if future != None:
+                return future
+            if run_now:
+                future = Future()
+                future.set_running_or_notify_cancel() #so evicting it can't cancel it
+            else:
+                if self._pool == None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.prefetch_blocks, thread_name_prefix='ez_aws_read_ahead')
+                future = self._pool.submit(self._context.copy().run, self._fetch, index)
+            self._blocks[index] = future
+            while len(self._blocks) > self.cache_blocks:
+                _, evicted = self._blocks.popitem(last=False)
+                evicted.cancel()
+        if run_now:
+            try:
+                future.set_result(self._context.copy().run(self._fetch, index))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def _fetch(self, index: int) -> bytes:
+        start = index * self.block_size
+        end = min(start + self.block_size, self.size) - 1
+        response = self.client.get_object(Bucket=self.bucket_name, Key=self.key, Range=f'bytes={start}-{end}',
+                                          IfMatch=self.etag, **self.object_kwargs)
+        data = response['Body'].read()
+        with self._lock:
+            self.requests += 1
+            self.bytes_fetched += len(data)
+        return data
+
+    def stats(self) -> Dict:
+        """returns a dictionary with the 'bytes_fetched' from S3, the 'bytes_served' to the reader, the number of
+        'requests', and the block 'cache_hits' and 'cache_misses' (a prefetched block counts as a hit).
+        bytes_served counts what the buffered stream on top of it read, which can run a little ahead of the caller"""
+        with self._lock:
+            return {'bytes_fetched': self.bytes_fetched, 'bytes_served': self.bytes_served, 'requests': self.requests,
+                    'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses}
+
+    def close(self) -> None:
+        if not self.closed:
+            with self._lock:
+                for future in self._blocks.values():
+                    future.cancel()
+                self._blocks.clear()
+            if self._pool != None:
+                self._pool.shutdown(wait=True)
+        super().close()
+
+
+class MultipartWriter(io.BufferedIOBase):
+    """Write-only stream to an S3 object, uploaded as a multipart upload with parts sent in parallel (see AWS.open(parallel_write=True)).
+
+    What is written is cut into blocks of block_size bytes. If compress is true, every block is gzipped on its own
+    on a thread pool (zlib releases the GIL, so this uses several cores), and the object is a multi-member gzip
+    file, which gzip, zcat and AWS.open(decompress=True) all read as one. The (compressed) blocks are joined in order
+    into parts of at least part_size bytes, which are uploaded on the same pool, with at most max_in_flight_parts
+    parts in memory at a time. Outputs smaller than one part are sent with a single put_object instead.
+
+    close() completes the upload. If anything fails, or the stream is left by an exception in a with block,
+    the multipart upload is aborted so no partial object or orphaned parts are left behind"""
+
+    def __init__(self, client, bucket_name: str, key: str, object_kwargs: Dict = None, compress=False, compresslevel: int = 6,
+                 part_size: int = 8*1024*1024, block_size: int = 4*1024*1024, max_workers: int = 4, max_in_flight_parts: int = 8):
+        if part_size < 5*1024*1024:
+            raise ValueError("part_size must be at least 5 MiB, the smallest part size S3 accepts")
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.object_kwargs = object_kwargs if object_kwargs != None else {}
+        self.compress = compress
+        self.compresslevel = compresslevel
+        self.part_size = part_size
+        self.block_size = block_size
+        self.max_in_flight_parts = max_in_flight_parts
+
+        self.bytes_written = 0
+        self.bytes_uploaded = 0
+
+        self._buffer = bytearray() #written bytes not yet in a block
+        self._blocks = collections.deque() #futures of the (compressed) blocks, in order
+        self._part = bytearray() #(compressed) bytes not yet in a part
+        self._uploads = collections.deque() #futures of the parts being uploaded
+        self._parts = [] #finished parts, for complete_multipart_upload
+        self._upload_id = None
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ez_aws_write')
+        self._context = contextvars.copy_context() #so the uploads count for the AWS method that opened the stream (see MetricsCollector)
+
+    def _call(self, function, *args, **kwargs):
+        """calls function in the context the stream was opened in"""
+        return self._context.copy().run(function, *args, **kwargs)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        try:
+            self._buffer += data
+            self.bytes_written += len(data)
+            while len(self._buffer) >= self.block_size:
+                block = bytes(self._buffer[:self.block_size])
+                del self._buffer[:self.block_size]
+                self._add_block(block)
+        except BaseException:
+            self.terminate()
+            raise
+        return len(data)
+
+    def _add_block(self, block: bytes) -> None:
+        if self.compress:
+            future = self._pool.submit(gzip.compress, block, self.compresslevel)
+        else:
+            future = Future()
+            future.set_result(block)
+        self._blocks.append(future)
+        self._collect_blocks()
+
+    def _collect_blocks(self, final=False) -> None:
+        """moves finished blocks, in order, into the current part, and starts uploading it once it's big enough.
+        Waits for the oldest block when too many are pending (or for all of them if final)"""
+        while self._blocks and (final or self._blocks[0].done() or len(self._blocks) > 2*self.max_in_flight_parts):
+            self._part += self._blocks.popleft().result()
+            if len(self._part) >= self.part_size:
+                self._upload_part(bytes(self._part))
+                self._part = bytearray()
+
+    def _upload_part(self, data: bytes) -> None:
+        if self._upload_id == None:
+            response = self._call(self.client.create_multipart_upload, Bucket=self.bucket_name, Key=self.key, **self.object_kwargs)
+            self._upload_id = response['UploadId']
+        part_number = len(self._parts) + len(self._uploads) + 1
+        self._uploads.append(self._pool.submit(self._call, self._send_part, part_number, data))
+        while len(self._uploads) >= self.max_in_flight_parts:
+            self._parts.append(self._uploads.popleft().result())
+
+    def _send_part(self, part_number: int, data: bytes) -> Dict:
+        response = self.client.upload_part(Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id,
+                                           PartNumber=part_number, Body=data, **self.object_kwargs)
+        with self._lock:
+            self.bytes_uploaded += len(data)
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self) -> None:
+        """uploads what is left and completes the upload"""
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._add_block(bytes(self._buffer))
+                self._buffer = bytearray()
+            self._collect_blocks(final=True)
+            if self._upload_id == None: #small enough for a single request
+                self._call(self.client.put_object, Bucket=self.bucket_name, Key=self.key, Body=bytes(self._part), **self.object_kwargs)
+                self.bytes_uploaded += len(self._part)
+            else:
+                if self._part:
+                    self._upload_part(bytes(self._part))
+                while self._uploads:
+                    self._parts.append(self._uploads.popleft().result())
+                self._call(self.client.complete_multipart_upload, Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id,
+                                                      MultipartUpload={'Parts': self._parts}, **self.object_kwargs)
+        except BaseException:
+            self.terminate()
+            raise
+        self._pool.shutdown(wait=True)
+        super().close()
+
+    def terminate(self) -> None:
+        """stops writing and aborts the multipart upload, without creating the object"""
+        if self.closed:
+            return
+        for future in list(self._blocks) + list(self._uploads):
+            future.cancel()
+        self._pool.shutdown(wait=True)
+        if self._upload_id != None:
+            self._call(self.client.abort_multipart_upload, Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id,
+                                               **self.object_kwargs)
+        super().close()
+
+    def stats(self) -> Dict:
+        """returns a dictionary with the 'bytes_written' to the stream, the 'bytes_uploaded' (after compression), and the 'parts' uploaded so far"""
+        return {'bytes_written': self.bytes_written, 'bytes_uploaded': self.bytes_uploaded, 'parts': len(self._parts)}
+
+    def __exit__(self, exc_type, *args):
+        if exc_type != None:
+            self.terminate()
+        else:
+            self.close()
+
+
+class MultipartTextWriter(io.TextIOWrapper):
+    """TextIOWrapper over a MultipartWriter (see AWS.open(mode='w', parallel_write=True)). TextIOWrapper's own __exit__
+    always closes its buffer, which would complete the upload, so leaving a with block by an exception aborts it instead"""
+
+    def __exit__(self, exc_type, *args):
+        if exc_type != None:
+            self.buffer.terminate() #closes the buffer, so closing this doesn't flush into it
+        self.close()
@@ -9,5 +9,5 @@ setup(
     author_email='atkrueger@gmail.com',
     license='MIT',
     packages=['ez_aws'],
-    install_requires=['boto3', 'smart_open', 'requests']
+    install_requires=['boto3', 'smart_open>=5.0.0'] #5.0.0 replaced smart_open.s3.open(session=...) with client=...
 )
\ No newline at end of file
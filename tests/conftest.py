@@ -0,0 +1,28 @@
+import os
+import sys
+
+import boto3
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from ez_aws import AWS
+from fake_s3 import FakeS3
+
+BUCKET = 'ez-aws-test'
+
+
+@pytest.fixture
+def fake() -> FakeS3:
+    fake = FakeS3()
+    fake.create_bucket(BUCKET)
+    return fake
+
+
+@pytest.fixture
+def aws(fake: FakeS3) -> AWS:
+    """an AWS whose S3 calls are all answered by fake"""
+    session = boto3.Session(aws_access_key_id='fake', aws_secret_access_key='fake', region_name='us-east-1')
+    fake.attach(session)
+    return AWS(session=session)
@@ -0,0 +1,51 @@
+import gzip
+import random
+
+from conftest import BUCKET
+
+
+def long_header(count):
+    return [f'col_{i:05d}' for i in range(count)]
+
+
+def test_reads_only_the_first_range(fake, aws):
+    fake.put(BUCKET, 'small.csv', b'id,name\r\n' + b'1,x\r\n' * 100000)
+    assert aws.get_column_names(BUCKET, 'small.csv') == ['id', 'name']
+    assert fake.requests['GetObject'] == 1
+    assert fake.bytes_out == 64*1024
+
+
+def test_ranges_double_until_the_line_ends(fake, aws):
+    header = long_header(30000) #about 300 KB
+    fake.put(BUCKET, 'wide.csv', ','.join(header).encode() + b'\n1,2,3\n' * 100000)
+    assert aws.get_column_names(BUCKET, 'wide.csv') == header
+    #64 KB, then 128 KB, then 256 KB
+    assert fake.requests['GetObject'] == 3
+    assert fake.bytes_out == (64 + 128 + 256) * 1024
+
+
+def test_stops_at_the_end_of_the_object(fake, aws):
+    fake.put(BUCKET, 'no_newline.csv', ','.join(long_header(10000)).encode())
+    fake.put(BUCKET, 'empty.csv', b'')
+    assert aws.get_column_names(BUCKET, 'no_newline.csv') == long_header(10000)
+    assert aws.get_column_names(BUCKET, 'empty.csv') == []
+
+
+def test_gzip_heads(fake, aws):
+    fake.put(BUCKET, 'small.csv.gz', gzip.compress(b'id,name\n' + b'1,x\n' * 100000))
+    assert aws.get_column_names(BUCKET, 'small.csv.gz') == ['id', 'name']
+    assert fake.requests['GetObject'] == 1
+
+    #random column names compress poorly, so the header takes a few ranges
+    names = [''.join(random.Random(i).choices('abcdefghijklmnopqrstuvwxyz', k=12)) for i in range(20000)]
+    fake.reset_counters()
+    fake.put(BUCKET, 'wide.csv.gz', gzip.compress(','.join(names).encode() + b'\n' + b'1,2\n' * 100000))
+    assert aws.get_column_names(BUCKET, 'wide.csv.gz') == names
+    assert fake.requests['GetObject'] > 1
+
+
+def test_unreadable_files(fake, aws):
+    fake.put(BUCKET, 'broken.csv.gz', b'not gzip data')
+    fake.put(BUCKET, 'data.parquet', b'PAR1')
+    assert aws.get_column_names(BUCKET, 'broken.csv.gz')[0].startswith('unreadable csv')
+    assert aws.get_column_names(BUCKET, 'data.parquet') == ['unreadable non csv file']
@@ -0,0 +1,73 @@
+import os
+
+from conftest import BUCKET
+
+MiB = 1024*1024
+DEST = BUCKET + '-copy'
+
+
+def populate(fake):
+    fake.create_bucket(DEST)
+    objects = {f'src/{i:02d}.bin': os.urandom(i * 1024) for i in range(10)}
+    objects['src/large.bin'] = os.urandom(12*MiB + 5)
+    for key, data in objects.items():
+        fake.put(BUCKET, key, data)
+    return objects
+
+
+def read_object(aws, bucket, key):
+    return aws.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+
+def test_copy_prefix_copies_small_and_multipart(fake, aws):
+    objects = populate(fake)
+
+    summary = aws.copy_prefix(BUCKET, 'src/', DEST, 'dst/', max_workers=4, multipart_threshold=5*MiB, part_size=5*MiB)
+
+    assert summary['copied'] == len(objects) and not summary['failed']
+    for key, data in objects.items():
+        assert read_object(aws, DEST, 'dst/' + key[len('src/'):]) == data
+    #the large file was copied in three parts, and completed from the last part's done-callback
+    assert fake.requests['UploadPartCopy'] == 3
+    assert fake.requests['CompleteMultipartUpload'] == 1
+    assert fake.requests['CopyObject'] == len(objects) - 1
+
+
+def test_copy_prefix_skips_identical(fake, aws):
+    objects = populate(fake)
+    aws.copy_prefix(BUCKET, 'src/', DEST, 'dst/', multipart_threshold=5*MiB, part_size=5*MiB)
+    fake.put(BUCKET, 'src/03.bin', b'changed')
+
+    fake.reset_counters()
+    summary = aws.copy_prefix(BUCKET, 'src/', DEST, 'dst/', multipart_threshold=5*MiB, part_size=5*MiB)
+
+    #the multipart copy has a different ETag from its source, but is newer, so it's skipped too
+    assert summary['copied'] == 1 and summary['skipped'] == len(objects) - 1
+    assert fake.requests['CopyObject'] == 1 and fake.requests['UploadPartCopy'] == 0
+    assert read_object(aws, DEST, 'dst/03.bin') == b'changed'
+
+
+def test_copy_prefix_dry_run(fake, aws):
+    objects = populate(fake)
+
+    summary = aws.copy_prefix(BUCKET, 'src/', DEST, 'dst/', dry_run=True)
+
+    assert summary['copied'] == len(objects) and summary['bytes_copied'] == sum(map(len, objects.values()))
+    assert aws.list_keys(DEST) == []
+
+
+def test_copy_prefix_aborts_failed_multipart_copy(fake, aws, monkeypatch):
+    objects = populate(fake)
+    upload_part_copy = aws.s3_client.upload_part_copy
+    def failing(**kwargs):
+        if kwargs['PartNumber'] == 2:
+            raise RuntimeError('simulated failure')
+        return upload_part_copy(**kwargs)
+    monkeypatch.setattr(aws.s3_client, 'upload_part_copy', failing)
+
+    summary = aws.copy_prefix(BUCKET, 'src/', DEST, 'dst/', multipart_threshold=5*MiB, part_size=5*MiB)
+
+    assert list(summary['failed']) == ['src/large.bin']
+    assert summary['copied'] == len(objects) - 1
+    assert fake.requests['AbortMultipartUpload'] == 1 and fake.requests['CompleteMultipartUpload'] == 0
+    assert 'dst/large.bin' not in aws.list_keys(DEST)
@@ -0,0 +1,46 @@
+import hashlib
+import os
+
+import pytest
+
+from conftest import BUCKET
+
+MiB = 1024*1024
+
+
+@pytest.mark.parametrize('size', [0, 1, 5*MiB - 1, 5*MiB, 5*MiB + 1, 17*MiB + 12345])
+@pytest.mark.parametrize('max_workers', [1, 8])
+def test_download_assembles_parts(fake, aws, tmp_path, size, max_workers):
+    data = os.urandom(size)
+    fake.put(BUCKET, 'object.bin', data)
+    path = tmp_path / 'sub' / 'object.bin'
+
+    aws.download(BUCKET, 'object.bin', str(path), part_size=5*MiB, max_workers=max_workers)
+
+    assert path.read_bytes() == data
+    #the first MiB tells the size, the rest comes in part_size ranges
+    assert fake.requests['GetObject'] == 1 + max(0, -(-(size - MiB) // (5*MiB)))
+    assert [name for name in os.listdir(path.parent)] == ['object.bin'] #no temporary files left behind
+
+
+def test_download_to_bare_filename(fake, aws, tmp_path, monkeypatch):
+    data = os.urandom(MiB + 1)
+    fake.put(BUCKET, 'object.bin', data)
+    monkeypatch.chdir(tmp_path)
+
+    aws.download(BUCKET, 'object.bin', 'object.bin')
+
+    assert (tmp_path / 'object.bin').read_bytes() == data
+    assert os.listdir(tmp_path) == ['object.bin']
+
+
+def test_download_many_assembles_every_file(fake, aws, tmp_path):
+    objects = {f'files/{i:02d}.bin': os.urandom(i * 700*1024) for i in range(12)}
+    for key, data in objects.items():
+        fake.put(BUCKET, key, data)
+
+    summary = aws.download_many(BUCKET, 'files/', str(tmp_path), part_size=5*MiB, max_workers=8, verify_md5=True)
+
+    assert not summary['failed']
+    for key, data in objects.items():
+        assert hashlib.md5((tmp_path / key[len('files/'):]).read_bytes()).digest() == hashlib.md5(data).digest()
@@ -0,0 +1,128 @@
+import csv
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import BUCKET
+
+
+def populate(fake, count):
+    for i in range(count):
+        fake.put(BUCKET, f'data/{i % 4}/{i:05d}.csv', b'id,name\n%d,x\n' % i)
+
+
+def read_index(path):
+    with open(path, newline='') as fin:
+        return list(csv.DictReader(fin))
+
+
+def fail_at(aws, row_number):
+    """makes the row_number-th get_obj_index call of aws raise"""
+    get_obj_index = aws.get_obj_index
+    calls = [0]
+    def failing(*args, **kwargs):
+        calls[0] += 1
+        if calls[0] == row_number:
+            raise RuntimeError('simulated failure')
+        return get_obj_index(*args, **kwargs)
+    aws.get_obj_index = failing
+    return get_obj_index
+
+
+@pytest.mark.parametrize('row_number', [1, 500, 1500, 2999])
+def test_resume_after_failure(fake, aws, tmp_path, row_number):
+    populate(fake, 3000)
+    path, checkpoint_path = tmp_path / 'index.csv', str(tmp_path / 'checkpoint.json')
+
+    get_obj_index = fail_at(aws, row_number)
+    with pytest.raises(RuntimeError):
+        with open(path, 'w', newline='') as fout:
+            aws.get_file_index(BUCKET, 'data/', fout=fout, checkpoint_path=checkpoint_path, max_workers=4)
+    aws.get_obj_index = get_obj_index
+
+    with open(path, 'a', newline='') as fout:
+        aws.get_file_index(BUCKET, 'data/', fout=fout, checkpoint_path=checkpoint_path, max_workers=4, keep_index=False)
+
+    assert [row['key'] for row in read_index(path)] == aws.list_keys(BUCKET, 'data/')
+    with open(path) as fin:
+        assert fin.read().count('key,sizebyte') == 1
+    assert not os.path.exists(checkpoint_path)
+
+
+def test_previous_index_diff(fake, aws, tmp_path):
+    populate(fake, 2500)
+    previous_path = tmp_path / 'previous.csv'
+    with open(previous_path, 'w', newline='') as fout:
+        aws.get_file_index(BUCKET, 'data/', fout=fout, get_column_names=True, include_etag=True, keep_index=False, max_workers=4)
+
+    fake.put(BUCKET, 'data/0/00000.csv', b'id,name,extra\n1,x,y\n') #changed
+    fake.put(BUCKET, 'data/1/00001a.csv', b'a,b\n') #added
+    fake.put(BUCKET, 'data/9/new.csv', b'c\n') #added, after every previous key
+    fake.delete(BUCKET, 'data/2/00002.csv') #removed
+    fake.delete(BUCKET, 'data/3/02499.csv') #removed, and the last previous key
+
+    fake.reset_counters()
+    diff = io.StringIO()
+    index = aws.get_file_index(BUCKET, 'data/', get_column_names=True, previous_index=str(previous_path), diff_fout=diff, max_workers=4)
+
+    assert [row['key'] for row in index] == aws.list_keys(BUCKET, 'data/')
+    changes = {row['key']: row['change'] for row in csv.DictReader(io.StringIO(diff.getvalue()))}
+    assert changes == {'data/0/00000.csv': 'changed', 'data/1/00001a.csv': 'added', 'data/9/new.csv': 'added',
+                       'data/2/00002.csv': 'removed', 'data/3/02499.csv': 'removed'}
+    assert {row['key']: row['column names'] for row in index}['data/0/00000.csv'] == 'id,name,extra'
+    #only the changed and added objects had their column names read
+    assert fake.requests['GetObject'] == 3
+
+
+def test_previous_index_needs_etags(fake, aws, tmp_path):
+    populate(fake, 10)
+    previous_path = tmp_path / 'previous.csv'
+    with open(previous_path, 'w', newline='') as fout:
+        aws.get_file_index(BUCKET, 'data/', fout=fout, keep_index=False)
+
+    with pytest.raises(ValueError, match='etag'):
+        aws.get_file_index(BUCKET, 'data/', previous_index=str(previous_path))
+    with pytest.raises(ValueError, match='etag'):
+        next(aws.iter_file_index(BUCKET, 'data/', previous_index=str(previous_path)))
+
+
+class UnseekableOutput(io.StringIO):
+    def seekable(self):
+        return False
+
+
+def test_checkpoint_needs_seekable_output(fake, aws, tmp_path):
+    populate(fake, 10)
+    fout = UnseekableOutput()
+    with pytest.raises(ValueError, match='seekable'):
+        aws.get_file_index(BUCKET, 'data/', fout=fout, checkpoint_path=str(tmp_path / 'checkpoint.json'))
+    assert fout.getvalue() == ''
+
+
+def test_column_names_are_read_on_a_pool(fake, aws):
+    populate(fake, 40)
+    get_column_names = aws.get_column_names
+    in_flight, most = [0], [0]
+    lock = threading.Lock()
+    def counting(*args, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            most[0] = max(most[0], in_flight[0])
+        time.sleep(0.01)
+        try:
+            return get_column_names(*args, **kwargs)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+    aws.get_column_names = counting
+
+    index = aws.get_file_index(BUCKET, 'data/', get_column_names=True) #max_workers=1 only lists serially
+    assert [row['column names'] for row in index] == ['id,name'] * 40
+    assert most[0] > 1
+
+    most[0] = 0
+    aws.get_file_index(BUCKET, 'data/', get_column_names=True, column_workers=1)
+    assert most[0] == 1
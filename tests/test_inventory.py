@@ -0,0 +1,62 @@
+import gzip
+import io
+import json
+import time
+import urllib.parse
+
+from conftest import BUCKET
+
+INVENTORY = 'ez-aws-inventory'
+
+
+def write_inventory(fake, objects, files=2):
+    """writes a gzipped CSV inventory report of objects ({key: data}) in files data files, and returns its manifest path"""
+    fake.create_bucket(INVENTORY)
+    keys = list(objects)
+    manifest = {'sourceBucket': BUCKET, 'destinationBucket': 'arn:aws:s3:::' + INVENTORY, 'fileFormat': 'CSV',
+                'fileSchema': 'Bucket, Key, Size, LastModifiedDate, ETag', 'files': [],
+                'creationTimestamp': str(int(time.time() * 1000))}
+    for number in range(files):
+        rows = io.StringIO()
+        for key in keys[number::files]: #not in key order
+            rows.write(f'"{BUCKET}","{urllib.parse.quote_plus(key)}","{len(objects[key])}","2024-01-01T00:00:00.000Z","etag{len(key)}"\n')
+        data_key = f'inventory/data/{number}.csv.gz'
+        fake.put(INVENTORY, data_key, gzip.compress(rows.getvalue().encode()))
+        manifest['files'].append({'key': data_key})
+    fake.put(INVENTORY, 'inventory/manifest.json', json.dumps(manifest).encode())
+    return f's3://{INVENTORY}/inventory/manifest.json'
+
+
+def test_index_from_inventory(fake, aws):
+    objects = {f'data/{name}_{i:03d}.csv': b'a,b\n' for i in range(50) for name in ['plain', 'with space', 'plus+sign', 'ünï']}
+    manifest_path = write_inventory(fake, objects)
+
+    fake.reset_counters()
+    index = aws.get_file_index(BUCKET, 'data/', inventory_manifest=manifest_path, max_workers=2)
+
+    assert [row['key'] for row in index] == sorted(objects) #URL-decoded, and merged into key order
+    assert fake.requests['ListObjectsV2'] == 0
+
+
+def test_inventory_merged_with_live_prefixes(fake, aws):
+    objects = {f'data/{part}/{i:03d}.csv': b'a,b\n' for i in range(20) for part in ['old', 'live']}
+    for key, data in objects.items():
+        fake.put(BUCKET, key, data)
+    time.sleep(0.01) #creationTimestamp is in milliseconds
+    manifest_path = write_inventory(fake, objects)
+    time.sleep(0.01)
+
+    fake.put(BUCKET, 'data/live/005.csv', b'a,b,c,d\n') #changed since the report
+    fake.put(BUCKET, 'data/live/new one.csv', b'x\n') #added since the report
+    fake.put(BUCKET, 'data/old/new.csv', b'x\n') #added, but outside live_prefixes
+    fake.delete(BUCKET, 'data/live/007.csv') #deleted since the report, so still in it
+
+    fake.reset_counters()
+    rows = list(aws.iter_file_index(BUCKET, 'data/', inventory_manifest=manifest_path, live_prefixes=['data/live/'], include_etag=True))
+
+    expected = sorted(set(objects) | {'data/live/new one.csv'})
+    assert [row['key'] for row in rows] == expected
+    by_key = {row['key']: row for row in rows}
+    assert by_key['data/live/005.csv']['sizebyte'] == 8
+    assert by_key['data/live/005.csv']['etag'].startswith('"') and by_key['data/live/006.csv']['etag'] == '"etag17"'
+    assert fake.requests['ListObjectsV2'] == 1 #only the live prefix was listed
@@ -0,0 +1,128 @@
+import pytest
+
+from conftest import BUCKET
+
+
+def flat_keys():
+    return [f'file_{i:05d}.csv' for i in range(2500)]
+
+def nested_keys():
+    return [f'data/year={2000 + i % 5}/month={i % 12:02d}/part-{i:05d}.csv' for i in range(3000)]
+
+def mixed_keys():
+    #objects next to prefixes, and names that sort around the delimiter ('-' and '.' sort before '/', '_' after it)
+    keys = ['logs', 'logs-2020.txt', 'logs.txt', 'logs_old', 'top.csv', 'z']
+    keys += [f'logs/{i % 3}/{i:05d}.gz' for i in range(1200)]
+    keys += [f'logs-{i % 4}/{i:05d}' for i in range(800)]
+    keys += [f'deep/{i % 2}/{i % 3}/{i % 5}/{i:05d}' for i in range(900)]
+    keys += [f'flat_{i:05d}' for i in range(700)]
+    keys += [f'wide/{i:05d}.csv' for i in range(2500)] #more than a page in one directory, so it's split by key ranges
+    return keys
+
+def unicode_keys():
+    names = ['é', 'ñandú', '日本', 'données', 'emoji_😀', 'Ω', 'a b', 'plus+sign']
+    keys = [f'{names[i % len(names)]}/{names[i // 7 % len(names)]}_{i:05d}.txt' for i in range(2600)]
+    return keys + [f'日本/ファイル_{i:05d}' for i in range(1500)]
+
+def wide_shallow_keys():
+    #many small directories, more than a page of them
+    return [f'dir{i:05d}/part-{j}.csv' for i in range(3000) for j in range(2)]
+
+def counter_keys():
+    #zero-padded counters, where one range of the first split holds most of the keys
+    return [f'events/{i:07d}' for i in range(20000)]
+
+LAYOUTS = {'flat': flat_keys, 'nested': nested_keys, 'mixed': mixed_keys, 'unicode': unicode_keys,
+           'wide_shallow': wide_shallow_keys, 'counter': counter_keys}
+
+
+def populate(fake, keys):
+    for key in keys:
+        fake.put(BUCKET, key, b'x')
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+@pytest.mark.parametrize('max_workers', [4, 16])
+def test_parallel_listing_matches_serial(fake, aws, layout, max_workers):
+    keys = LAYOUTS[layout]()
+    populate(fake, keys)
+
+    serial = aws.list_keys(BUCKET, max_workers=1)
+    assert serial == sorted(keys)
+    assert aws.list_keys(BUCKET, max_workers=max_workers) == serial
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+@pytest.mark.parametrize('start_after_index', [0, 1, 1234, -2, -1])
+def test_parallel_listing_with_start_after(fake, aws, layout, start_after_index):
+    keys = sorted(LAYOUTS[layout]())
+    populate(fake, keys)
+    start_after = keys[start_after_index]
+
+    expected = [key for key in keys if key > start_after]
+    for max_workers in [1, 8]:
+        listed = [obj['Key'] for obj in aws.iter_objects(BUCKET, max_workers=max_workers, start_after=start_after)]
+        assert listed == expected
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_parallel_listing_with_start_after_between_keys(fake, aws, layout):
+    keys = sorted(LAYOUTS[layout]())
+    populate(fake, keys)
+
+    for start_after in [keys[700] + '\0', keys[1500][:-1], keys[2000].split('/')[0], '']:
+        expected = [key for key in keys if key > start_after]
+        listed = [obj['Key'] for obj in aws.iter_objects(BUCKET, max_workers=8, start_after=start_after or None)]
+        assert listed == expected, start_after
+
+
+@pytest.mark.parametrize('layout, prefix', [('flat', 'file_01'), ('nested', 'data/year=2003/'), ('nested', 'data/year=200'),
+                                            ('mixed', 'logs'), ('mixed', 'logs/'), ('mixed', 'deep/1/'), ('unicode', 'é/'),
+                                            ('unicode', '日'), ('mixed', 'missing/')])
+def test_parallel_listing_of_prefix(fake, aws, layout, prefix):
+    keys = LAYOUTS[layout]()
+    populate(fake, keys)
+
+    expected = sorted(key for key in keys if key.startswith(prefix))
+    assert aws.list_keys(BUCKET, prefix, max_workers=1) == expected
+    assert aws.list_keys(BUCKET, prefix, max_workers=8) == expected
+    if expected:
+        start_after = expected[len(expected) // 3]
+        listed = [obj['Key'] for obj in aws.iter_objects(BUCKET, prefix, max_workers=8, start_after=start_after)]
+        assert listed == [key for key in expected if key > start_after]
+
+
+def test_parallel_listing_returns_every_object_field(fake, aws):
+    populate(fake, nested_keys())
+    serial = list(aws.iter_objects(BUCKET, max_workers=1))
+    parallel = list(aws.iter_objects(BUCKET, max_workers=8))
+    assert [(obj['Key'], obj['Size'], obj['ETag']) for obj in parallel] == [(obj['Key'], obj['Size'], obj['ETag']) for obj in serial]
+
+
+@pytest.mark.parametrize('layout', ['wide_shallow', 'counter'])
+@pytest.mark.parametrize('max_workers', [4, 16])
+def test_parallel_listing_requests(fake, aws, layout, max_workers):
+    populate(fake, LAYOUTS[layout]())
+    aws.list_keys(BUCKET, max_workers=1)
+    serial = fake.requests['ListObjectsV2']
+
+    fake.reset_counters()
+    aws.list_keys(BUCKET, max_workers=max_workers)
+    #a few requests per shard of the plan (4*max_workers shards) at most, not one per directory
+    assert fake.requests['ListObjectsV2'] <= serial + 2 * 4 * max_workers
+
+
+def test_large_shards_are_split_again(fake, aws, monkeypatch):
+    populate(fake, counter_keys())
+    collect_shard = aws._collect_shard
+    listed = []
+    def recording(*args, **kwargs):
+        pages, rest = collect_shard(*args, **kwargs)
+        listed.append(sum(len(page) for page in pages))
+        return pages, rest
+    monkeypatch.setattr(aws, '_collect_shard', recording)
+
+    assert aws.list_keys(BUCKET, max_workers=8) == counter_keys()
+    #no shard is listed to its end serially: the big ones are split again after a few pages
+    assert max(listed) <= 4000
+    assert len(listed) > 8
@@ -0,0 +1,62 @@
+from conftest import BUCKET
+from ez_aws import AWS, MetadataCache
+
+
+def test_hits_only_for_the_same_version(tmp_path):
+    with MetadataCache(str(tmp_path)) as cache:
+        cache.put('bucket', 'a.csv', '"etag1"', 10, {'key': 'a.csv', 'column names': 'x,y'})
+
+        assert cache.get('bucket', 'a.csv', '"etag1"', 10) == {'key': 'a.csv', 'column names': 'x,y'}
+        assert cache.get('bucket', 'a.csv', '"etag2"', 10) == None
+        assert cache.get('bucket', 'a.csv', '"etag1"', 11) == None
+        assert cache.get('other', 'a.csv', '"etag1"', 10) == None
+
+        cache.put('bucket', 'a.csv', '"etag2"', 12, {'key': 'a.csv', 'column names': 'z'}) #replaces the old version
+        assert cache.get('bucket', 'a.csv', '"etag1"', 10) == None
+        assert cache.get('bucket', 'a.csv', '"etag2"', 12) == {'key': 'a.csv', 'column names': 'z'}
+        assert cache.stats() == {'hits': 2, 'misses': 4, 'evictions': 0, 'entries': 1}
+
+
+def test_evicts_least_recently_used(tmp_path):
+    with MetadataCache(str(tmp_path), max_entries=10) as cache:
+        for i in range(10):
+            cache.put('bucket', f'{i}.csv', 'etag', i, {'i': i})
+        assert cache.get('bucket', '0.csv', 'etag', 0) == {'i': 0} #now the most recently used
+        cache.put('bucket', '10.csv', 'etag', 10, {'i': 10})
+
+        #down to 90% of max_entries: the two least recently used are gone
+        assert cache.stats()['entries'] == 9 and cache.stats()['evictions'] == 2
+        assert cache.get('bucket', '1.csv', 'etag', 1) == None and cache.get('bucket', '2.csv', 'etag', 2) == None
+        assert cache.get('bucket', '0.csv', 'etag', 0) == {'i': 0}
+        assert cache.get('bucket', '10.csv', 'etag', 10) == {'i': 10}
+
+
+def test_writes_are_committed_in_batches(tmp_path):
+    cache = MetadataCache(str(tmp_path), commit_every=100, commit_interval=3600)
+    cache.put('bucket', 'a.csv', 'etag', 1, {'key': 'a.csv'})
+    with MetadataCache(str(tmp_path)) as other:
+        assert other.get('bucket', 'a.csv', 'etag', 1) == None #not committed yet
+        cache.flush()
+        assert other.get('bucket', 'a.csv', 'etag', 1) == {'key': 'a.csv'}
+    cache.close()
+    cache.close() #closing twice is fine
+
+
+def test_file_index_reads_column_names_once(fake, aws, tmp_path):
+    for i in range(20):
+        fake.put(BUCKET, f'data/{i:02d}.csv', b'id,name\n1,x\n')
+    cached = AWS(session=aws.session, metadata_cache=MetadataCache(str(tmp_path), commit_every=1000, commit_interval=3600))
+
+    first = cached.get_file_index(BUCKET, 'data/', get_column_names=True)
+    assert fake.requests['GetObject'] == 20
+
+    fake.reset_counters()
+    fake.put(BUCKET, 'data/05.csv', b'a,b,c\n1,2,3\n')
+    second = cached.get_file_index(BUCKET, 'data/', get_column_names=True)
+    assert fake.requests['GetObject'] == 1 #only the changed object
+    assert [row['column names'] for row in second] == [row['column names'] for row in first[:5]] + ['a,b,c'] + [row['column names'] for row in first[6:]]
+
+    #flushed at the end of get_file_index, so another cache on the same file sees the rows
+    with MetadataCache(str(tmp_path)) as other:
+        assert other.stats()['entries'] == 20
+    cached.metadata_cache.close()
@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import BUCKET
+from ez_aws import ObjectIndex
+
+
+SIZES = {'a/x/1': 10, 'a/x/2': 20, 'a/y/1': 300, 'a/top': 4000, 'b/1': 0, 'b/ü/2': 1025, 'c': 7}
+
+
+@pytest.fixture
+def index(fake, aws):
+    for key, size in SIZES.items():
+        fake.put(BUCKET, key, b'x' * size)
+    return aws.get_object_index(BUCKET, max_workers=4)
+
+
+def test_lookups(index):
+    assert len(index) == len(SIZES)
+    assert [row['key'] for row in index] == sorted(SIZES)
+    assert 'a/x/1' in index and 'a/x' not in index
+    row = index.get('b/ü/2')
+    assert row['sizebyte'] == 1025 and row['etag'].startswith('"') and row['last_modified'] != None
+    assert index.get('missing') == None
+
+
+def test_du(index):
+    assert index.totals() == {'count': 7, 'sizebyte': sum(SIZES.values())}
+    assert index.totals('a/x/') == {'count': 2, 'sizebyte': 30}
+    assert index.du() == {'a/': {'count': 4, 'sizebyte': 4330}, 'b/': {'count': 2, 'sizebyte': 1025}, 'c': {'count': 1, 'sizebyte': 7}}
+    assert index.du('a/', depth=2) == {'a/top': {'count': 1, 'sizebyte': 4000}, 'a/x/1': {'count': 1, 'sizebyte': 10},
+                                       'a/x/2': {'count': 1, 'sizebyte': 20}, 'a/y/1': {'count': 1, 'sizebyte': 300}}
+    assert index.du('a/') == {'a/top': {'count': 1, 'sizebyte': 4000}, 'a/x/': {'count': 2, 'sizebyte': 30},
+                              'a/y/': {'count': 1, 'sizebyte': 300}}
+    assert index.du('a/', depth=0) == {'a/': {'count': 4, 'sizebyte': 4330}}
+
+
+def test_largest_and_histogram(index):
+    assert [row['key'] for row in index.largest(3)] == ['a/top', 'b/ü/2', 'a/y/1']
+    assert [row['key'] for row in index.largest(2, prefix='a/x/')] == ['a/x/2', 'a/x/1']
+    assert index.size_histogram() == {1: {'count': 1, 'sizebyte': 0}, 8: {'count': 1, 'sizebyte': 7}, 16: {'count': 1, 'sizebyte': 10},
+                                      32: {'count': 1, 'sizebyte': 20}, 512: {'count': 1, 'sizebyte': 300},
+                                      2048: {'count': 1, 'sizebyte': 1025}, 4096: {'count': 1, 'sizebyte': 4000}}
+    assert index.size_histogram('b/') == {1: {'count': 1, 'sizebyte': 0}, 2048: {'count': 1, 'sizebyte': 1025}}
+
+
+def test_save_and_load(index, tmp_path):
+    path = str(tmp_path / 'index.bin')
+    index.save(path)
+
+    with ObjectIndex.load(path) as loaded:
+        assert loaded.bucket_name == BUCKET
+        assert list(loaded) == list(index)
+        assert loaded.du('a/', depth=2) == index.du('a/', depth=2)
+        assert loaded.largest(3) == index.largest(3)
+        assert loaded.size_histogram() == index.size_histogram()
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'not an index at all')
+    with pytest.raises(ValueError):
+        ObjectIndex.load(str(path))
+
+
+def test_from_objects_sorts_keys():
+    index = ObjectIndex.from_objects([{'Key': 'b', 'Size': 2}, {'Key': 'a', 'Size': 1}, {'Key': 'c/d', 'Size': 3}])
+    assert [row['key'] for row in index] == ['a', 'b', 'c/d']
+    assert index.totals('c/') == {'count': 1, 'sizebyte': 3}
@@ -0,0 +1,105 @@
+import gzip
+import os
+
+import pytest
+
+from conftest import BUCKET
+
+MiB = 1024*1024
+
+
+def read_object(aws, key):
+    return aws.s3_client.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+
+#parts are whole 4 MiB blocks, at least part_size each (the last one may be smaller)
+@pytest.mark.parametrize('size, parts', [(100, 0), (5*MiB, 1), (12*MiB + 123, 2)])
+def test_multipart_writer_completes(fake, aws, size, parts):
+    data = os.urandom(size)
+    with aws.open(BUCKET, 'out.bin', mode='wb', parallel_write=True, part_size=5*MiB, max_workers=4) as fout:
+        for start in range(0, size, 300*1024):
+            fout.write(data[start:start + 300*1024])
+
+    assert read_object(aws, 'out.bin') == data
+    assert fake.requests['UploadPart'] == parts
+    assert fake.requests['CompleteMultipartUpload'] == (1 if parts else 0)
+    assert fake.requests['PutObject'] == (0 if parts else 1)
+
+
+def test_multipart_writer_compresses_blocks(fake, aws):
+    data = b''.join(b'%d,row,%d\n' % (i, i*7) for i in range(1000000))
+    with aws.open(BUCKET, 'out.csv.gz', mode='wb', decompress=True, parallel_write=True, part_size=5*MiB) as fout:
+        fout.write(data)
+
+    assert gzip.decompress(read_object(aws, 'out.csv.gz')) == data
+    assert fout.stats()['bytes_written'] == len(data)
+
+
+@pytest.mark.parametrize('mode', ['wb', 'w'])
+def test_multipart_writer_aborts_on_error(fake, aws, mode):
+    chunk = os.urandom(6*MiB) if mode == 'wb' else 'x' * (6*MiB)
+    with pytest.raises(RuntimeError):
+        with aws.open(BUCKET, 'out.bin', mode=mode, parallel_write=True, part_size=5*MiB) as fout:
+            fout.write(chunk)
+            fout.write(chunk) #a part has been uploaded by now
+            raise RuntimeError('simulated failure')
+
+    assert fake.requests['UploadPart'] >= 1
+    assert fake.requests['AbortMultipartUpload'] == 1
+    assert fake.requests['CompleteMultipartUpload'] == 0
+    assert aws.list_keys(BUCKET) == []
+
+
+def test_multipart_text_writer_completes(fake, aws):
+    lines = [f'{i},ñame_{i}\n' for i in range(400000)]
+    with aws.open(BUCKET, 'out.csv', mode='w', parallel_write=True, part_size=5*MiB) as fout:
+        fout.writelines(lines)
+
+    assert read_object(aws, 'out.csv').decode('utf-8') == ''.join(lines)
+    assert fake.requests['CompleteMultipartUpload'] == 1
+
+
+def test_block_reader_seeks_back_into_the_cache(fake, aws):
+    data = os.urandom(10*1024 + 100) #11 blocks
+    fake.put(BUCKET, 'in.bin', data)
+    with aws.open(BUCKET, 'in.bin', block_cache=True, block_size=1024, cache_blocks=4, prefetch_blocks=0) as fin:
+        reader = fin.block_reader
+        fin.seek(-100, os.SEEK_END)
+        assert fin.read() == data[-100:]
+        fin.seek(0)
+        assert fin.read(1500) == data[:1500]
+        fin.seek(10*1024 + 50) #the last block, still cached
+        assert fin.read(10) == data[10*1024 + 50:10*1024 + 60]
+
+        assert reader.stats()['requests'] == 1 + 3
+        assert reader.stats()['cache_hits'] == 1 and reader.stats()['cache_misses'] == 3
+        assert reader.stats()['bytes_fetched'] == 100 + 2*1024
+
+        fin.seek(0)
+        assert fin.read() == data
+        fin.seek(0) #the first block was evicted by the scan
+        assert fin.read(10) == data[:10]
+        assert reader.stats()['requests'] == 1 + 3 + 9 + 1
+    assert fake.requests['HeadObject'] == 1 and fake.requests['GetObject'] == 13
+
+
+def test_block_reader_prefetches_sequential_reads(fake, aws):
+    data = os.urandom(50*1024)
+    fake.put(BUCKET, 'in.bin', data)
+    with aws.open(BUCKET, 'in.bin', block_cache=True, block_size=1024, prefetch_blocks=4) as fin:
+        chunks = iter(lambda: fin.read(700), b'')
+        assert b''.join(chunks) == data
+        stats = fin.block_reader.stats()
+    #every block fetched once, almost all of them ahead of the reader
+    assert stats['bytes_fetched'] == len(data) and stats['requests'] == 1 + 50
+    assert stats['cache_misses'] <= 2 and stats['cache_hits'] >= 48
+
+
+def test_block_reader_fails_on_a_changed_object(fake, aws):
+    fake.put(BUCKET, 'in.bin', os.urandom(4096))
+    with aws.open(BUCKET, 'in.bin', block_cache=True, block_size=1024, prefetch_blocks=0) as fin:
+        fin.read(10)
+        fake.put(BUCKET, 'in.bin', os.urandom(4096))
+        fin.seek(3000)
+        with pytest.raises(Exception, match='PreconditionFailed'):
+            fin.read(10)
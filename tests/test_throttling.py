@@ -0,0 +1,30 @@
+import concurrent.futures
+
+import boto3
+
+from conftest import BUCKET
+from ez_aws import AWS, MetricsCollector
+from fake_s3 import FakeS3
+
+
+def test_throttled_requests_are_retried_and_lower_the_limit():
+    fake = FakeS3(throttle_rate=0.1)
+    fake.create_bucket(BUCKET)
+    for i in range(300):
+        fake.put(BUCKET, f'data/{i:05d}', b'x' * i)
+    session = boto3.Session(aws_access_key_id='test', aws_secret_access_key='test', region_name='us-east-1')
+    fake.attach(session)
+    metrics = MetricsCollector()
+    aws = AWS(session=session, metrics=metrics)
+
+    keys = aws.list_keys(BUCKET, 'data/', max_workers=4)
+    with concurrent.futures.ThreadPoolExecutor(16) as pool:
+        sizes = list(pool.map(lambda key: aws.s3_client.head_object(Bucket=BUCKET, Key=key)['ContentLength'], keys))
+
+    assert sizes == list(range(300))
+    assert fake.throttled > 0
+    totals = metrics.snapshot()['other']['HeadObject']
+    assert totals['errors'] == 0
+    assert totals['retries'] == totals['throttles'] > 0
+    limiter = aws.concurrency.stats()[(BUCKET, 'data')]
+    assert limiter['throttles'] > 0 and limiter['limit'] < 64
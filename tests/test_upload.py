@@ -0,0 +1,40 @@
+from conftest import BUCKET
+
+
+def write_files(tmp_path, keys, data=b'same'):
+    files = []
+    for key in keys:
+        path = tmp_path / key.replace('/', '_')
+        path.write_bytes(data)
+        files.append((key, str(path)))
+    return files
+
+
+def test_upload_many_skips_existing_without_listing_the_bucket(fake, aws, tmp_path):
+    for i in range(3000):
+        fake.put(BUCKET, f'other/{i:05d}', b'x') #not to be listed
+    fake.put(BUCKET, 'top.txt', b'same')
+    fake.put(BUCKET, 'a/one.txt', b'same')
+    fake.put(BUCKET, 'b/two.txt', b'old')
+    files = write_files(tmp_path, ['top.txt', 'a/one.txt', 'b/two.txt', 'c/three.txt'])
+
+    summary = aws.upload_many(BUCKET, files, max_workers=4, skip_existing=True)
+
+    assert summary['skipped'] == 2 and summary['uploaded'] == 2 and not summary['failed']
+    assert fake.requests['HeadObject'] == 4
+    assert fake.requests['ListObjectsV2'] == 0
+
+
+def test_upload_many_lists_the_parents_of_many_keys(fake, aws, tmp_path):
+    keys = [f'many/{i:03d}.txt' for i in range(50)]
+    for key in keys[:30]:
+        fake.put(BUCKET, key, b'same')
+    for i in range(3000):
+        fake.put(BUCKET, f'many/sub/{i:05d}', b'x') #under the parent, but in a sub-prefix
+    files = write_files(tmp_path, keys)
+
+    summary = aws.upload_many(BUCKET, files, max_workers=4, skip_existing=True)
+
+    assert summary['skipped'] == 30 and summary['uploaded'] == 20
+    assert fake.requests['ListObjectsV2'] == 1
+    assert fake.requests['HeadObject'] == 0